@@ -32,6 +32,18 @@ class APIConfig:
                 logging.warning("vLLM not installed, falling back to HuggingFace engine")
                 self.llm_engine = "hf"
     fp16_flow: bool = os.getenv("FP16_FLOW", "false").lower() == "true"
+    device: str = os.getenv("DEVICE", "auto")  # auto, cpu, cuda, cuda:N
+    num_threads: int = int(os.getenv("NUM_THREADS", "0"))  # CPU推理线程数，0为torch默认
+    cpu_dtype: str = os.getenv("CPU_DTYPE", "float32")  # CPU推理精度: float32 或 bfloat16
+    flow_solver: str = os.getenv("FLOW_SOLVER", "euler")  # flow ODE求解器: euler, heun, midpoint, rk4, dpm_multistep
+    flow_n_timesteps: int = int(os.getenv("FLOW_STEPS", "15"))  # flow ODE步数
+    flow_cfg_interval: tuple = tuple(float(x) for x in os.getenv("FLOW_CFG_INTERVAL", "0.0,1.0").split(","))  # 施加CFG的flow时间区间
+    flow_cfg_stride: int = int(os.getenv("FLOW_CFG_STRIDE", "1"))  # 区间内每隔n步施加一次CFG
+    flow_cfg_reuse: bool = os.getenv("FLOW_CFG_REUSE", "false").lower() == "true"  # 未施加CFG的步复用上次的引导差值
+    flow_deep_cache_interval: int = int(os.getenv("FLOW_DEEP_CACHE_INTERVAL", "1"))  # 每隔n次估计器调用才重算深层特征，1为关闭
+    feature_store_dir: Optional[str] = os.getenv("FEATURE_STORE_DIR") or None  # 参考音频特征的磁盘缓存目录，未设置时仅缓存在内存中
+    campplus_sessions: int = int(os.getenv("CAMPPLUS_SESSIONS", "4"))  # 说话人向量(CAM++)的ONNX会话池大小，不同请求与说话人并发提取
+    campplus_threads: int = int(os.getenv("CAMPPLUS_THREADS", "1"))  # 每个CAM++会话的线程数
 
     # 服务配置
     host: str = os.getenv("API_HOST", "0.0.0.0")
@@ -43,6 +55,8 @@ class APIConfig:
     output_dir: Path = Path("api/outputs")
     max_upload_size: int = 100 * 1024 * 1024  # 100MB
     file_cleanup_minutes: int = 30  # 文件过期时间（分钟）
+    speaker_dir: Path = Path(os.getenv("SPEAKER_DIR", "api/registered_speakers"))  # 已注册说话人的音频与元数据目录，不会被定期清理
+    max_speakers: int = int(os.getenv("MAX_SPEAKERS", "256"))  # 最多注册的说话人数量
 
     # 并发控制
     max_concurrent_tasks: int = int(os.getenv("MAX_CONCURRENT_TASKS", "2"))
@@ -4,13 +4,17 @@ FastAPI Main Application for SoulX-Podcast Voice Cloning API
 import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import List
+from typing import List, Optional, Tuple
 import json
+import queue
+import struct
 import threading
 
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+import numpy as np
 import torch
 import scipy.io.wavfile as wavfile
 
@@ -20,6 +24,7 @@ from api.models import (
     TaskStatusResponse,
     HealthResponse,
     ErrorResponse,
+    SpeakerInfo,
     TaskStatus,
 )
 from api.service import get_service
@@ -138,11 +143,139 @@ async def health_check():
     )
 
 
+def _speaker_info(speaker, features=None) -> SpeakerInfo:
+    """已注册说话人 -> 响应模型"""
+    num_prompt_tokens = None
+    if features is not None and features.speech_tokens is not None:
+        num_prompt_tokens = len(features.speech_tokens)
+    return SpeakerInfo(
+        speaker_id=speaker.speaker_id,
+        prompt_text=speaker.prompt_text,
+        num_prompt_tokens=num_prompt_tokens,
+        created_at=speaker.created_at,
+    )
+
+
+def _prepare_prompts(
+    task_id: str,
+    prompt_audio: Optional[List[UploadFile]],
+    prompt_text_list: Optional[List[str]],
+    speaker_ids: Optional[str],
+    dialogue_text: str,
+) -> Tuple[List[str], List[str], Optional[List[str]]]:
+    """
+    校验并准备参考音频：上传的音频文件与参考文本，或已注册说话人的 speaker_ids（JSON数组）
+
+    Returns:
+        Tuple[List[str], List[str], Optional[List[str]]]: (参考音频路径, 参考文本, 说话人ID)
+    """
+    if speaker_ids:
+        if prompt_audio:
+            raise HTTPException(status_code=400, detail="不能同时上传参考音频和指定speaker_ids")
+        try:
+            speaker_id_list = json.loads(speaker_ids)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"speaker_ids JSON格式错误: {str(e)}")
+        if not isinstance(speaker_id_list, list) or not all(isinstance(i, str) for i in speaker_id_list):
+            raise HTTPException(status_code=400, detail="speaker_ids必须是字符串JSON数组")
+        if not 1 <= len(speaker_id_list) <= 4:
+            raise HTTPException(status_code=400, detail="speaker_ids需要1-4个说话人")
+        service = get_service()
+        for speaker_id in speaker_id_list:
+            if service.speakers.get(speaker_id) is None:
+                raise HTTPException(status_code=404, detail=f"说话人不存在: {speaker_id}")
+        is_valid, error_msg = validate_dialogue_format(dialogue_text, len(speaker_id_list))
+        if not is_valid:
+            raise HTTPException(status_code=400, detail=error_msg)
+        return [], [], speaker_id_list
+
+    # 验证音频文件
+    validate_audio_files(prompt_audio)
+
+    if not isinstance(prompt_text_list, list):
+        raise HTTPException(status_code=400, detail="prompt_texts必须是JSON数组")
+
+    # 验证数量匹配
+    if len(prompt_audio) != len(prompt_text_list):
+        raise HTTPException(
+            status_code=400,
+            detail=f"参考音频数量({len(prompt_audio)})与参考文本数量({len(prompt_text_list)})不匹配"
+        )
+
+    # 验证对话格式
+    is_valid, error_msg = validate_dialogue_format(dialogue_text, len(prompt_audio))
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=error_msg)
+
+    # 保存上传的文件
+    audio_paths = []
+    for i, file in enumerate(prompt_audio):
+        path = save_upload_file(file, task_id, i)
+        audio_paths.append(str(path))
+    return audio_paths, prompt_text_list, None
+
+
+@app.post("/speakers", response_model=SpeakerInfo, tags=["Speakers"])
+async def register_speaker(
+    prompt_audio: UploadFile = File(..., description="参考音频文件"),
+    prompt_text: str = Form(..., description="参考音频对应的文本"),
+):
+    """
+    注册说话人（上传一次，之后按 speaker_id 合成）
+
+    预先计算参考音频特征与参考语音token，生成接口通过 speaker_ids 使用，无需再次上传音频。
+    同一音频与参考文本重复注册返回同一个 speaker_id。
+    """
+    validate_audio_files([prompt_audio])
+    path = save_upload_file(prompt_audio, generate_task_id(), 0)
+    try:
+        service = get_service()
+        loop = asyncio.get_event_loop()
+        speaker, features = await loop.run_in_executor(None, service.register_speaker, str(path), prompt_text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Speaker registration failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        path.unlink(missing_ok=True)
+
+    logger.info(f"Speaker registered: speaker_id={speaker.speaker_id}")
+    return _speaker_info(speaker, features)
+
+
+@app.get("/speakers", response_model=List[SpeakerInfo], tags=["Speakers"])
+async def list_speakers():
+    """列出已注册说话人"""
+    service = get_service()
+    return [_speaker_info(speaker, service.speakers.features.get(speaker.speaker_id))
+            for speaker in service.speakers.list()]
+
+
+@app.get("/speakers/{speaker_id}", response_model=SpeakerInfo, tags=["Speakers"])
+async def get_speaker(speaker_id: str):
+    """查询已注册说话人"""
+    service = get_service()
+    speaker = service.speakers.get(speaker_id)
+    if speaker is None:
+        raise HTTPException(status_code=404, detail="说话人不存在")
+    return _speaker_info(speaker, service.speakers.features.get(speaker_id))
+
+
+@app.delete("/speakers/{speaker_id}", tags=["Speakers"])
+async def delete_speaker(speaker_id: str):
+    """删除已注册说话人"""
+    if not get_service().speakers.delete(speaker_id):
+        raise HTTPException(status_code=404, detail="说话人不存在")
+    return {"speaker_id": speaker_id, "deleted": True}
+
+
 @app.post("/generate", tags=["Generation"])
 async def generate_sync(
-    prompt_audio: List[UploadFile] = File(..., description="参考音频文件（1-4个）"),
-    prompt_texts: List[str] = Form(..., description="参考文本JSON数组，如: [\"文本1\", \"文本2\"]"),
+    prompt_audio: Optional[List[UploadFile]] = File(None, description="参考音频文件（1-4个），使用speaker_ids时不上传"),
+    prompt_texts: Optional[List[str]] = Form(None, description="参考文本JSON数组，如: [\"文本1\", \"文本2\"]"),
     dialogue_text: str = Form(..., description="要生成的对话文本"),
+    speaker_ids: Optional[str] = Form(None, description="已注册说话人ID的JSON数组，替代参考音频与参考文本"),
     seed: int = Form(default=1988, description="随机种子"),
     temperature: float = Form(default=0.6, ge=0.1, le=2.0, description="采样温度"),
     top_k: int = Form(default=100, ge=1, le=500, description="Top-K采样"),
@@ -157,36 +290,11 @@ async def generate_sync(
     task_id = generate_task_id()
 
     try:
-        # 验证音频文件
-        validate_audio_files(prompt_audio)
-
-        # 解析prompt_texts
-        try:
-            prompt_text_list = prompt_texts
-            if not isinstance(prompt_text_list, list):
-                raise ValueError("prompt_texts必须是JSON数组")
-        except json.JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=f"prompt_texts JSON格式错误: {str(e)}")
-
-        # 验证数量匹配
-        if len(prompt_audio) != len(prompt_text_list):
-            raise HTTPException(
-                status_code=400,
-                detail=f"参考音频数量({len(prompt_audio)})与参考文本数量({len(prompt_text_list)})不匹配"
-            )
-
-        # 验证对话格式
-        is_valid, error_msg = validate_dialogue_format(dialogue_text, len(prompt_audio))
-        if not is_valid:
-            raise HTTPException(status_code=400, detail=error_msg)
-
-        # 保存上传的文件
-        audio_paths = []
-        for i, file in enumerate(prompt_audio):
-            path = save_upload_file(file, task_id, i)
-            audio_paths.append(str(path))
+        audio_paths, prompt_text_list, speaker_id_list = _prepare_prompts(
+            task_id, prompt_audio, prompt_texts, speaker_ids, dialogue_text
+        )
 
-        logger.info(f"Sync generation started: task_id={task_id}, speakers={len(audio_paths)}")
+        logger.info(f"Sync generation started: task_id={task_id}, speakers={len(speaker_id_list or audio_paths)}")
 
         # 调用服务生成
         service = get_service()
@@ -199,6 +307,7 @@ async def generate_sync(
             top_k=top_k,
             top_p=top_p,
             repetition_penalty=repetition_penalty,
+            speaker_ids=speaker_id_list,
         )
 
         # 保存结果
@@ -222,11 +331,41 @@ async def generate_sync(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/generate-async", response_model=TaskCreateResponse, tags=["Generation"])
-async def generate_async(
-    prompt_audio: List[UploadFile] = File(..., description="参考音频文件（1-4个）"),
-    prompt_texts: str = Form(..., description="参考文本JSON数组"),
+def _wav_stream_header(sample_rate: int) -> bytes:
+    """流式WAV头（16位单声道PCM），长度未知时按WAV流的惯例填最大值"""
+    byte_rate = sample_rate * 2
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, byte_rate, 2, 16)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+
+def _stream_worker(stream, chunks: queue.Queue, stop: threading.Event):
+    """
+    在独立线程中消费服务的生成器，音频逐块放入队列
+
+    生成器只在该线程中推进与关闭；stop 被设置（客户端断开）后在下一块处停止并关闭生成器，
+    从而停止推理并释放生成锁。队列以 None 结束。
+    """
+    try:
+        for _, wav, _ in stream:
+            if stop.is_set():
+                break
+            chunks.put(wav)
+    except Exception as e:
+        logger.error(f"Streaming generation failed: {e}", exc_info=True)
+        chunks.put(e)
+    finally:
+        stream.close()
+        chunks.put(None)
+
+
+@app.post("/generate-stream", tags=["Generation"])
+async def generate_stream(
+    prompt_audio: Optional[List[UploadFile]] = File(None, description="参考音频文件（1-4个），使用speaker_ids时不上传"),
+    prompt_texts: Optional[str] = Form(None, description="参考文本JSON数组"),
     dialogue_text: str = Form(..., description="要生成的对话文本"),
+    speaker_ids: Optional[str] = Form(None, description="已注册说话人ID的JSON数组，替代参考音频与参考文本"),
+    chunk_streaming: bool = Form(default=False, description="按语音token块返回音频，首包约在一个块后到达"),
     seed: int = Form(default=1988, description="随机种子"),
     temperature: float = Form(default=0.6, ge=0.1, le=2.0, description="采样温度"),
     top_k: int = Form(default=100, ge=1, le=500, description="Top-K采样"),
@@ -234,41 +373,87 @@ async def generate_async(
     repetition_penalty: float = Form(default=1.25, ge=1.0, le=2.0, description="重复惩罚"),
 ):
     """
-    异步生成语音（返回任务ID）
+    流式生成语音（边生成边返回16位PCM的WAV流）
 
-    适用于长音频生成或批量任务
+    每段对话（chunk_streaming 时每个语音token块）合成完成后立即发送，首包无需等待整段对话。
+    客户端断开后推理停止。
     """
     task_id = generate_task_id()
 
-    try:
-        # 验证音频文件
-        validate_audio_files(prompt_audio)
-
-        # 解析prompt_texts
+    prompt_text_list = None
+    if prompt_texts is not None:
         try:
             prompt_text_list = json.loads(prompt_texts)
-            if not isinstance(prompt_text_list, list):
-                raise ValueError("prompt_texts必须是JSON数组")
         except json.JSONDecodeError as e:
             raise HTTPException(status_code=400, detail=f"prompt_texts JSON格式错误: {str(e)}")
 
-        # 验证数量匹配
-        if len(prompt_audio) != len(prompt_text_list):
-            raise HTTPException(
-                status_code=400,
-                detail=f"参考音频数量({len(prompt_audio)})与参考文本数量({len(prompt_text_list)})不匹配"
-            )
+    audio_paths, prompt_text_list, speaker_id_list = _prepare_prompts(
+        task_id, prompt_audio, prompt_text_list, speaker_ids, dialogue_text
+    )
+    logger.info(f"Stream generation started: task_id={task_id}, speakers={len(speaker_id_list or audio_paths)}")
+
+    stream = get_service().generate_stream(
+        prompt_audio_paths=audio_paths,
+        prompt_texts=prompt_text_list,
+        dialogue_text=dialogue_text,
+        seed=seed,
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        repetition_penalty=repetition_penalty,
+        chunk_streaming=chunk_streaming,
+        speaker_ids=speaker_id_list,
+    )
 
-        # 验证对话格式
-        is_valid, error_msg = validate_dialogue_format(dialogue_text, len(prompt_audio))
-        if not is_valid:
-            raise HTTPException(status_code=400, detail=error_msg)
+    async def audio_chunks():
+        chunks, stop = queue.Queue(), threading.Event()
+        threading.Thread(target=_stream_worker, args=(stream, chunks, stop), daemon=True).start()
+        try:
+            yield _wav_stream_header(24000)
+            while True:
+                wav = await run_in_threadpool(chunks.get)
+                if wav is None or isinstance(wav, Exception):
+                    break
+                yield (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+            logger.info(f"Stream generation completed: task_id={task_id}")
+        finally:
+            # 客户端断开或生成结束，通知工作线程停止
+            stop.set()
+
+    return StreamingResponse(audio_chunks(), media_type="audio/wav")
+
+
+@app.post("/generate-async", response_model=TaskCreateResponse, tags=["Generation"])
+async def generate_async(
+    prompt_audio: Optional[List[UploadFile]] = File(None, description="参考音频文件（1-4个），使用speaker_ids时不上传"),
+    prompt_texts: Optional[str] = Form(None, description="参考文本JSON数组"),
+    dialogue_text: str = Form(..., description="要生成的对话文本"),
+    speaker_ids: Optional[str] = Form(None, description="已注册说话人ID的JSON数组，替代参考音频与参考文本"),
+    seed: int = Form(default=1988, description="随机种子"),
+    temperature: float = Form(default=0.6, ge=0.1, le=2.0, description="采样温度"),
+    top_k: int = Form(default=100, ge=1, le=500, description="Top-K采样"),
+    top_p: float = Form(default=0.9, ge=0.0, le=1.0, description="Top-P采样"),
+    repetition_penalty: float = Form(default=1.25, ge=1.0, le=2.0, description="重复惩罚"),
+):
+    """
+    异步生成语音（返回任务ID）
 
-        # 保存上传的文件
-        audio_paths = []
-        for i, file in enumerate(prompt_audio):
-            path = save_upload_file(file, task_id, i)
-            audio_paths.append(str(path))
+    适用于长音频生成或批量任务
+    """
+    task_id = generate_task_id()
+
+    try:
+        # 解析prompt_texts
+        prompt_text_list = None
+        if prompt_texts is not None:
+            try:
+                prompt_text_list = json.loads(prompt_texts)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=400, detail=f"prompt_texts JSON格式错误: {str(e)}")
+
+        audio_paths, prompt_text_list, speaker_id_list = _prepare_prompts(
+            task_id, prompt_audio, prompt_text_list, speaker_ids, dialogue_text
+        )
 
         # 创建异步任务
         task_manager = get_task_manager()
@@ -282,6 +467,7 @@ async def generate_async(
             top_k=top_k,
             top_p=top_p,
             repetition_penalty=repetition_penalty,
+            speaker_ids=speaker_id_list,
         )
 
         logger.info(f"Async task created: task_id={task_id}")
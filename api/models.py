@@ -99,6 +99,24 @@ class TaskStatusResponse(BaseModel):
         }
 
 
+class SpeakerInfo(BaseModel):
+    """已注册说话人信息"""
+    speaker_id: str = Field(..., description="说话人唯一标识符，用于生成接口的 speaker_ids")
+    prompt_text: str = Field(..., description="参考文本")
+    num_prompt_tokens: Optional[int] = Field(None, description="参考音频的语音token数量")
+    created_at: datetime = Field(..., description="注册时间")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "speaker_id": "3f2a9c1e5b7d4a60",
+                "prompt_text": "喜欢攀岩、徒步、滑雪的语言爱好者。",
+                "num_prompt_tokens": 152,
+                "created_at": "2025-11-01T12:00:00Z"
+            }
+        }
+
+
 class HealthResponse(BaseModel):
     """健康检查响应"""
     status: str = Field(default="healthy", description="服务状态")
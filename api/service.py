@@ -4,7 +4,7 @@ SoulXPodcast Model Service Layer
 import re
 import logging
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Dict, Iterator, List, Tuple, Optional
 import torch
 import numpy as np
 import random
@@ -14,8 +14,10 @@ import threading
 from soulxpodcast.models.soulxpodcast import SoulXPodcast
 from soulxpodcast.config import Config, SoulXPodcastLLMConfig, SamplingParams
 from soulxpodcast.utils.dataloader import PodcastInferHandler
+from soulxpodcast.utils.frontend import PromptFeatures
 
 from api.config import config as api_config
+from api.speakers import Speaker, SpeakerRegistry
 from api.utils import parse_dialogue_text
 
 logger = logging.getLogger(__name__)
@@ -50,7 +52,7 @@ class SoulXPodcastService:
         """加载模型"""
         try:
             logger.info(f"Loading SoulXPodcast model from {api_config.model_path}...")
-            logger.info(f"Using LLM engine: {api_config.llm_engine}")
+            logger.info(f"Using LLM engine: {api_config.llm_engine}, device: {api_config.device}")
 
             # 加载配置
             hf_config = SoulXPodcastLLMConfig.from_initial_and_json(
@@ -63,7 +65,19 @@ class SoulXPodcastService:
                 model=api_config.model_path,
                 enforce_eager=True,
                 llm_engine=api_config.llm_engine,
-                hf_config=hf_config
+                hf_config=hf_config,
+                device=api_config.device,
+                num_threads=api_config.num_threads,
+                cpu_dtype=api_config.cpu_dtype,
+                flow_solver=api_config.flow_solver,
+                flow_n_timesteps=api_config.flow_n_timesteps,
+                flow_cfg_interval=api_config.flow_cfg_interval,
+                flow_cfg_stride=api_config.flow_cfg_stride,
+                flow_cfg_reuse=api_config.flow_cfg_reuse,
+                flow_deep_cache_interval=api_config.flow_deep_cache_interval,
+                feature_store_dir=api_config.feature_store_dir,
+                campplus_sessions=api_config.campplus_sessions,
+                campplus_threads=api_config.campplus_threads,
             )
 
             # 初始化模型
@@ -71,9 +85,16 @@ class SoulXPodcastService:
             self.dataset = PodcastInferHandler(
                 self.model.llm.tokenizer,
                 None,
-                model_config
+                model_config,
+                speech_tokenizer=self.model.tokenize_prompts,
             )
             self.config = model_config
+            self.speakers = SpeakerRegistry(
+                api_config.speaker_dir,
+                self._speaker_features,
+                self.dataset.encode_prompt_text,
+                api_config.max_speakers,
+            )
 
             logger.info(f"Model loaded successfully with {api_config.llm_engine} engine!")
 
@@ -81,10 +102,157 @@ class SoulXPodcastService:
             logger.error(f"Failed to load model: {e}")
             raise RuntimeError(f"模型加载失败: {str(e)}")
 
+    def _on_cuda(self) -> bool:
+        """模型是否运行在GPU上"""
+        return torch.device(self.config.device).type == "cuda"
+
+    def _empty_device_cache(self):
+        """仅在GPU设备上清理缓存，CPU模式下不调用CUDA"""
+        if self._on_cuda():
+            torch.cuda.empty_cache()
+
     def is_loaded(self) -> bool:
         """检查模型是否已加载"""
         return hasattr(self, 'model') and self.model is not None
 
+    def speaker_embedding_stats(self) -> Dict[str, Any]:
+        """说话人向量提取的调用次数与耗时统计（毫秒）"""
+        return self.dataset.spk_model.stats.as_dict()
+
+    def _speaker_features(self, prompt_audio_paths: List[str]) -> List[PromptFeatures]:
+        """
+        参考音频特征，确保包含参考语音token（特征库关闭时不会自动计算）
+
+        不需要生成锁：特征提取按请求独立进行，语音token化在模型内部串行执行，可与正在进行的生成并发
+        """
+        features = self.dataset.prompt_features(prompt_audio_paths)
+        untokenized = [feature for feature in features if feature.speech_tokens is None]
+        if untokenized:
+            with torch.no_grad():
+                tokens = self.model.tokenize_prompts([feature.log_mel for feature in untokenized])
+            for feature, speech_tokens in zip(untokenized, tokens):
+                feature.speech_tokens = speech_tokens
+        return features
+
+    def register_speaker(self, prompt_audio_path: str, prompt_text: str) -> Tuple[Speaker, PromptFeatures]:
+        """注册说话人，预先计算其音频特征与参考语音token"""
+        if not self.is_loaded():
+            raise RuntimeError("模型未加载")
+        return self.speakers.register(prompt_audio_path, prompt_text)
+
+    def _resolve_speakers(
+        self, speaker_ids: List[str]
+    ) -> Tuple[List[str], List[str], List[PromptFeatures], List[Optional[List[int]]]]:
+        """已注册说话人 -> (参考音频路径, 参考文本, 特征, 参考文本token)"""
+        paths, texts, features, text_tokens = [], [], [], []
+        for speaker_id in speaker_ids:
+            speaker = self.speakers.get(speaker_id)
+            if speaker is None:
+                raise ValueError(f"说话人不存在: {speaker_id}")
+            paths.append(str(self.speakers.root / speaker.audio_file))
+            texts.append(speaker.prompt_text)
+            features.append(self.speakers.get_features(speaker_id))
+            text_tokens.append(speaker.prompt_text_tokens)
+        return paths, texts, features, text_tokens
+
+    def _prepare_inputs(
+        self,
+        prompt_audio_paths: List[str],
+        prompt_texts: List[str],
+        dialogue_text: str,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        repetition_penalty: float,
+        speaker_ids: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        构建模型输入，给定 speaker_ids 时使用已注册说话人的参考文本与预计算特征
+
+        每个请求独立构建数据项，不修改共享的数据源，因此在生成锁之外调用，可与正在进行的生成并发
+        """
+        prompt_features = prompt_text_ids = None
+        if speaker_ids:
+            prompt_audio_paths, prompt_texts, prompt_features, prompt_text_ids = self._resolve_speakers(speaker_ids)
+        num_speakers = len(prompt_audio_paths)
+        logger.info(f"Generating audio for {num_speakers} speaker(s)")
+
+        # 解析对话文本
+        target_text_list = parse_dialogue_text(dialogue_text, num_speakers)
+        logger.info(f"Parsed dialogue into {len(target_text_list)} segments")
+
+        # 提取说话人和文本
+        spks, texts = [], []
+        for target_text in target_text_list:
+            pattern = r'(\[S[1-9]\])(.+)'
+            match = re.match(pattern, target_text)
+            if match:
+                text, spk = match.group(2), int(match.group(1)[2]) - 1
+                spks.append(spk)
+                texts.append(text)
+            else:
+                raise ValueError(f"无效的对话文本格式: {target_text}")
+
+        # 构建数据项
+        dataitem = {
+            "key": "api_001",
+            "prompt_text": prompt_texts,
+            "prompt_wav": prompt_audio_paths,
+            "text": texts,
+            "spk": spks,
+        }
+        if prompt_features is not None:
+            dataitem["prompt_features"] = prompt_features
+            dataitem["prompt_text_ids"] = prompt_text_ids
+
+        # 获取处理后的数据（仅本请求的数据项）
+        data = self.dataset.build_item(dataitem)
+        if data is None:
+            raise ValueError("输入数据处理失败")
+        # 本次请求的说话人向量提取耗时（特征库命中时不提取）
+        for call in self.dataset.spk_model.stats.take_thread_calls():
+            logger.info(f"Speaker embedding: {call['prompts']} prompt(s) in {call['runs']} run(s), {call['ms']:.1f} ms")
+
+        # 准备模型输入
+        import s3tokenizer
+        prompt_mels_for_llm, prompt_mels_lens_for_llm = s3tokenizer.padding(data["log_mel"])
+        spk_emb_for_flow = torch.tensor(data["spk_emb"])
+        prompt_mels_for_flow = torch.nn.utils.rnn.pad_sequence(
+            data["mel"], batch_first=True, padding_value=0
+        )
+        prompt_mels_lens_for_flow = torch.tensor(data['mel_len'])
+        text_tokens_for_llm = data["text_tokens"]
+        prompt_text_tokens_for_llm = data["prompt_text_tokens"]
+        spk_ids = data["spks_list"]
+
+        # 采样参数
+        sampling_params = SamplingParams(
+            temperature=temperature,
+            repetition_penalty=repetition_penalty,
+            top_k=top_k,
+            top_p=top_p,
+            use_ras=True,
+            win_size=25,
+            tau_r=0.2
+        )
+
+        infos = [data["info"]]
+        processed_data = {
+            "prompt_mels_for_llm": prompt_mels_for_llm,
+            "prompt_mels_lens_for_llm": prompt_mels_lens_for_llm,
+            "prompt_text_tokens_for_llm": prompt_text_tokens_for_llm,
+            "text_tokens_for_llm": text_tokens_for_llm,
+            "prompt_mels_for_flow_ori": prompt_mels_for_flow,
+            "prompt_mels_lens_for_flow": prompt_mels_lens_for_flow,
+            "spk_emb_for_flow": spk_emb_for_flow,
+            "prompt_speech_tokens": data["prompt_speech_tokens"],
+            "sampling_params": sampling_params,
+            "spk_ids": spk_ids,
+            "infos": infos,
+            "use_dialect_prompt": False,
+        }
+        return processed_data
+
     def generate(
         self,
         prompt_audio_paths: List[str],
@@ -95,6 +263,7 @@ class SoulXPodcastService:
         top_k: int = 100,
         top_p: float = 0.9,
         repetition_penalty: float = 1.25,
+        speaker_ids: Optional[List[str]] = None,
     ) -> Tuple[int, np.ndarray]:
         """
         生成语音
@@ -108,6 +277,7 @@ class SoulXPodcastService:
             top_k: Top-K采样
             top_p: Top-P采样
             repetition_penalty: 重复惩罚
+            speaker_ids: 已注册说话人ID列表，给定时忽略 prompt_audio_paths 与 prompt_texts
 
         Returns:
             Tuple[int, np.ndarray]: (采样率, 音频数组)
@@ -117,6 +287,16 @@ class SoulXPodcastService:
         if not self.is_loaded():
             raise RuntimeError("模型未加载")
 
+        # 特征提取在生成锁之外进行
+        try:
+            processed_data = self._prepare_inputs(
+                prompt_audio_paths, prompt_texts, dialogue_text,
+                temperature, top_k, top_p, repetition_penalty, speaker_ids,
+            )
+        except Exception as e:
+            logger.error(f"Input preparation failed: {e}", exc_info=True)
+            raise RuntimeError(f"语音生成失败: {str(e)}")
+
         # 使用锁确保同一时间只有一个生成任务
         with self._generation_lock:
             logger.info("Acquired generation lock")
@@ -126,96 +306,27 @@ class SoulXPodcastService:
                 np.random.seed(seed)
                 random.seed(seed)
 
-                num_speakers = len(prompt_audio_paths)
-                logger.info(f"Generating audio for {num_speakers} speaker(s)")
-
-                # 解析对话文本
-                target_text_list = parse_dialogue_text(dialogue_text, num_speakers)
-                logger.info(f"Parsed dialogue into {len(target_text_list)} segments")
-
-                # 提取说话人和文本
-                spks, texts = [], []
-                for target_text in target_text_list:
-                    pattern = r'(\[S[1-9]\])(.+)'
-                    match = re.match(pattern, target_text)
-                    if match:
-                        text, spk = match.group(2), int(match.group(1)[2]) - 1
-                        spks.append(spk)
-                        texts.append(text)
-                    else:
-                        raise ValueError(f"无效的对话文本格式: {target_text}")
-
-                # 构建数据项
-                dataitem = {
-                    "key": "api_001",
-                    "prompt_text": prompt_texts,
-                    "prompt_wav": prompt_audio_paths,
-                    "text": texts,
-                    "spk": spks,
-                }
-
-                # 更新数据源
-                self.dataset.update_datasource([dataitem])
-
-                # 获取处理后的数据
-                data = self.dataset[0]
-
-                # 准备模型输入
-                import s3tokenizer
-                prompt_mels_for_llm, prompt_mels_lens_for_llm = s3tokenizer.padding(data["log_mel"])
-                spk_emb_for_flow = torch.tensor(data["spk_emb"])
-                prompt_mels_for_flow = torch.nn.utils.rnn.pad_sequence(
-                    data["mel"], batch_first=True, padding_value=0
-                )
-                prompt_mels_lens_for_flow = torch.tensor(data['mel_len'])
-                text_tokens_for_llm = data["text_tokens"]
-                prompt_text_tokens_for_llm = data["prompt_text_tokens"]
-                spk_ids = data["spks_list"]
-
-                # 采样参数
-                sampling_params = SamplingParams(
-                    temperature=temperature,
-                    repetition_penalty=repetition_penalty,
-                    top_k=top_k,
-                    top_p=top_p,
-                    use_ras=True,
-                    win_size=25,
-                    tau_r=0.2
-                )
-
-                infos = [data["info"]]
-                processed_data = {
-                    "prompt_mels_for_llm": prompt_mels_for_llm,
-                    "prompt_mels_lens_for_llm": prompt_mels_lens_for_llm,
-                    "prompt_text_tokens_for_llm": prompt_text_tokens_for_llm,
-                    "text_tokens_for_llm": text_tokens_for_llm,
-                    "prompt_mels_for_flow_ori": prompt_mels_for_flow,
-                    "prompt_mels_lens_for_flow": prompt_mels_lens_for_flow,
-                    "spk_emb_for_flow": spk_emb_for_flow,
-                    "sampling_params": sampling_params,
-                    "spk_ids": spk_ids,
-                    "infos": infos,
-                    "use_dialect_prompt": False,
-                }
+                num_segments = len(processed_data["text_tokens_for_llm"])
 
                 # 模型推理
                 logger.info("Running model inference...")
 
                 # 清理之前可能累积的GPU缓存
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
+                self._empty_device_cache()
 
                 # 使用超时机制执行推理
                 import concurrent.futures
                 import signal
 
                 def run_inference():
-                    """在独立线程中执行推理"""
+                    """在独立线程中执行推理，逐段取回音频"""
                     with torch.no_grad():
-                        return self.model.forward_longform(**processed_data)
+                        return [
+                            record["wav"].cpu().squeeze(0).numpy()
+                            for record in self.model.forward_longform_stream(**processed_data)
+                        ]
 
                 # 设置超时时间（根据音频长度动态调整）
-                num_segments = len(texts)
                 timeout_seconds = max(1200, num_segments * 120)  # 每段至少120秒，最少20分钟(1200秒)
 
                 logger.info(f"Starting inference with timeout: {timeout_seconds}s for {num_segments} segments")
@@ -224,42 +335,29 @@ class SoulXPodcastService:
                 with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
                     future = executor.submit(run_inference)
                     try:
-                        results_dict = future.result(timeout=timeout_seconds)
+                        segment_wavs = future.result(timeout=timeout_seconds)
                     except concurrent.futures.TimeoutError:
                         logger.error(f"Model inference timeout after {timeout_seconds} seconds")
                         # 尝试取消任务
                         future.cancel()
                         # 清理GPU内存
-                        if torch.cuda.is_available():
-                            torch.cuda.empty_cache()
+                        self._empty_device_cache()
                         raise TimeoutError(f"模型推理超时（{timeout_seconds}秒）。可能是音频过长或GPU内存不足。")
                     except Exception as e:
                         logger.error(f"Model inference failed: {e}")
                         raise RuntimeError(f"模型推理失败: {str(e)}")
 
                 # 拼接音频
-                target_audio = None
-                for i in range(len(results_dict['generated_wavs'])):
-                    if target_audio is None:
-                        target_audio = results_dict['generated_wavs'][i]
-                    else:
-                        target_audio = torch.concat(
-                            [target_audio, results_dict['generated_wavs'][i]], axis=1
-                        )
-
-                # 转换为numpy数组
-                audio_array = target_audio.cpu().squeeze(0).numpy()
+                audio_array = np.concatenate(segment_wavs)
                 sample_rate = 24000
 
-                # 清理GPU内存
-                del target_audio
-                del results_dict
+                # 清理内存
+                del segment_wavs
                 if 'processed_data' in locals():
                     del processed_data
 
                 # 显式清理GPU缓存
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
+                self._empty_device_cache()
 
                 # 强制垃圾回收
                 gc.collect()
@@ -267,7 +365,7 @@ class SoulXPodcastService:
                 logger.info(f"Audio generation completed. Duration: {len(audio_array) / sample_rate:.2f}s")
 
                 # 记录GPU内存使用情况
-                if torch.cuda.is_available():
+                if self._on_cuda():
                     allocated = torch.cuda.memory_allocated() / 1024**3  # GB
                     reserved = torch.cuda.memory_reserved() / 1024**3    # GB
                     logger.info(f"GPU Memory - Allocated: {allocated:.2f}GB, Reserved: {reserved:.2f}GB")
@@ -280,6 +378,52 @@ class SoulXPodcastService:
             finally:
                 logger.info("Released generation lock")
 
+    def generate_stream(
+        self,
+        prompt_audio_paths: List[str],
+        prompt_texts: List[str],
+        dialogue_text: str,
+        seed: int = 1988,
+        temperature: float = 0.6,
+        top_k: int = 100,
+        top_p: float = 0.9,
+        repetition_penalty: float = 1.25,
+        chunk_streaming: bool = False,
+        speaker_ids: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[int, np.ndarray, Dict[str, Any]]]:
+        """
+        逐段生成语音，每段对话合成完成后立即返回
+
+        参数同 generate；chunk_streaming 为 True 时按语音 token 块返回，首包约在一个块后到达
+
+        Yields:
+            Tuple[int, np.ndarray, Dict[str, Any]]: (采样率, 该段音频数组, 段信息: turn_index/spk_id/num_tokens/timings)
+
+        生成锁在整个迭代过程中保持，提前停止消费时调用方须调用 close()，以停止推理并释放生成锁
+        """
+        if not self.is_loaded():
+            raise RuntimeError("模型未加载")
+
+        # 特征提取在生成锁之外进行
+        processed_data = self._prepare_inputs(
+            prompt_audio_paths, prompt_texts, dialogue_text,
+            temperature, top_k, top_p, repetition_penalty, speaker_ids,
+        )
+        with self._generation_lock:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+            random.seed(seed)
+
+            records = self.model.forward_longform_stream(**processed_data, chunk_streaming=chunk_streaming)
+            try:
+                for record in records:
+                    wav = record.pop("wav")
+                    yield 24000, wav.cpu().squeeze(0).numpy(), record
+            finally:
+                # 立即关闭模型生成器，停止后台LLM线程，而不是等待垃圾回收
+                records.close()
+                self._empty_device_cache()
+
 
 # 全局服务实例
 _service: Optional[SoulXPodcastService] = None
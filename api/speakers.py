@@ -0,0 +1,148 @@
+"""
+Speaker Registry: register a prompt voice once, synthesize by speaker_id
+"""
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from dataclasses import dataclass, asdict
+
+from soulxpodcast.utils.feature_store import prompt_file_key
+from soulxpodcast.utils.frontend import PromptFeatures
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = "registry.json"
+
+
+@dataclass
+class Speaker:
+    """已注册说话人"""
+    speaker_id: str
+    prompt_text: str
+    audio_file: str  # 说话人目录下的参考音频文件名
+    created_at: str
+    prompt_text_tokens: Optional[List[int]] = None  # 参考文本的token，生成时不再重复分词
+
+
+class SpeakerRegistry:
+    """
+    说话人注册表
+
+    参考音频复制到 `root` 目录，元数据保存在 `root/registry.json` 中，服务重启后仍然有效。
+    每个说话人的音频特征和参考语音token只计算一次并保存在内存中；重启后在首次使用时重新计算
+    （配置了特征库磁盘目录时直接从磁盘读取）。参考文本的token随元数据一起保存。
+    特征计算不持有注册表锁，计算完成后在锁内再次检查后写入。
+
+    Args:
+        root: 说话人目录
+        compute_features: 参考音频路径列表 -> 特征列表（含语音token）
+        tokenize_text: 参考文本 -> token列表
+        max_speakers: 最多注册的说话人数量
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        compute_features: Callable[[List[str]], List[PromptFeatures]],
+        tokenize_text: Callable[[str], List[int]],
+        max_speakers: int = 256,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compute_features = compute_features
+        self.tokenize_text = tokenize_text
+        self.max_speakers = max_speakers
+        self._lock = threading.Lock()
+        self.speakers: Dict[str, Speaker] = {}
+        self.features: Dict[str, PromptFeatures] = {}
+        registry_path = self.root / REGISTRY_FILE
+        if registry_path.exists():
+            with open(registry_path, "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    self.speakers[item["speaker_id"]] = Speaker(**item)
+            logger.info(f"Loaded {len(self.speakers)} registered speakers from {registry_path}")
+
+    def _save(self):
+        """原子写入注册表"""
+        registry_path = self.root / REGISTRY_FILE
+        tmp_path = registry_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(speaker) for speaker in self.speakers.values()], f, ensure_ascii=False, indent=2)
+        tmp_path.replace(registry_path)
+
+    def register(self, audio_path: str, prompt_text: str) -> tuple[Speaker, PromptFeatures]:
+        """
+        注册说话人：计算特征与参考语音token，保存音频与元数据
+
+        同一音频与参考文本得到同一个 speaker_id，重复注册直接返回已有的说话人。
+        """
+        prompt_text = prompt_text.strip()
+        if not prompt_text:
+            raise ValueError("参考文本不能为空")
+        audio_key = prompt_file_key(audio_path)
+        speaker_id = hashlib.sha256(f"{audio_key}:{prompt_text}".encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            speaker = self.speakers.get(speaker_id)
+            self._check_capacity(speaker_id)
+        if speaker is not None:
+            return speaker, self.get_features(speaker_id)
+
+        features = self.compute_features([audio_path])[0]
+        prompt_text_tokens = self.tokenize_text(prompt_text)
+        audio_file = f"{speaker_id}{Path(audio_path).suffix or '.wav'}"
+        with self._lock:
+            # 计算特征期间可能有相同的注册或其他说话人占满了名额
+            if speaker_id in self.speakers:
+                return self.speakers[speaker_id], self.features.setdefault(speaker_id, features)
+            self._check_capacity(speaker_id)
+            shutil.copyfile(audio_path, self.root / audio_file)
+            speaker = Speaker(speaker_id, prompt_text, audio_file, datetime.now().isoformat(), prompt_text_tokens)
+            self.speakers[speaker_id] = speaker
+            self.features[speaker_id] = features
+            self._save()
+        logger.info(f"Registered speaker {speaker_id}: {len(features.speech_tokens or [])} speech tokens")
+        return speaker, features
+
+    def _check_capacity(self, speaker_id: str):
+        """新说话人是否还有名额，须持有注册表锁"""
+        if speaker_id not in self.speakers and len(self.speakers) >= self.max_speakers:
+            raise ValueError(f"已注册说话人数量达到上限（{self.max_speakers}），请先删除不用的说话人")
+
+    def get(self, speaker_id: str) -> Optional[Speaker]:
+        return self.speakers.get(speaker_id)
+
+    def get_features(self, speaker_id: str) -> PromptFeatures:
+        """说话人特征，重启后首次使用时在锁外计算"""
+        with self._lock:
+            speaker = self.speakers.get(speaker_id)
+            features = self.features.get(speaker_id)
+        if features is not None:
+            return features
+        if speaker is None:
+            raise ValueError(f"说话人不存在: {speaker_id}")
+        features = self.compute_features([str(self.root / speaker.audio_file)])[0]
+        with self._lock:
+            # 并发的首次使用保留先写入的特征；计算期间被删除的说话人不再缓存
+            if speaker_id in self.speakers:
+                features = self.features.setdefault(speaker_id, features)
+        return features
+
+    def list(self) -> List[Speaker]:
+        with self._lock:
+            return list(self.speakers.values())
+
+    def delete(self, speaker_id: str) -> bool:
+        with self._lock:
+            speaker = self.speakers.pop(speaker_id, None)
+            if speaker is None:
+                return False
+            self.features.pop(speaker_id, None)
+            self._save()
+        (self.root / speaker.audio_file).unlink(missing_ok=True)
+        logger.info(f"Deleted speaker {speaker_id}")
+        return True
@@ -28,6 +28,7 @@ class Task:
     top_k: int
     top_p: float
     repetition_penalty: float
+    speaker_ids: Optional[List[str]] = None  # 已注册说话人ID，给定时不使用上传的参考音频
 
     status: TaskStatus = TaskStatus.PENDING
     progress: int = 0
@@ -126,6 +127,7 @@ class TaskManager:
                 task.top_k,
                 task.top_p,
                 task.repetition_penalty,
+                task.speaker_ids,
             )
 
             task.progress = 80
@@ -161,6 +163,7 @@ class TaskManager:
         top_k: int = 100,
         top_p: float = 0.9,
         repetition_penalty: float = 1.25,
+        speaker_ids: Optional[List[str]] = None,
     ) -> Task:
         """创建并加入队列"""
         task = Task(
@@ -173,6 +176,7 @@ class TaskManager:
             top_k=top_k,
             top_p=top_p,
             repetition_penalty=repetition_penalty,
+            speaker_ids=speaker_ids,
         )
 
         self.tasks[task_id] = task
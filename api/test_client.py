@@ -3,6 +3,7 @@ API测试客户端示例
 使用示例:
     python api/test_client.py --mode sync
     python api/test_client.py --mode async
+    python api/test_client.py --mode speakers
 """
 import requests
 import time
@@ -199,6 +200,48 @@ def test_async(api_url: str):
             file_obj.close()
 
 
+def test_speakers(api_url: str):
+    """测试说话人注册 - 注册一次，按speaker_id同步生成"""
+    print("\n" + "=" * 60)
+    print("测试: 说话人注册")
+    print("=" * 60)
+
+    audio_file = "example/audios/female_mandarin.wav"
+    if not Path(audio_file).exists():
+        print(f"错误: 找不到音频文件 {audio_file}")
+        return
+
+    try:
+        with open(audio_file, 'rb') as f:
+            response = requests.post(
+                f"{api_url}/speakers",
+                files={'prompt_audio': f},
+                data={'prompt_text': "喜欢攀岩、徒步、滑雪的语言爱好者。"},
+            )
+        response.raise_for_status()
+        speaker = response.json()
+        print(f"✓ 注册成功: speaker_id={speaker['speaker_id']}, 参考语音token数={speaker['num_prompt_tokens']}")
+
+        data = {
+            'speaker_ids': json.dumps([speaker['speaker_id']]),
+            'dialogue_text': '大家好，欢迎收听今天的节目。',
+            'seed': 1988
+        }
+        start_time = time.time()
+        response = requests.post(f"{api_url}/generate", data=data)
+        response.raise_for_status()
+
+        output_path = "api/outputs/test_speaker_sync.wav"
+        with open(output_path, 'wb') as f:
+            f.write(response.content)
+        print(f"✓ 按speaker_id生成成功!")
+        print(f"  耗时: {time.time() - start_time:.2f}秒")
+        print(f"  保存到: {output_path}")
+
+    except requests.exceptions.RequestException as e:
+        print(f"✗ 请求失败: {e}")
+
+
 def test_health(api_url: str):
     """测试健康检查"""
     print("\n" + "=" * 60)
@@ -232,7 +275,7 @@ def main():
     parser.add_argument(
         "--mode",
         type=str,
-        choices=["health", "sync", "async", "all"],
+        choices=["health", "sync", "async", "speakers", "all"],
         default="all",
         help="测试模式（默认: all）"
     )
@@ -255,6 +298,9 @@ def main():
     if args.mode in ["async", "all"]:
         test_async(args.url)
 
+    if args.mode in ["speakers", "all"]:
+        test_speakers(args.url)
+
     print("\n" + "=" * 60)
     print("测试完成!")
     print("=" * 60)
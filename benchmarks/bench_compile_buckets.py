@@ -0,0 +1,108 @@
+"""
+Bucketed torch.compile of the flow and HiFT against eager: per bucket, the compile time of the first call,
+the cache hits of the following calls at other lengths inside the bucket, the steady-state speed-up of the
+offline flow (encoder + estimator over the ODE) and of the HiFT upsampling stack, and the max difference of
+their outputs. Without `--model_path` the models are randomly initialised, which only makes the timings meaningful.
+
+    PYTHONPATH=. python benchmarks/bench_compile_buckets.py --model_path pretrained_models/SoulX-Podcast-1.7B --num_threads 8
+"""
+import argparse
+import copy
+import time
+
+import torch
+
+from soulxpodcast.engine.compile_backend import (apply_compile_backend,
+                                                  bucket_length)
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec
+from soulxpodcast.models.modules.hifigan import HiFTGenerator
+
+
+def time_call(fn, device, repeats):
+    times = []
+    for _ in range(repeats):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        output = fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    return output, min(times)
+
+
+def load_models(model_path, device):
+    flow, hift = CausalMaskedDiffWithXvec(), HiFTGenerator()
+    if model_path is not None:
+        flow.load_state_dict(torch.load(f"{model_path}/flow.pt", map_location="cpu", weights_only=True), strict=True)
+        state_dict = torch.load(f"{model_path}/hift.pt", map_location="cpu", weights_only=True)
+        hift.load_state_dict({k.replace('generator.', ''): v for k, v in state_dict.items()}, strict=True)
+    hift.remove_weight_norm()
+    return flow.to(device).eval(), hift.to(device).eval()
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num_threads", type=int, default=0)
+    parser.add_argument("--backend", default="inductor")
+    parser.add_argument("--buckets", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--fill", type=float, nargs="+", default=[0.6, 0.8, 1.0], help="turn lengths, as fractions of their bucket")
+    parser.add_argument("--n_timesteps", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device(args.device)
+    torch.manual_seed(1988)
+    eager_flow, eager_hift = load_models(args.model_path, device)
+    flow, hift = copy.deepcopy(eager_flow), copy.deepcopy(eager_hift)
+    stats = apply_compile_backend(flow, hift, tuple(args.buckets), args.backend, time_hits=True)
+    embedding = torch.randn(1, flow.spk_embed_affine_layer.in_features, device=device)
+    prompt_feat = torch.zeros(1, 0, flow.output_size, device=device)
+
+    def run_flow(model, token, noise):
+        length = torch.tensor([token.shape[1]], device=device)
+        mel, _ = model(token, length, prompt_feat, torch.tensor([0], device=device), embedding, streaming=False,
+                       finalize=True, noise=noise, n_timesteps=args.n_timesteps)
+        return mel
+
+    def run_hift(decode_spec, mel):
+        s_real, s_imag = hift._stft(torch.randn(1, mel.shape[2] * int(hift.f0_upsamp.scale_factor), device=device,
+                                                generator=torch.Generator(device=device).manual_seed(0)))
+        return decode_spec(mel, torch.cat([s_real, s_imag], dim=1))
+
+    print(f"device={device.type} threads={torch.get_num_threads()} backend={args.backend} n_timesteps={args.n_timesteps}")
+    print(f"{'tokens':>7}{'bucket':>7}{'flow eager':>12}{'compiled':>10}{'speedup':>9}{'max |diff|':>12}"
+          f"{'hift eager':>12}{'compiled':>10}{'speedup':>9}{'max |diff|':>12}")
+    for bucket in sorted(args.buckets):
+        for fill in args.fill:
+            num_tokens = max(1, int(bucket * fill))
+            assert bucket_length(num_tokens, tuple(args.buckets)) == bucket
+            token = torch.randint(0, flow.vocab_size, (1, num_tokens), device=device)
+            noise = torch.randn(1, flow.output_size, num_tokens * flow.token_mel_ratio, device=device)
+            run_flow(flow, token, noise)  # compiles on the first length of the bucket, then hits
+            reference, eager_time = time_call(lambda: run_flow(eager_flow, token, noise), device, args.repeats)
+            mel, compiled_time = time_call(lambda: run_flow(flow, token, noise), device, args.repeats)
+            flow_diff = (mel - reference).abs().max().item()
+
+            run_hift(hift.spec_decoder, reference)
+            spec, hift_eager_time = time_call(lambda: run_hift(eager_hift.decode_spec, reference), device, args.repeats)
+            compiled_spec, hift_time = time_call(lambda: run_hift(hift.spec_decoder, reference), device, args.repeats)
+            hift_diff = (compiled_spec - spec).abs().max().item()
+            print(f"{num_tokens:>7}{bucket:>7}{eager_time:>12.3f}{compiled_time:>10.3f}{eager_time / compiled_time:>8.2f}x"
+                  f"{flow_diff:>12.2e}{hift_eager_time:>12.3f}{hift_time:>10.3f}{hift_eager_time / hift_time:>8.2f}x{hift_diff:>12.2e}")
+
+    print(f"{'part/bucket':>16}{'compiles':>10}{'compile s':>11}{'hits':>7}{'hit ms':>9}")
+    for name, bucket_stats in stats.summary()["buckets"].items():
+        print(f"{name:>16}{bucket_stats['compiles']:>10}{bucket_stats['compile_seconds']:>11.1f}"
+              f"{bucket_stats['hits']:>7}{bucket_stats['mean_hit_seconds'] * 1000:>9.2f}")
+    if stats.eager:
+        print(f"eager fallbacks: {dict(stats.eager)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Tensor allocations and wall time per flow ODE step, with the loop-invariant conditioning prepared once
+per solve (`prepare_conditioning` / `forward_prepared`) against the per-step estimator `forward`.
+Allocations come from the cuda caching allocator stats on cuda and from the profiler memory events on CPU.
+On cuda the peak memory of a solve is reported for every `--num_tokens` value, to check that it grows
+linearly with the turn length.
+
+    PYTHONPATH=. python benchmarks/bench_flow_allocations.py --device cuda --num_tokens 250 500 1000
+"""
+import argparse
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from soulxpodcast.models.modules.flow import CausalConditionalCFM
+
+
+class PlainEstimator(torch.nn.Module):
+    """Hides `prepare_conditioning`, so that the solver falls back to the per-step estimator forward."""
+
+    def __init__(self, estimator):
+        super().__init__()
+        self.estimator = estimator
+
+    def forward(self, *args):
+        return self.estimator(*args)
+
+
+def count_allocations(solve, device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        before = torch.cuda.memory_stats(device)["allocation.all.allocated"]
+        solve()
+        torch.cuda.synchronize(device)
+        return torch.cuda.memory_stats(device)["allocation.all.allocated"] - before
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        solve()
+    return sum(1 for event in prof.events() if event.name == "[memory]" and event.cpu_memory_usage > 0)
+
+
+def peak_memory(solve, device):
+    torch.cuda.synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    before = torch.cuda.memory_allocated(device)
+    solve()
+    torch.cuda.synchronize(device)
+    return torch.cuda.max_memory_allocated(device) - before
+
+
+def time_solve(solve, device, repeats):
+    times = []
+    for _ in range(repeats):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        solve()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num_tokens", type=int, nargs="+", default=[250], help="prompt + generated speech tokens")
+    parser.add_argument("--n_timesteps", type=int, default=15)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(1988)
+    decoder = CausalConditionalCFM()
+    if args.model_path is not None:
+        state_dict = torch.load(f"{args.model_path}/flow.pt", map_location="cpu", weights_only=True)
+        decoder.load_state_dict({k[len("decoder."):]: v for k, v in state_dict.items() if k.startswith("decoder.")})
+    decoder.to(device).eval()
+    plain = CausalConditionalCFM(estimator=PlainEstimator(decoder.estimator)).to(device).eval()
+
+    for num_tokens in args.num_tokens:
+        mel_len = num_tokens * 2
+        mu = torch.randn(1, 80, mel_len, device=device)
+        mask = torch.ones(1, 1, mel_len, device=device)
+        spks = torch.randn(1, 80, device=device)
+        cond = torch.randn(1, 80, mel_len, device=device)
+
+        results = {}
+        for name, cfm in (("per-step", plain), ("prepared", decoder)):
+            def solve():
+                generator = torch.Generator(device=device).manual_seed(1988)
+                return cfm(mu, mask, args.n_timesteps, spks=spks, cond=cond, streaming=args.streaming, generator=generator)[0]
+
+            mels = solve()  # warmup
+            allocations = count_allocations(solve, device)
+            elapsed = time_solve(solve, device, args.repeats)
+            peak = peak_memory(solve, device) if device.type == "cuda" else None
+            results[name] = (allocations, elapsed, peak, mels)
+
+        print(f"device={device.type} mel_frames={mel_len} n_timesteps={args.n_timesteps} streaming={args.streaming}")
+        for name, (allocations, elapsed, peak, mels) in results.items():
+            line = f"{name:<9} allocations/step {allocations / args.n_timesteps:8.1f}  time/step {elapsed / args.n_timesteps * 1000:8.2f} ms"
+            if peak is not None:
+                line += f"  peak {peak / 1024 ** 2:8.1f} MiB"
+            print(line)
+        max_diff = (results["per-step"][3] - results["prepared"][3]).abs().max().item()
+        print(f"max |mel diff| {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
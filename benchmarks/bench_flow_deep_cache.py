@@ -0,0 +1,76 @@
+"""
+Accuracy / latency of DeepCache-style feature reuse in the flow estimator: for each refresh interval, the
+wall time of a solve and its mel L1 distance to full recomputation (interval 1), from the same noise.
+Without `--model_path` the flow is randomly initialised, which only makes the timings meaningful.
+
+    PYTHONPATH=. python benchmarks/bench_flow_deep_cache.py --model_path pretrained_models/SoulX-Podcast-1.7B --device cuda
+"""
+import argparse
+import time
+
+import torch
+
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec
+
+
+def run(flow, inputs, args, interval, device):
+    generator = torch.Generator(device=device).manual_seed(args.seed)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    mels, _ = flow(*inputs, streaming=False, finalize=True, generator=generator, n_timesteps=args.n_timesteps,
+                   solver=args.solver, deep_cache_interval=interval)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return mels, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--solver", default="euler")
+    parser.add_argument("--n_timesteps", type=int, default=15)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[1, 2, 3, 4, 5])
+    parser.add_argument("--num_tokens", type=int, default=250, help="generated speech tokens, 25 per second")
+    parser.add_argument("--prompt_tokens", type=int, default=150)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1988)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    flow = CausalMaskedDiffWithXvec()
+    if args.model_path is not None:
+        flow.load_state_dict(torch.load(f"{args.model_path}/flow.pt", map_location="cpu", weights_only=True), strict=True)
+    flow.to(device).eval()
+
+    total_tokens = args.prompt_tokens + args.num_tokens
+    token = torch.randint(0, flow.vocab_size, (1, total_tokens), device=device)
+    token_len = torch.tensor([total_tokens], device=device)
+    prompt_mel_len = args.prompt_tokens * flow.token_mel_ratio
+    prompt_feat = torch.randn(1, prompt_mel_len, flow.output_size, device=device)
+    prompt_feat_len = torch.tensor([prompt_mel_len], device=device)
+    embedding = torch.randn(1, flow.spk_embed_affine_layer.in_features, device=device)
+    inputs = (token, token_len, prompt_feat, prompt_feat_len, embedding)
+
+    run(flow, inputs, args, 1, device)  # warmup
+
+    reference, reference_time = None, None
+    print(f"device={device.type} solver={args.solver} n_timesteps={args.n_timesteps} tokens={args.num_tokens}")
+    print(f"{'interval':>8}{'time (s)':>10}{'speedup':>9}{'mel L1':>10}{'max |diff|':>12}")
+    for interval in args.intervals:
+        times = []
+        for _ in range(args.repeats):
+            mels, elapsed = run(flow, inputs, args, interval, device)
+            times.append(elapsed)
+        elapsed = min(times)
+        mels = mels[:, :, prompt_mel_len:]
+        if reference is None:
+            reference, reference_time = mels, elapsed
+        diff = (mels - reference).abs()
+        print(f"{interval:>8}{elapsed:>10.3f}{reference_time / elapsed:>8.2f}x{diff.mean().item():>10.4f}{diff.max().item():>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
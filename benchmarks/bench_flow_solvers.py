@@ -0,0 +1,111 @@
+"""
+Flow ODE solvers and CFG schedules against the 15-step Euler reference: estimator calls, estimator
+batch rows (FLOPs relative to the reference), wall time and mel L1 distance, all runs start from the
+same noise. Without `--model_path` the flow is randomly initialised, which is enough for calls and
+timings but not for a meaningful L1.
+
+    PYTHONPATH=. python benchmarks/bench_flow_solvers.py --model_path pretrained_models/SoulX-Podcast-1.7B --device cuda
+"""
+import argparse
+import time
+
+import torch
+
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec, CfgSchedule
+
+PRESETS = [
+    ("euler", 15, CfgSchedule()),
+    ("euler", 8, CfgSchedule()),
+    ("heun", 4, CfgSchedule()),
+    ("midpoint", 4, CfgSchedule()),
+    ("rk4", 2, CfgSchedule()),
+    ("dpm_multistep", 8, CfgSchedule()),
+    ("dpm_multistep", 6, CfgSchedule()),
+    ("dpm_multistep", 5, CfgSchedule()),
+    ("euler", 15, CfgSchedule(interval=(0.0, 0.5))),
+    ("euler", 15, CfgSchedule(interval=(0.1, 0.7))),
+    ("euler", 15, CfgSchedule(stride=3, reuse_delta=True)),
+    ("euler", 15, CfgSchedule(stride=5, reuse_delta=True)),
+    ("dpm_multistep", 6, CfgSchedule(stride=2, reuse_delta=True)),
+]
+
+
+def describe(schedule):
+    if schedule == CfgSchedule():
+        return "always"
+    text = f"[{schedule.interval[0]:g},{schedule.interval[1]:g}]"
+    if schedule.stride > 1:
+        text += f"/{schedule.stride}"
+    return text + ("+reuse" if schedule.reuse_delta else "")
+
+
+def run(flow, inputs, solver, n_timesteps, schedule, seed, device):
+    generator = torch.Generator(device=device).manual_seed(seed)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    mels, mel_lens = flow(*inputs, streaming=False, finalize=True, generator=generator,
+                          n_timesteps=n_timesteps, solver=solver, cfg_schedule=schedule)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return mels, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num_tokens", type=int, default=250, help="generated speech tokens, 25 per second")
+    parser.add_argument("--prompt_tokens", type=int, default=150)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1988)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    flow = CausalMaskedDiffWithXvec()
+    if args.model_path is not None:
+        flow.load_state_dict(torch.load(f"{args.model_path}/flow.pt", map_location="cpu", weights_only=True), strict=True)
+    flow.to(device).eval()
+
+    num_calls, num_rows = 0, 0
+
+    def count_call(module, inputs, output):
+        nonlocal num_calls, num_rows
+        num_calls += 1
+        num_rows += inputs[0].shape[0]
+
+    flow.decoder.estimator.register_forward_hook(count_call)
+
+    total_tokens = args.prompt_tokens + args.num_tokens
+    token = torch.randint(0, flow.vocab_size, (1, total_tokens), device=device)
+    token_len = torch.tensor([total_tokens], device=device)
+    prompt_mel_len = args.prompt_tokens * flow.token_mel_ratio
+    prompt_feat = torch.randn(1, prompt_mel_len, flow.output_size, device=device)
+    prompt_feat_len = torch.tensor([prompt_mel_len], device=device)
+    embedding = torch.randn(1, flow.spk_embed_affine_layer.in_features, device=device)
+    inputs = (token, token_len, prompt_feat, prompt_feat_len, embedding)
+
+    # warmup
+    run(flow, inputs, "euler", 2, None, args.seed, device)
+
+    reference, reference_time, reference_rows = None, None, None
+    print(f"device={device.type} tokens={args.num_tokens} prompt_tokens={args.prompt_tokens}")
+    print(f"{'solver':<14}{'steps':>6}{'cfg':>18}{'calls':>7}{'flops':>8}{'time (s)':>10}{'speedup':>9}{'mel L1':>10}")
+    for solver, n_timesteps, schedule in PRESETS:
+        times = []
+        for _ in range(args.repeats):
+            num_calls, num_rows = 0, 0
+            mels, elapsed = run(flow, inputs, solver, n_timesteps, schedule, args.seed, device)
+            times.append(elapsed)
+        elapsed = min(times)
+        mels = mels[:, :, prompt_mel_len:]
+        if reference is None:
+            reference, reference_time, reference_rows = mels, elapsed, num_rows
+        l1 = (mels - reference).abs().mean().item()
+        print(f"{solver:<14}{n_timesteps:>6}{describe(schedule):>18}{num_calls:>7}{num_rows / reference_rows:>8.0%}"
+              f"{elapsed:>10.3f}{reference_time / elapsed:>8.2f}x{l1:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
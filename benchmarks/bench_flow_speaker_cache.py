@@ -0,0 +1,78 @@
+"""
+Chunk streaming encoder with the speaker prompt cache: wall time of one streamed flow encoder pass over
+prompt + generated tokens, re-encoding the whole prompt (`encoder.forward`) against resuming from the
+cached complete chunks of the prompt (`encoder.forward_chunk`), and the max difference of their outputs.
+Without `--model_path` the flow is randomly initialised, which is enough for both.
+
+    PYTHONPATH=. python benchmarks/bench_flow_speaker_cache.py --model_path pretrained_models/SoulX-Podcast-1.7B --device cuda
+"""
+import argparse
+import time
+
+import torch
+
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec
+
+
+def time_call(fn, device, repeats):
+    times = []
+    for _ in range(repeats):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        output = fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    return output, min(times)
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--prompt_tokens", type=int, default=250)
+    parser.add_argument("--num_tokens", type=int, nargs="+", default=[28, 78, 153], help="generated speech tokens, with the lookahead")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(1988)
+    flow = CausalMaskedDiffWithXvec()
+    if args.model_path is not None:
+        flow.load_state_dict(torch.load(f"{args.model_path}/flow.pt", map_location="cpu", weights_only=True), strict=True)
+    flow.to(device).eval()
+
+    prompt_token = torch.randint(0, flow.vocab_size, (args.prompt_tokens,)).tolist()
+    prompt_feat = torch.randn(args.prompt_tokens * flow.token_mel_ratio, flow.output_size, device=device)
+    embedding = torch.randn(1, flow.spk_embed_affine_layer.in_features, device=device)
+    speaker = flow.prepare_speaker(prompt_token, prompt_feat, embedding)
+    _, build_time = time_call(lambda: flow._speaker_encoder_cache(speaker), device, 1)
+    lookahead = flow.pre_lookahead_len
+
+    print(f"device={device.type} prompt_tokens={args.prompt_tokens} cached_tokens={speaker.num_encoded_tokens} "
+          f"cache build {build_time * 1000:.1f} ms")
+    for num_tokens in args.num_tokens:
+        token = torch.tensor([prompt_token + torch.randint(0, flow.vocab_size, (num_tokens,)).tolist()], device=device)
+        token = flow.input_embedding(token)
+        token, context = token[:, :-lookahead], token[:, -lookahead:]
+
+        def full():
+            h, _ = flow.encoder(token, torch.tensor([token.shape[1]], device=device), context=context, streaming=True)
+            return h
+
+        def cached():
+            h, _ = flow.encoder.forward_chunk(token[:, speaker.num_encoded_tokens:], context=context, cache=speaker.encoder_cache)
+            return h
+
+        full()  # warmup
+        reference, full_time = time_call(full, device, args.repeats)
+        output, cached_time = time_call(cached, device, args.repeats)
+        max_diff = (reference[:, speaker.num_encoded_tokens * flow.token_mel_ratio:] - output).abs().max().item()
+        print(f"generated {num_tokens:>4}  full {full_time * 1000:8.2f} ms  cached {cached_time * 1000:8.2f} ms  "
+              f"speedup {full_time / cached_time:5.2f}x  max |diff| {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
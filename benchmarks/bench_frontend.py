@@ -0,0 +1,85 @@
+"""
+Prompt audio frontend: wall time of the features of one request (s3 log-mel, CAM++ x-vector, flow mel of
+every prompt), decoding and normalising every prompt twice with a new resampler per call as before, against
+`AudioFrontend`, and the max difference of their features. Prompts are synthetic noise bursts written at `--sample_rate`.
+
+    PYTHONPATH=. python benchmarks/bench_frontend.py --model_path pretrained_models/SoulX-Podcast-1.7B --seconds 8 12
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnxruntime
+import s3tokenizer
+import soundfile
+import torchaudio
+import torchaudio.compliance.kaldi as kaldi
+
+from soulxpodcast.utils.audio import audio_volume_normalize, mel_spectrogram
+from soulxpodcast.utils.frontend import AudioFrontend
+from soulxpodcast.utils.speaker_embedding import SpeakerEmbedder
+
+
+def legacy_features(spk_model, path):
+    audio = s3tokenizer.load_audio(path, sr=16000)
+    audio = audio_volume_normalize(audio)
+    log_mel = s3tokenizer.log_mel_spectrogram(audio)
+    spk_feat = kaldi.fbank(audio.unsqueeze(0), num_mel_bins=80, dither=0, sample_frequency=16000)
+    spk_feat = spk_feat - spk_feat.mean(dim=0, keepdim=True)
+    spk_emb = spk_model.run(None, {spk_model.get_inputs()[0].name: spk_feat.unsqueeze(dim=0).numpy()})[0].flatten()
+    audio, sample_rate = torchaudio.load(path, backend='soundfile')
+    audio = audio_volume_normalize(audio[0]).unsqueeze(0)
+    if sample_rate != 24000:
+        audio = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=24000)(audio)
+    mel = mel_spectrogram(audio).transpose(1, 2).squeeze(0)
+    if mel.shape[0] % 2 != 0:
+        mel = mel[:-1]
+    return log_mel, spk_emb, mel
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, help="model directory holding campplus.onnx")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[6, 10], help="length of every prompt of the request")
+    parser.add_argument("--sample_rate", type=int, default=44100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--campplus_sessions", type=int, default=4)
+    args = parser.parse_args()
+
+    option = onnxruntime.SessionOptions()
+    option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    option.intra_op_num_threads = 1
+    spk_model = onnxruntime.InferenceSession(f"{args.model_path}/campplus.onnx", sess_options=option,
+                                             providers=["CPUExecutionProvider"])
+    frontend = AudioFrontend(SpeakerEmbedder(f"{args.model_path}/campplus.onnx", num_sessions=args.campplus_sessions))
+    rng = np.random.default_rng(1988)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i, seconds in enumerate(args.seconds):
+            num_samples = int(seconds * args.sample_rate)
+            envelope = np.abs(np.sin(np.linspace(0, seconds * np.pi, num_samples)))
+            paths.append(os.path.join(tmp_dir, f"prompt_{i}.wav"))
+            soundfile.write(paths[-1], (0.3 * envelope * rng.standard_normal(num_samples)).astype(np.float32), args.sample_rate)
+
+        timings = {"legacy": [], "frontend": []}
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            reference = [legacy_features(spk_model, path) for path in paths]
+            timings["legacy"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            features = frontend(paths)
+            timings["frontend"].append(time.perf_counter() - start)
+
+    legacy_time, frontend_time = min(timings["legacy"]), min(timings["frontend"])
+    print(f"prompts={args.seconds} s at {args.sample_rate} Hz")
+    print(f"legacy {legacy_time * 1000:8.1f} ms  frontend {frontend_time * 1000:8.1f} ms  speedup {legacy_time / frontend_time:5.2f}x")
+    for i, ((log_mel, spk_emb, mel), feature) in enumerate(zip(reference, features)):
+        print(f"prompt {i}: max |diff| log-mel {(log_mel - feature.log_mel).abs().max().item():.3e}  "
+              f"x-vector {np.abs(spk_emb - np.array(feature.spk_emb)).max():.3e}  "
+              f"flow mel {(mel - feature.mel).abs().max().item():.3e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Windowed / batched HiFT vocoding against whole-turn `HiFTGenerator.forward`: wall time and peak memory
+of vocoding several turns, and the max waveform difference, which only comes from the cross-faded
+overlaps. Without `--model_path` the vocoder is randomly initialised, which only makes the timings meaningful.
+
+    PYTHONPATH=. python benchmarks/bench_hift_windows.py --model_path pretrained_models/SoulX-Podcast-1.7B --num_threads 8
+"""
+import argparse
+import time
+
+import torch
+
+from soulxpodcast.engine.vocoder_engine import VocoderEngine
+from soulxpodcast.models.modules.hifigan import HiFTGenerator
+
+
+def measure(vocode, device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    wavs = vocode()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    peak = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else None
+    return wavs, time.perf_counter() - start, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num_threads", type=int, default=0)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[4, 12, 30], help="length of every turn")
+    parser.add_argument("--windows", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--overlap", type=int, default=48)
+    parser.add_argument("--batch_size", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device(args.device)
+    torch.manual_seed(1988)
+    hift = HiFTGenerator()
+    if args.model_path is not None:
+        state_dict = torch.load(f"{args.model_path}/hift.pt", map_location="cpu", weights_only=True)
+        hift.load_state_dict({k.replace('generator.', ''): v for k, v in state_dict.items()}, strict=True)
+    hift.to(device).eval()
+
+    mels = [torch.randn(1, 80, int(seconds * 50), device=device) for seconds in args.seconds]
+
+    def whole():
+        return [hift(speech_feat=mel, generator=torch.Generator(device=device).manual_seed(i))[0] for i, mel in enumerate(mels)]
+
+    whole()  # warmup
+    reference, reference_time, reference_peak = measure(whole, device)
+    print(f"device={device.type} threads={torch.get_num_threads()} turns={args.seconds} s")
+    print(f"{'window':>8}{'time (s)':>10}{'speedup':>9}{'peak MiB':>10}{'max |diff|':>12}")
+    print(f"{'whole':>8}{reference_time:>10.3f}{1.0:>8.2f}x{(reference_peak or 0) / 1024 ** 2:>10.1f}{0.0:>12.4f}")
+    for window in args.windows:
+        vocoder = VocoderEngine(hift, window_frames=window, overlap_frames=args.overlap, batch_size=args.batch_size)
+
+        def windowed():
+            generators = [torch.Generator(device=device).manual_seed(i) for i in range(len(mels))]
+            return vocoder(mels, generators)[0]
+
+        wavs, elapsed, peak = measure(windowed, device)
+        max_diff = max((wav - ref).abs().max().item() for wav, ref in zip(wavs, reference))
+        print(f"{window:>8}{elapsed:>10.3f}{reference_time / elapsed:>8.2f}x{(peak or 0) / 1024 ** 2:>10.1f}{max_diff:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
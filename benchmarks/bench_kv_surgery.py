@@ -0,0 +1,73 @@
+"""
+Total LLM prefill tokens of a long podcast under the history-window reset policies of
+`SoulXPodcast.forward_longform_stream`: re-prefill on reset (with and without the prompt
+prefix cache) against KV surgery. Token lengths are simulated, no model is needed.
+
+    PYTHONPATH=. python benchmarks/bench_kv_surgery.py --turns 200
+"""
+import argparse
+import random
+from itertools import chain
+
+
+def simulate(turns, policy, max_turn_size=10, turn_tokens_threshold=6192,
+             prompt_context=2, history_context=2, history_text_context=2,
+             prompt_text_len=40, prompt_speech_len=250, text_len=(15, 60), speech_len=(80, 400), seed=1988):
+    rng = random.Random(seed)
+    prompt_inputs = [[0] * (prompt_text_len + prompt_speech_len + 1) for _ in range(prompt_context)]
+    history_inputs = [list(x) for x in prompt_inputs]
+    inputs = list(chain.from_iterable(prompt_inputs))
+    prompt_len = len(inputs)
+    cache_len = 0
+    valid_turn_size = prompt_context
+    prefill_tokens, resets = 0, 0
+
+    for _ in range(turns):
+        if valid_turn_size > max_turn_size or len(inputs) > turn_tokens_threshold:
+            resets += 1
+            if policy == "kv_surgery":
+                recent_start = max(prompt_len, len(inputs) - sum(len(x) for x in prompt_inputs[-history_context:]))
+                inputs = inputs[:prompt_len] + inputs[recent_start:]
+                cache_len = len(inputs) - 1
+                valid_turn_size = prompt_context + history_context
+            else:
+                prompt_text_bound = max(prompt_context, len(history_inputs) - history_text_context - history_context)
+                inputs = list(chain.from_iterable(
+                    history_inputs[:prompt_context] +
+                    history_inputs[prompt_text_bound:-history_context] +
+                    prompt_inputs[-history_context:]
+                ))
+                valid_turn_size = prompt_context + len(history_inputs) - prompt_text_bound
+                # a fresh cache, the prefix cache can serve the speaker prompt block
+                cache_len = prompt_len if policy == "prefix_cache" else 0
+        valid_turn_size += 1
+
+        text = [0] * rng.randint(*text_len)
+        speech = [0] * (rng.randint(*speech_len) + 1)
+        inputs.extend(text)
+        prefill_tokens += len(inputs) - cache_len
+        inputs.extend(speech)
+        # every token but the last sampled one is in the cache after the turn
+        cache_len = len(inputs) - 1
+        prompt_inputs.append(text + speech)
+        history_inputs.append(text[:-1])
+    return prefill_tokens, resets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1988)
+    args = parser.parse_args()
+
+    results = {policy: simulate(args.turns, policy, seed=args.seed)
+               for policy in ("re_prefill", "prefix_cache", "kv_surgery")}
+    baseline = results["re_prefill"][0]
+    print(f"turns={args.turns}")
+    for policy, (prefill_tokens, resets) in results.items():
+        print(f"{policy:<13} prefill tokens {prefill_tokens:>9d}  resets {resets:>4d}  "
+              f"({prefill_tokens / baseline:.2%} of re_prefill)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the RAS token selection step: the previous implementation (two softmax +
+multinomial, one host sync per step) against `_ras_next_tokens`.
+
+    PYTHONPATH=. python benchmarks/bench_ras_sampler.py --batch_size 1 --steps 200
+"""
+import argparse
+import time
+
+import torch
+from torch import nn
+
+from soulxpodcast.models.modules.sampler import _ras_next_tokens
+
+
+def legacy_ras_step(input_ids, next_token_scores, next_token_logits, win_size=25, tau_r=0.2):
+    probs_candidate = nn.functional.softmax(next_token_scores, dim=-1)
+    next_tokens_candidate = torch.multinomial(probs_candidate, num_samples=1).squeeze(1)
+    rep_num = (input_ids[:, -win_size:] == next_tokens_candidate).sum().item() + 1
+    if rep_num >= win_size * tau_r:
+        next_token_scores = next_token_logits
+    probs = nn.functional.softmax(next_token_scores, dim=-1)
+    return torch.multinomial(probs, num_samples=1).squeeze(1)
+
+
+def vectorised_ras_step(input_ids, next_token_scores, next_token_logits, win_size=25, tau_r=0.2):
+    next_tokens, _ = _ras_next_tokens(input_ids, next_token_scores, next_token_logits,
+                                      do_sample=True, use_ras=True, win_size=win_size, tau_r=tau_r)
+    return next_tokens
+
+
+def make_inputs(batch_size, vocab_size, top_k, history_len, device):
+    next_token_logits = torch.randn(batch_size, vocab_size, device=device)
+    # top-k processed scores, as produced by the logits processors
+    kth = next_token_logits.topk(top_k, dim=-1).values[:, -1:]
+    next_token_scores = next_token_logits.masked_fill(next_token_logits < kth, -float("inf"))
+    input_ids = torch.randint(0, vocab_size, (batch_size, history_len), device=device)
+    return input_ids, next_token_scores, next_token_logits
+
+
+def bench(step_fn, inputs, steps, warmup, device):
+    for _ in range(warmup):
+        step_fn(*inputs)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(steps):
+        step_fn(*inputs)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return steps / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--vocab_size", type=int, default=159488)
+    parser.add_argument("--top_k", type=int, default=100)
+    parser.add_argument("--history_len", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(1988)
+    inputs = make_inputs(args.batch_size, args.vocab_size, args.top_k, args.history_len, device)
+
+    # the legacy step only supports batch 1
+    legacy = bench(legacy_ras_step, inputs, args.steps, args.warmup, device) if args.batch_size == 1 else None
+    vectorised = bench(vectorised_ras_step, inputs, args.steps, args.warmup, device)
+
+    print(f"device={device.type} batch_size={args.batch_size} vocab_size={args.vocab_size}")
+    if legacy is not None:
+        print(f"legacy      {legacy:10.1f} steps/s")
+    print(f"vectorised  {vectorised:10.1f} steps/s")
+    if legacy is not None:
+        print(f"speedup     {vectorised / legacy:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
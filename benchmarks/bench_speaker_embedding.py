@@ -0,0 +1,56 @@
+"""
+CAM++ speaker embeddings of one request: one single-threaded session running the prompts one by one as before,
+against `SpeakerEmbedder` session pools of `--sessions` sizes, with the per-call latency they report and the
+max difference of their x-vectors. Prompts are 16 kHz noise bursts of `--seconds` lengths, equal lengths share a batched run.
+
+    PYTHONPATH=. python benchmarks/bench_speaker_embedding.py --model_path pretrained_models/SoulX-Podcast-1.7B --seconds 6 8 10 12
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from soulxpodcast.utils.speaker_embedding import SpeakerEmbedder
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", required=True, help="model directory holding campplus.onnx")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[6, 8, 10, 12], help="length of every prompt of the request")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--threads", type=int, default=1, help="intra-op threads of every pooled session")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(1988)
+    audios = []
+    for seconds in args.seconds:
+        num_samples = int(seconds * 16000)
+        envelope = torch.sin(torch.linspace(0, seconds * np.pi, num_samples)).abs()
+        audios.append(0.3 * envelope * torch.randn(num_samples, generator=generator))
+
+    serial = SpeakerEmbedder(f"{args.model_path}/campplus.onnx", num_sessions=1, num_threads=1)
+    reference = None
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        reference = [serial([audio])[0] for audio in audios]
+    serial_time = (time.perf_counter() - start) / args.repeats
+    print(f"prompts={args.seconds} s")
+    print(f"{'sessions':>9}{'threads':>8}{'ms/request':>12}{'speedup':>9}{'p50 ms':>8}{'p95 ms':>8}{'max |diff|':>12}")
+    print(f"{'serial':>9}{1:>8}{serial_time * 1000:>12.1f}{1.0:>8.2f}x{'':>16}{0.0:>12.2e}")
+    for num_sessions in args.sessions:
+        embedder = SpeakerEmbedder(f"{args.model_path}/campplus.onnx", num_sessions=num_sessions, num_threads=args.threads)
+        embeddings = embedder(audios)  # warm-up
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            embeddings = embedder(audios)
+        pool_time = (time.perf_counter() - start) / args.repeats
+        stats = embedder.stats.as_dict()
+        diff = max(np.abs(np.array(a) - np.array(b)).max() for a, b in zip(reference, embeddings))
+        print(f"{num_sessions:>9}{args.threads:>8}{pool_time * 1000:>12.1f}{serial_time / pool_time:>8.2f}x"
+              f"{stats['p50_ms']:>8.1f}{stats['p95_ms']:>8.1f}{diff:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
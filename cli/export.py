@@ -0,0 +1,14 @@
+import argparse
+
+from soulxpodcast.utils.export import EXPORT_DTYPES, export_acoustic
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the flow and HiFT checkpoints as one inference artifact")
+    parser.add_argument("--model_path", required=True, help="Path to the model directory holding flow.pt and hift.pt")
+    parser.add_argument("--output_path", default=None, help="Artifact path, <model_path>/acoustic.safetensors by default, which is where the model looks for it")
+    parser.add_argument("--dtype", default="float32", choices=list(EXPORT_DTYPES), help="Storage dtype of the weights")
+    args = parser.parse_args()
+
+    output_path = export_acoustic(args.model_path, args.output_path, args.dtype)
+    print(f"[INFO] Saved acoustic artifact to: {output_path}")
@@ -0,0 +1,28 @@
+import sys
+import argparse
+
+from soulxpodcast.utils.export import check_onnx_parity, export_onnx
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the flow and HiFT as ONNX graphs for acoustic_backend=onnx")
+    parser.add_argument("--model_path", required=True, help="Path to the model directory holding flow.pt and hift.pt")
+    parser.add_argument("--output_dir", default=None, help="Graph directory, <model_path>/onnx by default, which is where the model looks for them")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--speech_tokenizer_onnx", default=None, help="speech_tokenizer_v2.onnx of CosyVoice2 to serve the speech tokenizer through ORT")
+    parser.add_argument("--atol", type=float, default=1e-3, help="Max absolute difference allowed between ORT and eager outputs")
+    parser.add_argument("--skip_check", action="store_true", help="Skip the ORT / eager parity check")
+    args = parser.parse_args()
+
+    paths = export_onnx(args.model_path, args.output_dir, args.opset, args.speech_tokenizer_onnx)
+    for part, path in paths.items():
+        print(f"[INFO] Saved {part} graph to: {path}")
+    if args.skip_check:
+        sys.exit(0)
+
+    failed = False
+    for part, diff in check_onnx_parity(args.model_path, args.output_dir).items():
+        status = "OK" if diff <= args.atol else "MISMATCH"
+        failed |= diff > args.atol
+        print(f"[INFO] {part:<20} max |ORT - eager| {diff:.3e} {status}")
+    sys.exit(1 if failed else 0)
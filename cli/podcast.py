@@ -1,10 +1,10 @@
 import os
 import json
-import torch
 import argparse
 
 import s3tokenizer
 import soundfile as sf
+import torch
 
 from soulxpodcast.config import SamplingParams
 from soulxpodcast.utils.parser import podcast_format_parser
@@ -18,9 +18,12 @@ def run_inference(
     llm_engine: str = "hf",
     fp16_flow: bool = False,
     seed: int = 1988,
+    device: str = "auto",
+    num_threads: int = 0,
+    cpu_dtype: str = "float32",
 ):
     
-    model, dataset = initiate_model(seed, model_path, llm_engine, fp16_flow)
+    model, dataset = initiate_model(seed, model_path, llm_engine, fp16_flow, device, num_threads, cpu_dtype)
     
     data = process_single_input(
         dataset,
@@ -32,39 +35,85 @@ def run_inference(
     )
 
     print("[INFO] Start inference...")
-    results_dict = model.forward_longform(**data)
-
-    target_audio = None
-    for wav in results_dict["generated_wavs"]:
-        if target_audio is None:
-            target_audio = wav
-        else:
-            target_audio = torch.cat([target_audio, wav], dim=1)
-
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    sf.write(output_path, target_audio.cpu().squeeze(0).numpy(), 24000)
+    # write every turn as soon as it is rendered instead of holding the whole podcast
+    with sf.SoundFile(output_path, "w", samplerate=24000, channels=1) as f:
+        for record in model.forward_longform_stream(**data):
+            f.write(record["wav"].cpu().squeeze(0).numpy())
+            timings = record["timings"]
+            print(f"[INFO] Turn {record['turn_index']} (S{record['spk_id'] + 1}): {record['num_tokens']} tokens, "
+                  f"llm {timings['llm']:.2f}s, acoustic {timings['acoustic']:.2f}s, elapsed {timings['elapsed']:.2f}s")
     print(f"[INFO] Saved synthesized audio to: {output_path}")
 
 
+def run_batch_inference(
+    inputs_list: list[dict],
+    model_path: str,
+    output_paths: list[str],
+    llm_engine: str = "hf",
+    fp16_flow: bool = False,
+    seed: int = 1988,
+    device: str = "auto",
+    num_threads: int = 0,
+    cpu_dtype: str = "float32",
+):
+    """Synthesize several podcasts at once, their turns share the LLM batches."""
+    model, dataset = initiate_model(seed, model_path, llm_engine, fp16_flow, device, num_threads, cpu_dtype)
+
+    dialogues = [
+        process_single_input(
+            dataset,
+            inputs['text'],
+            inputs['prompt_wav'],
+            inputs['prompt_text'],
+            inputs['use_dialect_prompt'],
+            inputs['dialect_prompt_text'],
+        )
+        for inputs in inputs_list
+    ]
+
+    print(f"[INFO] Start inference of {len(dialogues)} podcasts...")
+    results = model.forward_longform_batch(dialogues)
+    for result, output_path in zip(results, output_paths):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        wav = torch.cat(result["generated_wavs"], dim=1).cpu().squeeze(0).numpy()
+        sf.write(output_path, wav, 24000)
+        print(f"[INFO] Saved synthesized audio to: {output_path}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser = argparse.ArgumentParser()
-    parser.add_argument("--json_path", required=True, help="Path to the input JSON file")
+    parser.add_argument("--json_path", required=True, nargs="+",
+                        help="Path to the input JSON file, several files are decoded together")
     parser.add_argument("--model_path", required=True, help="Path to the model file")
-    parser.add_argument("--output_path", default="outputs/result.wav", help="Path to the output audio file")
+    parser.add_argument("--output_path", default="outputs/result.wav",
+                        help="Path to the output audio file, with several JSON files the audios are named after them in its directory")
     parser.add_argument("--llm_engine", default="hf", choices=["hf", "vllm"], help="Inference engine to use")
     parser.add_argument("--fp16_flow", action="store_true", help="Enable FP16 flow")
     parser.add_argument("--seed", type=int, default=1988, help="Random seed")
+    parser.add_argument("--device", default="auto", help="Device to run on: auto, cpu, cuda or cuda:N")
+    parser.add_argument("--num_threads", type=int, default=0, help="CPU intra-op threads, 0 keeps the torch default")
+    parser.add_argument("--cpu_dtype", default="float32", choices=["float32", "bfloat16"], help="Compute dtype on CPU")
     args = parser.parse_args()
 
-    with open(args.json_path, "r") as f:
-        data = json.load(f)
-    inputs = podcast_format_parser(data)
-    run_inference(
-        inputs=inputs,
+    inputs_list = []
+    for json_path in args.json_path:
+        with open(json_path, "r") as f:
+            inputs_list.append(podcast_format_parser(json.load(f)))
+    engine_args = dict(
         model_path=args.model_path,
-        output_path=args.output_path,
         llm_engine=args.llm_engine,
         fp16_flow=args.fp16_flow,
         seed=args.seed,
+        device=args.device,
+        num_threads=args.num_threads,
+        cpu_dtype=args.cpu_dtype,
     )
+    if len(inputs_list) == 1:
+        run_inference(inputs=inputs_list[0], output_path=args.output_path, **engine_args)
+    else:
+        output_dir = os.path.dirname(args.output_path)
+        output_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(json_path))[0] + ".wav")
+                        for json_path in args.json_path]
+        run_batch_inference(inputs_list=inputs_list, output_paths=output_paths, **engine_args)
@@ -18,9 +18,12 @@ def run_inference(
     llm_engine: str = "hf",
     fp16_flow: bool = False,
     seed: int = 1988,
+    device: str = "auto",
+    num_threads: int = 0,
+    cpu_dtype: str = "float32",
 ):
     
-    model, dataset = initiate_model(seed, model_path, llm_engine, fp16_flow)
+    model, dataset = initiate_model(seed, model_path, llm_engine, fp16_flow, device, num_threads, cpu_dtype)
     
     data = process_single_input(
         dataset,
@@ -58,6 +61,9 @@ if __name__ == "__main__":
     parser.add_argument("--llm_engine", default="hf", choices=["hf", "vllm"], help="Inference engine to use")
     parser.add_argument("--fp16_flow", action="store_true", help="Enable FP16 flow")
     parser.add_argument("--seed", type=int, default=1988, help="Random seed")
+    parser.add_argument("--device", default="auto", help="Device to run on: auto, cpu, cuda or cuda:N")
+    parser.add_argument("--num_threads", type=int, default=0, help="CPU intra-op threads, 0 keeps the torch default")
+    parser.add_argument("--cpu_dtype", default="float32", choices=["float32", "bfloat16"], help="Compute dtype on CPU")
     args = parser.parse_args()
 
     data = {
@@ -80,4 +86,7 @@ if __name__ == "__main__":
         llm_engine=args.llm_engine,
         fp16_flow=args.fp16_flow,
         seed=args.seed,
+        device=args.device,
+        num_threads=args.num_threads,
+        cpu_dtype=args.cpu_dtype,
     )
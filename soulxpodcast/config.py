@@ -40,6 +40,7 @@ class SoulXPodcastLLMConfig:
     qkv_bias: bool = False
     fp16_flow: bool = False
     speech_token_offset: int = 152927
+    speech_vocab_size: int = 6561
 
     @classmethod
     def from_initial_and_json(
@@ -116,6 +117,15 @@ class SamplingParams:
     use_ras: bool = True
     win_size: int = 25
     tau_r: float = 0.2
+    # seed of the vLLM draw of this request, which `torch.manual_seed` does not reach; None uses the engine generator
+    seed: int | None = None
+    # Flow ODE overrides of this request, None falls back to `Config.flow_solver` / `Config.flow_n_timesteps`
+    flow_solver: str | None = None
+    flow_n_timesteps: int | None = None
+    flow_cfg_interval: tuple[float, float] | None = None
+    flow_cfg_stride: int | None = None
+    flow_cfg_reuse: bool | None = None
+    flow_deep_cache_interval: int | None = None
 
 
 @dataclass
@@ -134,9 +144,49 @@ class Config:
     prompt_context: int = 2 # default to 2 for two-speaker podcast;
     history_context: int = 2
     history_text_context: int = 2
+
+    prefix_cache_size_mb: int = 1024 # KV budget of the cross-request prompt prefix cache (hf engine), 0 to disable;
+    speaker_cache_size: int = 16 # speakers whose prompt tokens and flow conditioning are kept across requests, 0 to disable;
+    feature_store_dir: str | None = None # on-disk prompt feature store keyed by audio content, None keeps it in memory only;
+    feature_store_size: int = 64 # prompts whose audio features and speech tokens are kept in memory, 0 disables the store;
+    dialect_cache_size: int = 64 # dialect prompt generations kept across requests, 0 to disable;
+    dialect_cache_dir: str | None = None # on-disk store of the dialect prompt generations, None keeps them in memory only;
+    campplus_sessions: int = 4 # CAM++ sessions of the speaker embedder, prompts of different lengths run concurrently;
+    campplus_threads: int = 1 # intra-op threads of every CAM++ session;
+
+    pipeline_acoustic: bool = False # render flow + hift of finished turns while the LLM decodes the next ones;
+    pipeline_queue_size: int = 4 # max turns waiting for the acoustic stage;
+    flow_batch_size: int = 1 # turns rendered by one flow call, 1 renders every turn right after its LLM step;
+    flow_bucket_ratio: float = 1.25 # max longest / shortest token length inside a flow batch;
+    stream_chunk_tokens: int = 25 # speech tokens per chunk of chunk streaming, one encoder chunk;
+    stream_context_chunks: int = 4 # encoder chunks of emitted frames the flow of chunk streaming still attends to, bounds the cost of a chunk;
+    speech_vocab_decoding: bool = False # LM head, processors and sampling over the speech tokens + eos only (hf engine);
+    kv_surgery: bool = False # on history reset, cut the middle turns out of the KV cache instead of re-prefilling (hf engine);
+    flow_solver: str = "euler" # flow ODE solver: euler, heun, midpoint, rk4 or dpm_multistep;
+    flow_n_timesteps: int = 15 # flow ODE steps, e.g. dpm_multistep with 6 steps for a few-step preset;
+    flow_cfg_interval: tuple[float, float] = (0.0, 1.0) # flow times whose estimator calls may apply CFG, the others run at half batch;
+    flow_cfg_stride: int = 1 # apply CFG on every n-th estimator call inside the interval;
+    flow_cfg_reuse: bool = False # calls without CFG add the guidance delta of the last guided call;
+    flow_deep_cache_interval: int = 1 # run the deep flow estimator blocks on every n-th call only and reuse their output in between, 1 disables;
+    hift_window_frames: int = 0 # mel frames (50 per second) per HiFT window of long turns to bound their memory, e.g. 500; longer turns then differ slightly from whole-turn HiFT; 0 vocodes every turn whole;
+    hift_window_overlap: int = 48 # mel frames shared by consecutive HiFT windows, cross-faded over their middle half;
+    hift_batch_size: int = 4 # HiFT windows decoded together, across the turns of a flow batch;
+    acoustic_backend: str = "torch" # "torch", "onnx" runs the graphs of <model>/onnx (cli/export_onnx.py) through ONNX Runtime, "compile" runs torch.compile graphs per length bucket;
+    onnx_num_threads: int = 0 # ONNX Runtime intra-op threads, 0 keeps the ORT default;
+    compile_buckets: tuple[int, ...] = (128, 256, 512, 1024) # flow token lengths (prompt + turn) padded to and compiled for, longer turns run eagerly;
+    compile_backend: str = "inductor" # torch.compile backend of acoustic_backend="compile";
+    compile_warmup: bool = True # compile every bucket at startup instead of on the first turns;
+
+    device: str = "auto" # "auto", "cpu", "cuda" or "cuda:<index>", auto picks cuda when available;
+    num_threads: int = 0 # intra-op CPU threads (torch.set_num_threads), 0 keeps the torch default;
+    cpu_dtype: str = "float32" # LLM weights and flow autocast dtype on CPU, "float32" or "bfloat16";
     
     def __post_init__(self):
         assert os.path.isdir(self.model)
+        if self.device == "auto":
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        assert self.cpu_dtype in ("float32", "bfloat16"), f"Unsupported cpu_dtype: {self.cpu_dtype}"
+        assert self.acoustic_backend in ("torch", "onnx", "compile"), f"Unsupported acoustic_backend: {self.acoustic_backend}"
 
         max_pos = getattr(self.hf_config, "max_position_embeddings", 8192)
         self.max_model_len = min(self.max_model_len, max_pos)
\ No newline at end of file
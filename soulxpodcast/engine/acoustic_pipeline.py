@@ -0,0 +1,111 @@
+import queue
+import threading
+from typing import Callable
+
+import torch
+
+
+_DONE = object()
+
+
+class AcousticPipeline:
+    """
+    Background executor for the acoustic stage (flow + HiFT) of finished turns.
+
+    The LLM loop submits one job per turn and keeps decoding the next turn while
+    a single worker renders the queued ones, so the results come back in
+    submission order. On CUDA the worker runs on its own stream; elsewhere it
+    falls back to a plain thread.
+
+    Args:
+        render_fn: callable rendering one job, called as render_fn(*job).
+        device: device the acoustic models live on.
+        max_pending: bound of the job queue, submit blocks when it is full.
+    """
+
+    def __init__(self, render_fn: Callable, device: torch.device | str, max_pending: int = 4):
+        self.render_fn = render_fn
+        self.device = torch.device(device)
+        self.jobs = queue.Queue(maxsize=max(1, max_pending))
+        self.outputs = queue.Queue()
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        self.num_submitted = 0
+        self.num_collected = 0
+        self.worker = threading.Thread(target=self._run, name="acoustic-pipeline", daemon=True)
+        self.worker.start()
+
+    def _run(self):
+        # inference mode is thread local
+        with torch.inference_mode():
+            while True:
+                item = self.jobs.get()
+                if item is _DONE:
+                    break
+                ready, job = item
+                try:
+                    if self.stream is not None:
+                        self.stream.wait_event(ready)
+                        with torch.cuda.stream(self.stream):
+                            output = self.render_fn(*job)
+                        self.stream.synchronize()
+                    else:
+                        output = self.render_fn(*job)
+                    self.outputs.put((True, output))
+                except BaseException as e:
+                    self.outputs.put((False, e))
+
+    def submit(self, *job):
+        """Queue one job, blocks while `max_pending` jobs are waiting."""
+        ready = None
+        if self.stream is not None:
+            # inputs were produced on the caller's stream
+            ready = torch.cuda.Event()
+            ready.record(torch.cuda.current_stream(self.device))
+        self.jobs.put((ready, job))
+        self.num_submitted += 1
+
+    def _collect(self, block: bool):
+        success, output = self.outputs.get(block=block)
+        self.num_collected += 1
+        if not success:
+            self.close(cancel=True)
+            raise output
+        return output
+
+    def poll(self) -> list:
+        """Return the outputs finished so far without waiting."""
+        outputs = []
+        while self.num_collected < self.num_submitted:
+            try:
+                outputs.append(self._collect(block=False))
+            except queue.Empty:
+                break
+        return outputs
+
+    def drain(self) -> list:
+        """Wait for every submitted job and return the outputs not collected yet."""
+        outputs = []
+        while self.num_collected < self.num_submitted:
+            outputs.append(self._collect(block=True))
+        return outputs
+
+    def close(self, cancel: bool = False):
+        """
+        Stop the worker once the queued jobs are rendered, or with `cancel` (an abandoned stream, a failed
+        job) drop the queued jobs first, so that only the one in progress is waited for.
+        """
+        if cancel:
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+        if self.worker.is_alive():
+            self.jobs.put(_DONE)
+            self.worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(cancel=exc_type is not None)
@@ -0,0 +1,224 @@
+import contextlib
+import math
+import time
+from collections import defaultdict
+
+import torch
+import torch.nn.functional as F
+
+# speech token lengths the flow and HiFT are compiled for, longer inputs run eagerly
+COMPILE_BUCKETS = (128, 256, 512, 1024)
+
+
+def bucket_length(length: int, buckets: tuple[int, ...]) -> int | None:
+    """Smallest bucket holding `length`, None when it is longer than all of them."""
+    for bucket in sorted(buckets):
+        if length <= bucket:
+            return bucket
+    return None
+
+
+class BucketStats:
+    """Compilations and calls of one compiled part at one bucket."""
+
+    def __init__(self):
+        self.compiles = 0
+        self.compile_seconds = 0.0
+        self.hits = 0
+        self.timed_hits = 0
+        self.hit_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "compiles": self.compiles,
+            "compile_seconds": self.compile_seconds,
+            "hits": self.hits,
+            "mean_hit_seconds": self.hit_seconds / self.timed_hits if self.timed_hits else 0.0,
+        }
+
+
+class CompileStats:
+    """
+    {(part, bucket): BucketStats} of the compiled modules, plus the calls that ran eagerly for lack of a bucket.
+    A call whose shapes and flags were not seen yet at its bucket is counted as a compilation, with its wall
+    time, the others as cache hits. Hits are only counted, so that the compiled calls keep overlapping with
+    the GPU; `time_hits` synchronizes and times them too, for benchmarks.
+    """
+
+    def __init__(self, time_hits: bool = False):
+        self.buckets = defaultdict(BucketStats)
+        self.eager = defaultdict(int)
+        self.time_hits = time_hits
+        self._seen = set()
+
+    def _timed_call(self, fn, args) -> tuple:
+        device = next((x.device for x in args if isinstance(x, torch.Tensor)), None)
+        start = time.perf_counter()
+        output = fn(*args)
+        if device is not None and device.type == "cuda":
+            torch.cuda.synchronize(device)
+        return output, time.perf_counter() - start
+
+    def timed(self, part: str, bucket: int, key: tuple, fn, *args):
+        stats = self.buckets[part, bucket]
+        if (part, bucket, key) not in self._seen:
+            self._seen.add((part, bucket, key))
+            output, elapsed = self._timed_call(fn, args)
+            stats.compiles += 1
+            stats.compile_seconds += elapsed
+            return output
+        stats.hits += 1
+        if not self.time_hits:
+            return fn(*args)
+        output, elapsed = self._timed_call(fn, args)
+        stats.timed_hits += 1
+        stats.hit_seconds += elapsed
+        return output
+
+    def summary(self) -> dict:
+        return {
+            "buckets": {f"{part}/{bucket}": stats.as_dict() for (part, bucket), stats in sorted(self.buckets.items())},
+            "eager": dict(self.eager),
+        }
+
+
+# log-mel of silence, the floor of `dynamic_range_compression_torch`
+SILENCE_LOG_MEL = math.log(1e-5)
+
+
+def _pad_time(x: torch.Tensor | None, length: int, value: float = 0.0) -> torch.Tensor | None:
+    return None if x is None else F.pad(x, (0, length - x.size(-1)), value=value)
+
+
+class CompiledEstimator(torch.nn.Module):
+    """
+    Flow estimator (`CausalConditionalDecoder.forward`) compiled per mel length bucket. Inputs are right padded
+    with a zero mask to their bucket; the estimator convs are causal and its attention masks padded keys, so
+    the unpadded frames are those of the eager call.
+
+    It has no `prepare_conditioning`, so the ODE solvers call it once per step with the full inputs;
+    deep feature reuse does not apply.
+    """
+
+    def __init__(self, estimator: torch.nn.Module, buckets: tuple[int, ...], stats: CompileStats, backend: str = "inductor"):
+        super().__init__()
+        self.estimator = estimator
+        self.buckets = buckets
+        self.stats = stats
+        self.compiled = torch.compile(estimator, backend=backend, dynamic=False)
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, streaming=False):
+        num_frames = x.size(2)
+        bucket = bucket_length(num_frames, self.buckets)
+        if bucket is None:
+            self.stats.eager["estimator"] += 1
+            return self.estimator(x, mask, mu, t, spks, cond, streaming)
+        x, mask, mu, cond = (_pad_time(v, bucket) for v in (x, mask, mu, cond))
+        output = self.stats.timed("estimator", bucket, (x.size(0), x.dtype, streaming),
+                                  self.compiled, x, mask, mu, t, spks, cond, streaming)
+        return output[:, :, :num_frames]
+
+
+class CompiledEncoder(torch.nn.Module):
+    """
+    Flow encoder compiled per token length bucket, for calls without lookahead context (the last chunk of a
+    stream and offline synthesis); padded frames are masked. Calls with context, whose lookahead frames must
+    follow the last real token, and `forward_chunk` stay on the eager `encoder`.
+    """
+
+    def __init__(self, encoder: torch.nn.Module, buckets: tuple[int, ...], stats: CompileStats, backend: str = "inductor"):
+        super().__init__()
+        self.encoder = encoder
+        self.buckets = buckets
+        self.stats = stats
+        self.static_chunk_size = encoder.static_chunk_size
+        self.up_stride = encoder.up_layer.stride
+        self.compiled = torch.compile(encoder, backend=backend, dynamic=False)
+
+    def output_size(self) -> int:
+        return self.encoder.output_size()
+
+    def forward_chunk(self, *args, **kwargs):
+        return self.encoder.forward_chunk(*args, **kwargs)
+
+    def forward(self, xs, xs_lens, context=torch.zeros(0, 0, 0), decoding_chunk_size=0, num_decoding_left_chunks=-1,
+                streaming=False):
+        num_tokens = xs.size(1)
+        bucket = bucket_length(num_tokens, self.buckets)
+        if context.size(1) != 0 or bucket is None:
+            self.stats.eager["encoder"] += 1
+            return self.encoder(xs, xs_lens, context=context, streaming=streaming)
+        xs = F.pad(xs, (0, 0, 0, bucket - num_tokens))
+        h, masks = self.stats.timed("encoder", bucket, (xs.size(0), xs.dtype, streaming),
+                                    lambda xs, xs_lens: self.compiled(xs, xs_lens, streaming=streaming), xs, xs_lens)
+        num_frames = num_tokens * self.up_stride
+        return h[:, :num_frames], masks[:, :, :num_frames]
+
+
+class CompiledHiFTDecoder:
+    """
+    HiFT upsampling stack (`HiFTGenerator.decode_spec`) compiled per mel length bucket, the STFT and iSTFT stay
+    eager. The log-mel is padded with silence (`SILENCE_LOG_MEL`) and the source STFT with zeros. The stack is
+    not causal: the last frames of a padded mel see the activations of that silence instead of the zero
+    padding of its convs, a small difference within its receptive field, which the cross-faded windows of
+    `VocoderEngine` discard everywhere but at the end of a turn, where the speech fades to silence anyway.
+    """
+
+    def __init__(self, hift: torch.nn.Module, buckets: tuple[int, ...], stats: CompileStats, backend: str = "inductor"):
+        self.hift = hift
+        self.buckets = buckets
+        self.stats = stats
+        # source STFT frames per mel frame
+        self.stft_frames_per_mel = int(hift.f0_upsamp.scale_factor) // hift.istft_params["hop_len"]
+        self.compiled = torch.compile(hift.decode_spec, backend=backend, dynamic=False)
+
+    def __call__(self, x: torch.Tensor, s_stft: torch.Tensor) -> torch.Tensor:
+        num_frames = x.size(2)
+        bucket = bucket_length(num_frames, self.buckets)
+        if bucket is None:
+            self.stats.eager["hift"] += 1
+            return self.hift.decode_spec(x, s_stft)
+        num_stft_frames = s_stft.size(2)
+        stft_bucket = num_stft_frames + (bucket - num_frames) * self.stft_frames_per_mel
+        x, s_stft = _pad_time(x, bucket, SILENCE_LOG_MEL), _pad_time(s_stft, stft_bucket)
+        output = self.stats.timed("hift", bucket, (x.size(0), x.dtype), self.compiled, x, s_stft)
+        return output[:, :, :num_stft_frames]
+
+
+def apply_compile_backend(flow: torch.nn.Module, hift: torch.nn.Module, buckets: tuple[int, ...] = COMPILE_BUCKETS,
+                          backend: str = "inductor", time_hits: bool = False) -> CompileStats:
+    """
+    Swap the flow estimator, the flow encoder and the HiFT upsampling stack for their bucketed compiled
+    versions. `buckets` are speech token lengths: mel lengths are `flow.token_mel_ratio` times longer.
+    `time_hits` times every compiled call, not only the compilations, at the cost of a GPU sync each.
+
+    Returns:
+        the CompileStats shared by the three parts.
+    """
+    stats = CompileStats(time_hits)
+    mel_buckets = tuple(bucket * flow.token_mel_ratio for bucket in buckets)
+    # one graph per bucket, batch size, dtype and attention mode, beyond the default recompile limit
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 8 * len(buckets))
+    flow.decoder.estimator = CompiledEstimator(flow.decoder.estimator, mel_buckets, stats, backend)
+    flow.encoder = CompiledEncoder(flow.encoder, buckets, stats, backend)
+    hift.spec_decoder = CompiledHiFTDecoder(hift, mel_buckets, stats, backend)
+    return stats
+
+
+@torch.inference_mode()
+def warmup_compiled(flow: torch.nn.Module, vocoder, buckets: tuple[int, ...] = COMPILE_BUCKETS,
+                    flow_autocast=contextlib.nullcontext, **flow_options):
+    """
+    Compile every bucket ahead of the first request: one offline flow call on a single turn of each bucket
+    length, under `flow_autocast()` and with the solver options of the requests, and the vocoding of its mel.
+    Other flow batch sizes and the chunk streaming calls compile on first use.
+    """
+    device = next(flow.parameters()).device
+    embedding = torch.zeros(1, flow.spk_embed_affine_layer.in_features, device=device)
+    prompt_feat = torch.zeros(1, 0, flow.output_size, device=device)
+    for bucket in sorted(buckets):
+        token = torch.zeros(1, bucket, dtype=torch.long, device=device)
+        with flow_autocast():
+            mel, _ = flow(token, torch.tensor([bucket], device=device), prompt_feat, torch.tensor([0], device=device),
+                          embedding, streaming=False, finalize=True, **flow_options)
+        vocoder([mel])
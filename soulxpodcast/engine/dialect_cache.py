@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Optional
+
+from soulxpodcast.config import SamplingParams
+
+# fields of `SamplingParams` that change the tokens drawn by the LLM
+SAMPLING_FIELDS = ("temperature", "repetition_penalty", "top_k", "top_p", "min_tokens", "max_tokens",
+                   "stop_token_ids", "use_ras", "win_size", "tau_r")
+# files of a model directory that identify its weights
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".onnx")
+
+
+def model_fingerprint(model: str) -> str:
+    """
+    Identity of the model directory: the contents of its JSON configs and the name, size and modification
+    time of its weight files, so that other weights under the same path never share cache entries.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model)):
+        path = os.path.join(model, name)
+        if not os.path.isfile(path):
+            continue
+        if name.endswith(".json"):
+            digest.update(name.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        elif name.endswith(WEIGHT_SUFFIXES):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def dialect_prompt_key(model_id: str, llm_engine: str, audio_key: str, prompt_input: list[int],
+                       sampling_params: SamplingParams | list[SamplingParams], seed: int) -> str:
+    """
+    Key of one dialect prompt generation: the model (`model_fingerprint`) and the LLM engine decoding it, the
+    prompt audio hash (`prompt_audio_key`), the LLM input (prompt text, prompt speech tokens and dialect text
+    tokens), the sampling params and the seed of the draw. The engines draw differently from the same seed.
+    """
+    sampling_param = sampling_params[0] if isinstance(sampling_params, (list, tuple)) else sampling_params
+    params = {name: value for name, value in asdict(sampling_param).items() if name in SAMPLING_FIELDS}
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model_id, llm_engine, audio_key, params, seed]).encode())
+    digest.update(b"\0")
+    digest.update(json.dumps(prompt_input).encode())
+    return digest.hexdigest()
+
+
+class DialectPromptCache:
+    """
+    Speech tokens generated for the dialect chain-of-thought prompts, so that a dialect request pays the
+    extra LLM generation of each speaker only once per prompt, dialect text, sampling params and seed.
+
+    Entries live in an in-process LRU of `max_entries` generations, in front of an optional on-disk store
+    under `root`: one JSON file of token ids per key, written through a temporary name and renamed.
+
+    Args:
+        max_entries: generations kept in memory, 0 disables the cache.
+        root: directory of the on-disk store, None keeps the generations in memory only.
+    """
+
+    def __init__(self, max_entries: int, root: str | None = None):
+        self.max_entries = max_entries
+        self.root = root
+        self.entries: OrderedDict[str, list[int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, token_ids: list[int]):
+        self.entries[key] = token_ids
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[list[int]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.lookups += 1
+            token_ids = self.entries.get(key)
+            if token_ids is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return token_ids
+        if self.root is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), "r", encoding="utf-8") as f:
+            token_ids = json.load(f)
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, token_ids)
+        return token_ids
+
+    def put(self, key: str, token_ids: list[int]):
+        if not self.enabled:
+            return
+        token_ids = list(token_ids)
+        if self.root is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(token_ids, f)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(key, token_ids)
+
+    def clear(self):
+        """Drop the in-memory entries, the on-disk store is kept."""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / self.lookups if self.lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "root": self.root,
+        }
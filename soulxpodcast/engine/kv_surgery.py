@@ -0,0 +1,41 @@
+import torch
+
+
+def rotate_half(x: torch.Tensor) -> torch.Tensor:
+    x1, x2 = x[..., : x.shape[-1] // 2], x[..., x.shape[-1] // 2:]
+    return torch.cat((-x2, x1), dim=-1)
+
+
+def shift_rope(keys: torch.Tensor, delta: int, inv_freq: torch.Tensor) -> torch.Tensor:
+    """
+    Move RoPE-rotated keys by `delta` positions.
+
+    Rotations compose, so a key cached at position p becomes the key at p + delta
+    by rotating it once more by delta * inv_freq.
+
+    Args:
+        keys: [B, H, T, D] keys after RoPE.
+        inv_freq: [D / 2] inverse frequencies of the rotary embedding.
+    """
+    angles = delta * inv_freq.to(device=keys.device, dtype=torch.float32)
+    emb = torch.cat((angles, angles), dim=-1)
+    cos, sin = emb.cos(), emb.sin()
+    shifted = keys.float() * cos + rotate_half(keys.float()) * sin
+    return shifted.to(keys.dtype)
+
+
+def evict_kv_span(past_key_values, start: int, end: int, inv_freq: torch.Tensor):
+    """
+    Drop the positions [start, end) from every layer of a DynamicCache, in place.
+
+    The keys after the span are moved back by end - start positions, so the cache
+    reads as if the evicted tokens had never been there and decoding goes on
+    without a re-prefill.
+    """
+    if end <= start:
+        return
+    for layer in past_key_values.layers:
+        keys, values = layer.keys, layer.values
+        tail_keys = shift_rope(keys[:, :, end:], start - end, inv_freq)
+        layer.keys = torch.cat([keys[:, :, :start], tail_keys], dim=2)
+        layer.values = torch.cat([values[:, :, :start], values[:, :, end:]], dim=2)
@@ -7,8 +7,12 @@ from dataclasses import fields, asdict
 
 import torch
 import torch.multiprocessing as mp
-from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, StoppingCriteriaList
 from transformers import EosTokenCriteria, RepetitionPenaltyLogitsProcessor
+from transformers import (
+    LogitsProcessorList, MinNewTokensLengthLogitsProcessor,
+    TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+)
 try:    
     from vllm import LLM
     from vllm import SamplingParams as VllmSamplingParams
@@ -17,8 +21,16 @@ try:
 except ImportError:
     SUPPORT_VLLM = False
 
-from soulxpodcast.config import Config, SamplingParams
-from soulxpodcast.models.modules.sampler import _ras_sample_hf_engine
+from soulxpodcast.config import AutoPretrainedConfig, Config, SamplingParams
+from soulxpodcast.engine.prefix_cache import RadixPrefixCache
+from soulxpodcast.engine.kv_surgery import evict_kv_span
+from soulxpodcast.models.modules.sampler import _ras_sample_hf_engine, SpeechVocabHead
+
+def _to_vllm_sampling_params(sampling_param: SamplingParams):
+    # the flow_* fields drive the acoustic stage, vLLM does not know them
+    params = {k: v for k, v in asdict(sampling_param).items() if not k.startswith("flow_")}
+    return VllmSamplingParams(**params)
+
 
 class HFLLMEngine:
 
@@ -29,25 +41,90 @@ class HFLLMEngine:
         
         self.tokenizer = AutoTokenizer.from_pretrained(model, use_fast=True)
         config.eos = config.hf_config.eos_token_id # speech eos token;
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        self.model = AutoModelForCausalLM.from_pretrained(model, torch_dtype=torch.bfloat16, device_map=self.device)
+        self.device = config.device
+        if torch.device(self.device).type == "cpu" and config.cpu_dtype == "float32":
+            torch_dtype = torch.float32
+        else:
+            torch_dtype = torch.bfloat16
+        self.model = AutoModelForCausalLM.from_pretrained(model, torch_dtype=torch_dtype, device_map=self.device)
         self.config = config
         self.pad_token_id = self.tokenizer.pad_token_id
+        if config.prefix_cache_size_mb > 0:
+            self.prefix_cache = RadixPrefixCache(max_bytes=config.prefix_cache_size_mb * 1024 * 1024)
+        else:
+            self.prefix_cache = None
+        if config.speech_vocab_decoding:
+            self.speech_vocab = SpeechVocabHead(
+                self.model.get_output_embeddings().weight,
+                speech_token_offset=config.hf_config.speech_token_offset,
+                speech_vocab_size=config.hf_config.speech_vocab_size,
+                eos_token_id=config.hf_config.eos_token_id,
+            )
+        else:
+            self.speech_vocab = None
+
+    def _sample_handler(self, sampling_param: SamplingParams, input_len: int, always: bool = False):
+        """custom_generate for `model.generate`, None keeps the default HF sampling."""
+        if self.speech_vocab is not None:
+            # same processors and order as HF (processors, then the custom repetition penalty, then warpers),
+            #    built for sub-vocabulary ids
+            speech_logits_processor = LogitsProcessorList([
+                MinNewTokensLengthLogitsProcessor(input_len, sampling_param.min_tokens,
+                                                  self.speech_vocab.eos_index, device=self.device),
+                RepetitionPenaltyLogitsProcessor(sampling_param.repetition_penalty, prompt_ignore_length=input_len),
+            ])
+            if sampling_param.temperature != 1.0:
+                speech_logits_processor.append(TemperatureLogitsWarper(sampling_param.temperature))
+            if sampling_param.top_k is not None and sampling_param.top_k > 0:
+                speech_logits_processor.append(TopKLogitsWarper(sampling_param.top_k))
+            if sampling_param.top_p is not None and sampling_param.top_p < 1.0:
+                speech_logits_processor.append(TopPLogitsWarper(sampling_param.top_p))
+            return partial(_ras_sample_hf_engine,
+                    use_ras=sampling_param.use_ras,
+                    win_size=sampling_param.win_size, tau_r=sampling_param.tau_r,
+                    speech_vocab=self.speech_vocab, speech_logits_processor=speech_logits_processor)
+        if sampling_param.use_ras or always:
+            return partial(_ras_sample_hf_engine,
+                    use_ras=sampling_param.use_ras,
+                    win_size=sampling_param.win_size, tau_r=sampling_param.tau_r)
+        return None
+
+    def prefix_cache_stats(self) -> dict:
+        return self.prefix_cache.stats() if self.prefix_cache is not None else {}
+
+    def evict_kv(self, past_key_values, start: int, end: int):
+        """Drop the cached positions [start, end) and re-position the later keys, see `evict_kv_span`."""
+        evict_kv_span(past_key_values, start, end, self.model.model.rotary_emb.inv_freq)
 
     def generate(
         self,
         prompt: list[str],
         sampling_param: SamplingParams,
         past_key_values=None,
+        cache_prefix_len: int = 0,
+        streamer=None,
     ) -> dict:
-        
+        """
+        Args:
+            prompt: input token ids, the part already held by `past_key_values` is not prefilled again.
+            past_key_values: the DynamicCache of the dialogue, updated in place.
+            cache_prefix_len: number of leading prompt tokens (e.g. the speaker prompt block) to keep
+                in the cross-request prefix cache after this call.
+            streamer: receives every sampled token as soon as it is drawn.
+        """
+        use_prefix_cache = self.prefix_cache is not None and past_key_values is not None
+        if use_prefix_cache and past_key_values.get_seq_length() == 0:
+            # resume from the deepest cached prefix, at least one token must be left to prefill;
+            matched_len, kv = self.prefix_cache.match(prompt[:len(prompt) - 1])
+            if matched_len > 0:
+                for layer_idx, (key, value) in enumerate(kv):
+                    past_key_values.update(key, value, layer_idx)
+
         stopping_criteria = StoppingCriteriaList([EosTokenCriteria(eos_token_id=self.config.hf_config.eos_token_id)])
-        if sampling_param.use_ras:
-            sample_hf_engine_handler = partial(_ras_sample_hf_engine, 
-                    use_ras=sampling_param.use_ras, 
-                    win_size=sampling_param.win_size, tau_r=sampling_param.tau_r)
-        else:
-            sample_hf_engine_handler = None
+        if hasattr(streamer, "stopping_criteria"):
+            # the consumer of the streamer may stop the turn early;
+            stopping_criteria.append(streamer.stopping_criteria())
+        sample_hf_engine_handler = self._sample_handler(sampling_param, len(prompt))
         rep_pen_processor = RepetitionPenaltyLogitsProcessor(
             penalty=sampling_param.repetition_penalty,
             prompt_ignore_length=len(prompt)
@@ -66,15 +143,120 @@ class HFLLMEngine:
                 past_key_values=past_key_values,
                 custom_generate=sample_hf_engine_handler,
                 use_cache=True,
-                logits_processor=[rep_pen_processor]
+                logits_processor=[rep_pen_processor],
+                streamer=streamer,
             )
             generated_ids = generated_ids[:, input_len:].cpu().numpy().tolist()[0]
+        if use_prefix_cache and cache_prefix_len > 0:
+            kv = [(layer.keys, layer.values) for layer in past_key_values.layers]
+            self.prefix_cache.insert(prompt[:cache_prefix_len], kv)
         output = {
             "text": self.tokenizer.decode(generated_ids),
             "token_ids": generated_ids,
         }
         return output
 
+    def generate_batch(
+        self,
+        prompts: list[list[int]],
+        sampling_param: SamplingParams,
+        kv_caches: list | None = None,
+    ) -> list[dict]:
+        """
+        Decode the current turns of several independent dialogues together.
+
+        Every row is laid out as [pad, cached prompt, pad, new prompt] and decoded in lock step with an
+        attention mask over the padding, so the positions of a row, and hence its cached keys, are those
+        of the row decoded alone. RAS windows, repetition penalty and eos are tracked per sequence.
+
+        Args:
+            prompts: the full input token ids of every dialogue.
+            kv_caches: per dialogue, None or the KV of a previous call covering the first tokens of its
+                prompt (a list of per-layer (key, value) of batch 1); only the rest is prefilled. When given,
+                every output carries the `kv` of its dialogue, holding every input token but the last
+                sampled one. Either way a sequence leaves the batch once it emits the speech eos, its cache
+                row copied out first.
+
+        Returns:
+            one output per prompt, in order, like `generate`.
+        """
+        eos_token_id = self.config.hf_config.eos_token_id
+        pad_token_id = self.pad_token_id if self.pad_token_id is not None else eos_token_id
+        return_kv = kv_caches is not None
+        kv_caches = kv_caches if kv_caches is not None else [None] * len(prompts)
+        cached_lens = [0 if kv is None else kv[0][0].shape[2] for kv in kv_caches]
+        new_prompts = [prompt[cached_len:] for prompt, cached_len in zip(prompts, cached_lens)]
+        cache_len, new_len = max(cached_lens), max(len(new_prompt) for new_prompt in new_prompts)
+        input_len = cache_len + new_len
+        input_ids, attention_mask = [], []
+        for prompt, cached_len, new_prompt in zip(prompts, cached_lens, new_prompts):
+            cache_pad, new_pad = cache_len - cached_len, new_len - len(new_prompt)
+            input_ids.append([pad_token_id] * cache_pad + prompt[:cached_len] + [pad_token_id] * new_pad + new_prompt)
+            attention_mask.append([0] * cache_pad + [1] * cached_len + [0] * new_pad + [1] * len(new_prompt))
+        input_ids = torch.tensor(input_ids, dtype=torch.int64)
+        attention_mask = torch.tensor(attention_mask, dtype=torch.int64)
+
+        past_key_values = None
+        if return_kv:
+            past_key_values = DynamicCache(config=AutoPretrainedConfig().from_dataclass(self.config.hf_config))
+            if cache_len > 0:
+                reference = next(kv for kv in kv_caches if kv is not None)
+                for layer_idx, (ref_key, ref_value) in enumerate(reference):
+                    keys, values = [], []
+                    for kv in kv_caches:
+                        key = ref_key.new_zeros(ref_key.shape[:2] + (0,) + ref_key.shape[3:]) if kv is None else kv[layer_idx][0]
+                        value = ref_value.new_zeros(ref_value.shape[:2] + (0,) + ref_value.shape[3:]) if kv is None else kv[layer_idx][1]
+                        pad = (0, 0, cache_len - key.shape[2], 0)
+                        keys.append(torch.nn.functional.pad(key, pad))
+                        values.append(torch.nn.functional.pad(value, pad))
+                    past_key_values.update(torch.cat(keys), torch.cat(values), layer_idx)
+
+        stopping_criteria = StoppingCriteriaList([EosTokenCriteria(eos_token_id=eos_token_id)])
+        # the RAS sampler drops finished rows from the batch, handing back their cache rows
+        finished_kv = {} if return_kv else None
+        sample_hf_engine_handler = partial(self._sample_handler(sampling_param, input_len, always=True),
+                                           finished_kv=finished_kv)
+        rep_pen_processor = RepetitionPenaltyLogitsProcessor(
+            penalty=sampling_param.repetition_penalty,
+            prompt_ignore_length=input_len
+        ) # every prompt lies inside the first input_len positions;
+        with torch.no_grad():
+            generated_ids = self.model.generate(
+                input_ids=input_ids.to(self.device),
+                attention_mask=attention_mask.to(self.device),
+                do_sample=True,
+                top_k=sampling_param.top_k,
+                top_p=sampling_param.top_p,
+                min_new_tokens=sampling_param.min_tokens,
+                max_new_tokens=sampling_param.max_tokens,
+                temperature=sampling_param.temperature,
+                stopping_criteria=stopping_criteria,
+                pad_token_id=pad_token_id,
+                past_key_values=past_key_values,
+                custom_generate=sample_hf_engine_handler,
+                use_cache=True,
+                logits_processor=[rep_pen_processor]
+            )
+            generated_ids = generated_ids[:, input_len:].cpu().numpy().tolist()
+
+        outputs = []
+        for row, (token_ids, cached_len, new_prompt) in enumerate(zip(generated_ids, cached_lens, new_prompts)):
+            if eos_token_id in token_ids:
+                token_ids = token_ids[:token_ids.index(eos_token_id) + 1]
+            output = {
+                "text": self.tokenizer.decode(token_ids),
+                "token_ids": token_ids,
+            }
+            if return_kv:
+                # the cached prompt, then the new prompt and the generated tokens but the last one
+                spans = [(cache_len - cached_len, cache_len), (input_len - len(new_prompt), input_len + len(token_ids) - 1)]
+                output["kv"] = [
+                    tuple(torch.cat([tensor[:, :, start:end] for start, end in spans], dim=2) for tensor in layer_kv)
+                    for layer_kv in finished_kv[row]
+                ]
+            outputs.append(output)
+        return outputs
+
 class VLLMEngine:
 
     def __init__(self, model, **kwargs):
@@ -85,7 +267,7 @@ class VLLMEngine:
         
         self.tokenizer = AutoTokenizer.from_pretrained(config.model, use_fast=True)
         config.eos = config.hf_config.eos_token_id # speech eos token;
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.device = config.device
         os.environ["VLLM_USE_V1"] = "0"
         if SUPPORT_VLLM:
             self.model = LLM(model=model, enforce_eager=True, dtype="bfloat16", max_model_len=8192, enable_prefix_caching=True,)
@@ -99,16 +281,43 @@ class VLLMEngine:
         prompt: list[str],
         sampling_param: SamplingParams,
         past_key_values=None,
+        cache_prefix_len: int = 0, # vLLM manages its own prefix caching;
+        streamer=None, # tokens are only handed over once the whole turn is decoded;
     ) -> dict:
         sampling_param.stop_token_ids = [self.config.hf_config.eos_token_id]
         with torch.no_grad():
             generated_ids = self.model.generate(
                 TokensPrompt(prompt_token_ids=prompt), 
-                VllmSamplingParams(**asdict(sampling_param)),
+                _to_vllm_sampling_params(sampling_param),
                 use_tqdm=False,
             )[0].outputs[0].token_ids
+        if streamer is not None:
+            streamer.put(torch.tensor(generated_ids))
+            streamer.end()
         output = {
             "text": self.tokenizer.decode(generated_ids),
             "token_ids": list(generated_ids),
         }
-        return output
\ No newline at end of file
+        return output
+
+    def generate_batch(
+        self,
+        prompts: list[list[int]],
+        sampling_param: SamplingParams,
+        kv_caches: list | None = None, # vLLM reuses the dialogue prefixes through its own prefix caching;
+    ) -> list[dict]:
+        sampling_param.stop_token_ids = [self.config.hf_config.eos_token_id]
+        with torch.no_grad():
+            request_outputs = self.model.generate(
+                [TokensPrompt(prompt_token_ids=prompt) for prompt in prompts],
+                _to_vllm_sampling_params(sampling_param),
+                use_tqdm=False,
+            )
+        outputs = []
+        for request_output in request_outputs:
+            generated_ids = request_output.outputs[0].token_ids
+            outputs.append({
+                "text": self.tokenizer.decode(generated_ids),
+                "token_ids": list(generated_ids),
+            })
+        return outputs
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import onnxruntime
+import torch
+
+ONNX_DIR = "onnx"
+ONNX_FILES = {
+    "encoder": "flow_encoder.onnx",
+    "estimator": "flow_estimator.onnx",
+    "estimator_streaming": "flow_estimator_streaming.onnx",
+    "hift": "hift_decoder.onnx",
+    "speech_tokenizer": "speech_tokenizer_v2.onnx",
+}
+
+
+def create_session(path: str, device: torch.device, num_threads: int = 0) -> onnxruntime.InferenceSession:
+    """ORT session with all graph optimisations, on cuda when the device is cuda and the provider is available."""
+    option = onnxruntime.SessionOptions()
+    option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads > 0:
+        option.intra_op_num_threads = num_threads
+    providers = ["CPUExecutionProvider"]
+    if device.type == "cuda" and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+        providers = [("CUDAExecutionProvider", {"device_id": device.index or 0})] + providers
+    return onnxruntime.InferenceSession(path, sess_options=option, providers=providers)
+
+
+def run_session(session: onnxruntime.InferenceSession, *inputs: torch.Tensor) -> list[np.ndarray]:
+    """Run `session` on torch tensors, fed as float32 / integer numpy arrays in the order of the graph inputs."""
+    feeds = {}
+    for node, value in zip(session.get_inputs(), inputs):
+        value = value.detach().cpu()
+        feeds[node.name] = (value.float() if value.is_floating_point() else value).numpy()
+    return session.run(None, feeds)
+
+
+class OrtEstimator(torch.nn.Module):
+    """
+    Flow estimator (`CausalConditionalDecoder.forward`) through ORT, one graph per attention mode.
+
+    It has no `prepare_conditioning`, so the ODE solvers call it once per step with the full inputs;
+    deep feature reuse does not apply. Streaming calls stay on the eager `estimator` without a streaming graph.
+    """
+
+    def __init__(self, session: onnxruntime.InferenceSession, estimator: torch.nn.Module,
+                 streaming_session: onnxruntime.InferenceSession | None = None):
+        super().__init__()
+        self.session = session
+        self.estimator = estimator
+        self.streaming_session = streaming_session
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, streaming=False):
+        if streaming and self.streaming_session is None:
+            return self.estimator(x, mask, mu, t, spks, cond, streaming)
+        output = run_session(self.streaming_session if streaming else self.session, x, mask, mu, t, spks, cond)[0]
+        return torch.from_numpy(output).to(device=x.device, dtype=x.dtype)
+
+
+class OrtEncoder(torch.nn.Module):
+    """
+    Full-context flow encoder through ORT. Streaming calls, with chunk masks or lookahead context, and
+    `forward_chunk` stay on the eager `encoder`.
+    """
+
+    def __init__(self, session: onnxruntime.InferenceSession, encoder: torch.nn.Module):
+        super().__init__()
+        self.session = session
+        self.encoder = encoder
+        self.static_chunk_size = encoder.static_chunk_size
+
+    def output_size(self) -> int:
+        return self.encoder.output_size()
+
+    def forward_chunk(self, *args, **kwargs):
+        return self.encoder.forward_chunk(*args, **kwargs)
+
+    def forward(self, xs, xs_lens, context=torch.zeros(0, 0, 0), decoding_chunk_size=0, num_decoding_left_chunks=-1,
+                streaming=False):
+        if streaming or context.size(1) != 0:
+            return self.encoder(xs, xs_lens, context=context, streaming=streaming)
+        h, masks = run_session(self.session, xs, xs_lens.long())
+        return (torch.from_numpy(h).to(device=xs.device, dtype=xs.dtype),
+                torch.from_numpy(masks).to(device=xs.device))
+
+
+class OrtHiFTDecoder:
+    """HiFT upsampling stack (`HiFTGenerator.decode_spec`) through ORT, the STFT and iSTFT stay in torch."""
+
+    def __init__(self, session: onnxruntime.InferenceSession):
+        self.session = session
+
+    def __call__(self, x: torch.Tensor, s_stft: torch.Tensor) -> torch.Tensor:
+        output = run_session(self.session, x, s_stft)[0]
+        return torch.from_numpy(output).to(device=x.device, dtype=x.dtype)
+
+
+class OrtSpeechTokenizer:
+    """
+    S3 speech tokenizer from its original ONNX graph (`speech_tokenizer_v2.onnx` of CosyVoice2), with the
+    `quantize` interface of the s3tokenizer model. The graph takes one utterance at a time.
+    """
+
+    def __init__(self, session: onnxruntime.InferenceSession):
+        self.session = session
+
+    def quantize(self, mels: torch.Tensor, mels_lens: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        tokens = []
+        for mel, mel_len in zip(mels, mels_lens.tolist()):
+            output = run_session(self.session, mel[None, :, :mel_len], torch.tensor([mel_len], dtype=torch.int32))[0]
+            tokens.append(torch.from_numpy(output.reshape(-1).astype(np.int64)))
+        tokens_lens = torch.tensor([len(x) for x in tokens], device=mels.device)
+        tokens = torch.nn.utils.rnn.pad_sequence(tokens, batch_first=True, padding_value=0).to(mels.device)
+        return tokens, tokens_lens
+
+
+def apply_onnx_backend(model_path: str, flow: torch.nn.Module, hift: torch.nn.Module, device: torch.device,
+                       num_threads: int = 0) -> dict:
+    """
+    Swap the exported modules of `flow` and `hift` for their ORT sessions, from `<model_path>/onnx`.
+
+    Returns:
+        {part: path} of the graphs in use, the parts without a graph stay eager.
+    """
+    onnx_dir = os.path.join(model_path, ONNX_DIR)
+    paths = {part: os.path.join(onnx_dir, name) for part, name in ONNX_FILES.items()
+             if part != "speech_tokenizer" and os.path.exists(os.path.join(onnx_dir, name))}
+    enabled = {}
+    if "estimator" in paths:
+        streaming_session = None
+        if "estimator_streaming" in paths:
+            streaming_session = create_session(paths["estimator_streaming"], device, num_threads)
+            enabled["estimator_streaming"] = paths["estimator_streaming"]
+        flow.decoder.estimator = OrtEstimator(create_session(paths["estimator"], device, num_threads),
+                                              flow.decoder.estimator, streaming_session)
+        enabled["estimator"] = paths["estimator"]
+    if "encoder" in paths:
+        flow.encoder = OrtEncoder(create_session(paths["encoder"], device, num_threads), flow.encoder)
+        enabled["encoder"] = paths["encoder"]
+    if "hift" in paths:
+        hift.spec_decoder = OrtHiFTDecoder(create_session(paths["hift"], device, num_threads))
+        enabled["hift"] = paths["hift"]
+    return enabled
+
+
+def load_speech_tokenizer(model_path: str, device: torch.device, num_threads: int = 0) -> OrtSpeechTokenizer | None:
+    """`OrtSpeechTokenizer` from `<model_path>/onnx/speech_tokenizer_v2.onnx`, None without that graph."""
+    path = os.path.join(model_path, ONNX_DIR, ONNX_FILES["speech_tokenizer"])
+    if not os.path.exists(path):
+        return None
+    return OrtSpeechTokenizer(create_session(path, device, num_threads))
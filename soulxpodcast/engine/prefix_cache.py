@@ -0,0 +1,177 @@
+import threading
+from typing import Optional
+
+import torch
+
+
+class _RadixNode:
+    __slots__ = ("parent", "children", "tokens", "kv", "nbytes", "last_access")
+
+    def __init__(self, parent=None, tokens: tuple = (), kv: Optional[list] = None):
+        self.parent = parent
+        self.children: dict[int, "_RadixNode"] = {}
+        self.tokens = tokens
+        # per-layer (key, value) for the tokens of this edge only, [B, H, len(tokens), D]
+        self.kv = kv if kv is not None else []
+        self.nbytes = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in self.kv)
+        self.last_access = 0
+
+
+def _common_prefix_len(a, b) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def _slice_kv(kv: list, start: int, end: int) -> list:
+    return [(k[:, :, start:end].clone(), v[:, :, start:end].clone()) for k, v in kv]
+
+
+class RadixPrefixCache:
+    """
+    Token-prefix radix tree of KV snapshots shared across requests.
+
+    Every edge of the tree owns the KV segment of its own tokens, so prompts
+    sharing a prefix (e.g. the same host voices) share memory. Because the KV of
+    a causal LM prefix does not depend on what follows it, a lookup can also
+    resume from the middle of an edge. Least recently used leaves are evicted
+    once the byte budget is exceeded.
+
+    Args:
+        max_bytes: memory budget for the stored KV segments.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.root = _RadixNode()
+        self.total_bytes = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.saved_prefill_tokens = 0
+        self.inserted_tokens = 0
+        self.evictions = 0
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def match(self, tokens: list[int]) -> tuple[int, Optional[list]]:
+        """
+        Find the deepest cached prefix of `tokens`.
+
+        Returns:
+            (matched_len, kv): kv is a per-layer list of (key, value) of shape
+            [B, H, matched_len, D], or None when nothing matched.
+        """
+        with self._lock:
+            self.lookups += 1
+            now = self._tick()
+            node, pos, segments = self.root, 0, []
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    break
+                n = _common_prefix_len(child.tokens, tokens[pos:pos + len(child.tokens)])
+                child.last_access = now
+                segments.append((child, n))
+                pos += n
+                if n < len(child.tokens):
+                    break
+                node = child
+            if pos == 0:
+                return 0, None
+
+            self.hits += 1
+            self.saved_prefill_tokens += pos
+            num_layers = len(segments[0][0].kv)
+            kv = []
+            for layer_idx in range(num_layers):
+                keys = [seg.kv[layer_idx][0][:, :, :n] for seg, n in segments]
+                values = [seg.kv[layer_idx][1][:, :, :n] for seg, n in segments]
+                kv.append((torch.cat(keys, dim=2), torch.cat(values, dim=2)))
+            return pos, kv
+
+    def insert(self, tokens: list[int], kv: list):
+        """
+        Store the KV of `tokens`.
+
+        Args:
+            tokens: token prefix to cache.
+            kv: per-layer (key, value) covering at least len(tokens) positions;
+                only the spans missing from the tree are copied.
+        """
+        with self._lock:
+            now = self._tick()
+            node, pos = self.root, 0
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    leaf = _RadixNode(node, tuple(tokens[pos:]), _slice_kv(kv, pos, len(tokens)))
+                    leaf.last_access = now
+                    node.children[tokens[pos]] = leaf
+                    self.total_bytes += leaf.nbytes
+                    self.inserted_tokens += len(tokens) - pos
+                    break
+                n = _common_prefix_len(child.tokens, tokens[pos:pos + len(child.tokens)])
+                if n < len(child.tokens) and pos + n < len(tokens):
+                    # diverges inside this edge, branch off at the split point
+                    child = self._split(child, n)
+                child.last_access = now
+                node, pos = child, pos + n
+            self._evict()
+
+    def _split(self, node: _RadixNode, n: int) -> _RadixNode:
+        """Split `node` so that its first `n` tokens become a new parent node."""
+        parent = node.parent
+        # copy both halves so that evicting one of them really frees its memory
+        head = _RadixNode(parent, node.tokens[:n], _slice_kv(node.kv, 0, n))
+        head.last_access = node.last_access
+        tail_kv = _slice_kv(node.kv, n, len(node.tokens))
+        parent.children[node.tokens[0]] = head
+        node.parent, node.tokens, node.kv = head, node.tokens[n:], tail_kv
+        node.nbytes -= head.nbytes
+        head.children[node.tokens[0]] = node
+        return head
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            leaves = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node is not self.root and not node.children:
+                    leaves.append(node)
+                stack.extend(node.children.values())
+            if not leaves:
+                break
+            victim = min(leaves, key=lambda x: x.last_access)
+            del victim.parent.children[victim.tokens[0]]
+            self.total_bytes -= victim.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        """Drop every cached prefix and reset the counters of `stats`."""
+        with self._lock:
+            self.root = _RadixNode()
+            self.total_bytes = 0
+            self.lookups = 0
+            self.hits = 0
+            self.saved_prefill_tokens = 0
+            self.inserted_tokens = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups > 0 else 0.0,
+            "saved_prefill_tokens": self.saved_prefill_tokens,
+            "inserted_tokens": self.inserted_tokens,
+            "evictions": self.evictions,
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+from soulxpodcast.models.modules.flow import FlowSpeaker
+
+
+def prompt_audio_key(*features: torch.Tensor) -> str:
+    """Hash of the features of one prompt audio (LLM log-mel, flow mel, x-vector), the speaker cache key."""
+    digest = hashlib.sha1()
+    for feature in features:
+        feature = feature.detach().float().cpu().contiguous()
+        digest.update(str(tuple(feature.shape)).encode())
+        digest.update(feature.numpy().tobytes())
+    return digest.hexdigest()
+
+
+class SpeakerFlowCache:
+    """
+    Flow conditioning of the speaker prompts shared across turns and requests.
+
+    Every entry is the `FlowSpeaker` of one prompt audio: the aligned prompt speech tokens (which
+    also skip the audio tokenizer on a hit), the prompt mels on the flow device, the projected
+    x-vector and, once the speaker was chunk streamed, the encoder state of its prompt. Least
+    recently used speakers are evicted beyond `max_entries`.
+
+    Args:
+        max_entries: number of speakers kept, 0 disables the cache.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, FlowSpeaker] = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[FlowSpeaker]:
+        with self._lock:
+            self.lookups += 1
+            speaker = self.entries.get(key)
+            if speaker is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return speaker
+
+    def put(self, key: str, speaker: FlowSpeaker):
+        with self._lock:
+            if self.max_entries <= 0:
+                return
+            self.entries[key] = speaker
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,62 @@
+import queue
+import threading
+
+import torch
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+
+
+class SpeechTokenStreamer(BaseStreamer):
+    """
+    Hands the tokens sampled by `generate` over to another thread as soon as they exist.
+
+    `generate` first puts the 2-D prompt, which is skipped, then every sampled token
+    as a 1-D tensor. Iterating the streamer yields token ids until `end` is called. A consumer
+    that gives up early calls `stop`, which ends the generation through `stopping_criteria`.
+
+    Args:
+        timeout: seconds to wait for the next token before raising `queue.Empty`.
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self.tokens = queue.Queue()
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+    def put(self, value: torch.Tensor):
+        if value.dim() > 1:
+            return
+        self.tokens.put(value.tolist())
+
+    def end(self):
+        self.tokens.put(None)
+
+    def stop(self):
+        """Ask the generating thread to stop after its current step."""
+        self.stopped.set()
+
+    def stopping_criteria(self) -> StoppingCriteria:
+        return StreamerStoppingCriteria(self)
+
+    def error(self, exc: BaseException):
+        """Forward an exception of the generating thread to the consumer."""
+        self.tokens.put(exc)
+
+    def __iter__(self):
+        while True:
+            item = self.tokens.get(timeout=self.timeout)
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+
+
+class StreamerStoppingCriteria(StoppingCriteria):
+    """Stops every row once the consumer of `streamer` called `stop`, checked on the host without a device sync."""
+
+    def __init__(self, streamer: SpeechTokenStreamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.streamer.stopped.is_set(), dtype=torch.bool, device=input_ids.device)
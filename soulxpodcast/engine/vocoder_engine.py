@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+import torch
+
+from soulxpodcast.models.modules.hifigan import HiFTGenerator
+
+
+class VocoderEngine:
+    """
+    Windowed and batched HiFT vocoding of whole turns.
+
+    The F0 and the harmonic source of a turn are computed over its whole mel, so the source phase
+    stays continuous across windows. The costly `decode` (source STFT, upsampling stack, iSTFT) runs
+    on windows of `window_frames` mel frames overlapping by `overlap_frames`, `batch_size` windows at
+    a time, windows of every turn of a call sharing the batches. Consecutive windows are cross-faded
+    over the middle half of their overlap, away from the window edges whose receptive field is cut.
+    Mels up to `window_frames` are decoded whole, exactly as `HiFTGenerator.forward` does.
+
+    Args:
+        hift: the vocoder.
+        window_frames: mel frames per window, 0 decodes every turn whole.
+        overlap_frames: mel frames shared by consecutive windows.
+        batch_size: windows decoded by one `decode` call.
+    """
+
+    def __init__(self, hift: HiFTGenerator, window_frames: int = 0, overlap_frames: int = 48, batch_size: int = 4):
+        assert window_frames <= 0 or window_frames > 2 * overlap_frames, "HiFT windows must be longer than twice their overlap"
+        self.hift = hift
+        self.window_frames = window_frames
+        self.overlap_frames = overlap_frames
+        self.batch_size = max(1, batch_size)
+        self.upsample_scale = int(hift.f0_upsamp.scale_factor)
+
+    def _windows(self, num_frames: int) -> list[tuple[int, int]]:
+        if self.window_frames <= 0 or num_frames <= self.window_frames:
+            return [(0, num_frames)]
+        # the last window ends on the last frame, so all windows have the same length
+        hop = self.window_frames - self.overlap_frames
+        starts = list(range(0, num_frames - self.window_frames, hop)) + [num_frames - self.window_frames]
+        return [(start, start + self.window_frames) for start in starts]
+
+    def _fade(self, length: int, device: torch.device) -> torch.Tensor:
+        return torch.linspace(0.0, 1.0, length + 2, device=device)[1:-1]
+
+    @torch.inference_mode()
+    def __call__(self, mels: list[torch.Tensor], generators: list[torch.Generator] | None = None,
+                 cache_sources: list[torch.Tensor] | None = None) -> tuple[list[torch.Tensor], list[torch.Tensor]]:
+        """
+        Vocode the mels (1, num_mels, T) of several turns.
+
+        Args:
+            mels: mel of every turn.
+            generators: noise generator of the source of every turn.
+            cache_sources: source samples to keep at the start of every turn, see `HiFTGenerator.forward`.
+
+        Returns:
+            (wavs, sources): the waveform (1, T * upsample_scale) and the source of every turn.
+        """
+        scale = self.upsample_scale
+        sources = []
+        for i, mel in enumerate(mels):
+            cache_source = cache_sources[i] if cache_sources is not None else torch.zeros(1, 1, 0)
+            sources.append(self.hift.source(mel, cache_source=cache_source,
+                                            generator=generators[i] if generators is not None else None))
+
+        # windows of equal length share a decode call
+        windows = [self._windows(mel.shape[2]) for mel in mels]
+        groups = defaultdict(list)
+        for i, turn_windows in enumerate(windows):
+            for j, (start, end) in enumerate(turn_windows):
+                groups[end - start].append((i, j))
+        outputs = {}
+        for group in groups.values():
+            for k in range(0, len(group), self.batch_size):
+                batch = group[k:k + self.batch_size]
+                x = torch.cat([mels[i][:, :, windows[i][j][0]:windows[i][j][1]] for i, j in batch])
+                s = torch.cat([sources[i][:, :, windows[i][j][0] * scale:windows[i][j][1] * scale] for i, j in batch])
+                for (i, j), wav in zip(batch, self.hift.decode(x=x, s=s)):
+                    outputs[i, j] = wav[None]
+
+        wavs = []
+        for i, (mel, turn_windows) in enumerate(zip(mels, windows)):
+            if len(turn_windows) == 1:
+                wavs.append(outputs[i, 0])
+                continue
+            wav = mel.new_zeros(1, mel.shape[2] * scale, dtype=torch.float32)
+            quarter = self.overlap_frames // 4
+            for j, (start, end) in enumerate(turn_windows):
+                weight = torch.ones((end - start) * scale, device=wav.device)
+                if j > 0:
+                    # fade in over the middle of the overlap with the previous window
+                    fade_end = (turn_windows[j - 1][1] - quarter - start) * scale
+                    fade_start = fade_end - (self.overlap_frames - 2 * quarter) * scale
+                    weight[:fade_start] = 0.0
+                    weight[fade_start:fade_end] = self._fade(fade_end - fade_start, wav.device)
+                if j < len(turn_windows) - 1:
+                    fade_end = (end - quarter - start) * scale
+                    fade_start = fade_end - (self.overlap_frames - 2 * quarter) * scale
+                    weight[fade_end:] = 0.0
+                    weight[fade_start:fade_end] = 1.0 - self._fade(fade_end - fade_start, wav.device)
+                wav[:, start * scale:end * scale] += outputs[i, j].float() * weight
+            wavs.append(wav)
+        return wavs, sources
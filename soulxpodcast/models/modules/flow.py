@@ -7,7 +7,7 @@ import torch.nn.functional as F
 from soulxpodcast.models.modules.flow_components.estimator import \
     CausalConditionalDecoder
 from soulxpodcast.models.modules.flow_components.upsample_encoder import (
-    UpsampleConformerEncoder, make_pad_mask)
+    EncoderChunkCache, UpsampleConformerEncoder, make_pad_mask)
 
 
 @dataclass
@@ -19,6 +19,33 @@ class CfmParams:
     inference_cfg_rate: float = 0.7
 
 
+@dataclass
+class CfgSchedule:
+    """
+    Which estimator calls of an ODE solve apply classifier-free guidance.
+
+    Guidance runs on the calls whose time lies in `interval`, and among those on every `stride`-th one.
+    The other calls run the estimator on the conditional half of the batch only, and with `reuse_delta`
+    add the guidance delta (cond - uncond velocity) of the last guided call back.
+    """
+    interval: tuple[float, float] = (0.0, 1.0)
+    stride: int = 1
+    reuse_delta: bool = False
+
+
+class _CfgState:
+    """Estimator buffers and guidance state of one ODE solve."""
+
+    def __init__(self, inputs: tuple, schedule: CfgSchedule, prepared=None):
+        self.inputs = inputs
+        self.schedule = schedule
+        # loop-invariant estimator conditioning of the double batch and of its conditional half
+        self.prepared = prepared
+        self.prepared_cond = None if prepared is None else prepared.narrow(inputs[0].size(0) // 2)
+        self.delta = None
+        self.num_in_interval = 0
+
+
 class CausalConditionalCFM(torch.nn.Module):
     def __init__(self, in_channels=320, cfm_params=CfmParams(), n_spks=1, spk_emb_dim=80, estimator: torch.nn.Module = None):
         super().__init__()
@@ -38,7 +65,8 @@ class CausalConditionalCFM(torch.nn.Module):
         self.estimator = CausalConditionalDecoder() if estimator is None else estimator
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, streaming=False):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, streaming=False, generator=None, noise=None,
+                solver=None, cfg_schedule=None, deep_cache_interval=1):
         """Forward diffusion
 
         Args:
@@ -51,19 +79,118 @@ class CausalConditionalCFM(torch.nn.Module):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            generator (torch.Generator | list[torch.Generator], optional): source of the initial noise,
+                a list holds one generator per batch item. Defaults to None.
+            noise (torch.Tensor, optional): fixed initial noise, at least as long as mu, used instead of
+                drawing a new one so that calls over a growing prefix agree on their overlap. Defaults to None.
+                shape: (batch_size, n_feats, >= mel_timesteps)
+            solver (str, optional): ODE solver, one of `FLOW_SOLVERS`. Defaults to `cfm_params.solver`.
+            cfg_schedule (CfgSchedule, optional): steps that apply CFG. Defaults to guidance on every step.
+            deep_cache_interval (int, optional): recompute the deep estimator blocks on every n-th call only,
+                reusing their output in between (needs an estimator with `prepare_conditioning`). Defaults to 1.
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, n_feats, mel_timesteps)
         """
-        z = torch.randn_like(mu).to(mu.device).to(mu.dtype) * temperature
+        if noise is not None:
+            z = noise[:, :, :mu.size(2)].to(mu.device, mu.dtype) * temperature
+        elif isinstance(generator, (list, tuple)):
+            # draw the noise of every item over its own length, as if it were decoded alone
+            z = torch.zeros_like(mu)
+            for i, length in enumerate(mask.sum(dim=-1).view(-1).long().tolist()):
+                z[i, :, :length] = torch.randn((mu.size(1), length), generator=generator[i], device=mu.device, dtype=mu.dtype)
+            z = z * temperature
+        else:
+            z = torch.randn(mu.shape, generator=generator, device=mu.device, dtype=mu.dtype) * temperature
         # fix prompt and overlap part mu and z
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
+        # the time grid stays on the host, so that the guidance schedule never waits for the device
+        t_span = torch.linspace(0, 1, n_timesteps + 1)
         if self.t_scheduler == 'cosine':
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming), None
+        solver = self.solver if solver is None else solver
+        if solver not in FLOW_SOLVERS:
+            raise ValueError(f"Unknown flow solver: {solver}, expected one of {sorted(FLOW_SOLVERS)}")
+        solve = getattr(self, FLOW_SOLVERS[solver])
+        return solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming,
+                     cfg_schedule=cfg_schedule, deep_cache_interval=deep_cache_interval), None
+
+    def _cfg_state(self, x, t_span, mu, mask, spks, cond, streaming=False, schedule=None, deep_cache_interval=1):
+        """
+        Double batch estimator inputs for CFG, the conditional half first and the unconditional half
+        with zero mu, spks and cond. Only `x` and `t` change between estimator calls, so an estimator
+        with `prepare_conditioning` packs the rest, and embeds the times of `t_span`, once per solve.
+        """
+        batch_size = x.size(0)
+        # Do not use concat, it may cause memory format changed and trt infer with wrong results!
+        x_in = torch.zeros([batch_size * 2, x.size(1), x.size(2)], device=x.device, dtype=x.dtype)
+        mask_in = torch.zeros([batch_size * 2, mask.size(1), mask.size(2)], device=x.device, dtype=x.dtype)
+        mu_in = torch.zeros([batch_size * 2, mu.size(1), mu.size(2)], device=x.device, dtype=x.dtype)
+        t_in = torch.zeros([batch_size * 2], device=x.device, dtype=x.dtype)
+        spks_in = torch.zeros([batch_size * 2, spks.size(1)], device=x.device, dtype=x.dtype)
+        cond_in = torch.zeros([batch_size * 2, cond.size(1), cond.size(2)], device=x.device, dtype=x.dtype)
+        mask_in[:batch_size] = mask
+        mask_in[batch_size:] = mask
+        mu_in[:batch_size] = mu
+        spks_in[:batch_size] = spks
+        cond_in[:batch_size] = cond
+        inputs = (x_in, mask_in, mu_in, t_in, spks_in, cond_in)
+        prepared = None
+        if hasattr(self.estimator, "prepare_conditioning"):
+            prepared = self.estimator.prepare_conditioning(mask_in, mu_in, spks_in, cond_in, streaming,
+                                                           x_channels=x.size(1), times=t_span.tolist(),
+                                                           deep_cache_interval=deep_cache_interval)
+        return _CfgState(inputs, CfgSchedule() if schedule is None else schedule, prepared)
 
-    def solve_euler(self, x, t_span, mu, mask, spks, cond, streaming=False):
+    def _estimate(self, x, t, state, guided, streaming=False):
+        """Estimator call over the double batch when `guided`, else over its conditional half."""
+        batch_size = x.size(0)
+        if state.prepared is not None:
+            prepared = state.prepared if guided else state.prepared_cond
+            prepared.x[:batch_size] = x
+            if guided:
+                prepared.x[batch_size:] = x
+            return self.estimator.forward_prepared(prepared, float(t))
+
+        x_in, mask_in, mu_in, t_in, spks_in, cond_in = state.inputs
+        rows = slice(None) if guided else slice(0, batch_size)
+        x_in[:batch_size] = x
+        if guided:
+            x_in[batch_size:] = x
+        t_in[rows].fill_(t)
+        return self.estimator(
+            x_in[rows], mask_in[rows],
+            mu_in[rows], t_in[rows],
+            spks_in[rows],
+            cond_in[rows],
+            streaming
+        )
+
+    def _cfg_velocity(self, x, t, state, streaming=False):
+        """
+        Velocity at (x, t), one estimator call. Guided calls run the conditional and unconditional batch,
+        the others only the conditional half.
+        """
+        # Classifier-Free Guidance inference introduced in VoiceBox
+        batch_size = x.size(0)
+        schedule = state.schedule
+        guided = False
+        if schedule.interval[0] <= float(t) <= schedule.interval[1]:
+            guided = state.num_in_interval % schedule.stride == 0
+            state.num_in_interval += 1
+
+        dphi_dt = self._estimate(x, t, state, guided, streaming)
+        if not guided:
+            if schedule.reuse_delta and state.delta is not None:
+                dphi_dt = dphi_dt + self.inference_cfg_rate * state.delta
+            return dphi_dt
+
+        dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [batch_size, batch_size], dim=0)
+        if schedule.reuse_delta:
+            state.delta = dphi_dt - cfg_dphi_dt
+        return (1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt
+
+    def solve_euler(self, x, t_span, mu, mask, spks, cond, streaming=False, cfg_schedule=None, deep_cache_interval=1):
         """
         Fixed euler solver for ODEs.
         Args:
@@ -77,52 +204,115 @@ class CausalConditionalCFM(torch.nn.Module):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            cfg_schedule (CfgSchedule, optional): steps that apply CFG. Defaults to guidance on every step.
+            deep_cache_interval (int, optional): estimator calls per deep feature refresh. Defaults to 1.
         """
-        batch_size = x.size(0)
-        t, _, dt = t_span[0], t_span[-1], t_span[1] - t_span[0]
+        state = self._cfg_state(x, t_span, mu, mask, spks, cond, streaming, cfg_schedule, deep_cache_interval)
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            x = x + dt * self._cfg_velocity(x, t, state, streaming)
+        return x.float()
 
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
+    def solve_heun(self, x, t_span, mu, mask, spks, cond, streaming=False, cfg_schedule=None, deep_cache_interval=1):
+        """Heun (explicit trapezoidal) solver, 2 estimator calls per step. Same arguments as `solve_euler`."""
+        state = self._cfg_state(x, t_span, mu, mask, spks, cond, streaming, cfg_schedule, deep_cache_interval)
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            v = self._cfg_velocity(x, t, state, streaming)
+            v_next = self._cfg_velocity(x + dt * v, t + dt, state, streaming)
+            x = x + 0.5 * dt * (v + v_next)
+        return x.float()
 
-        # Do not use concat, it may cause memory format changed and trt infer with wrong results!
-        # Create tensors with double batch size for CFG (conditional + unconditional)
-        x_in = torch.zeros([batch_size * 2, x.size(1), x.size(2)], device=x.device, dtype=x.dtype)
-        mask_in = torch.zeros([batch_size * 2, mask.size(1), mask.size(2)], device=x.device, dtype=x.dtype)
-        mu_in = torch.zeros([batch_size * 2, mu.size(1), mu.size(2)], device=x.device, dtype=x.dtype)
-        t_in = torch.zeros([batch_size * 2], device=x.device, dtype=x.dtype)
-        spks_in = torch.zeros([batch_size * 2, spks.size(1)], device=x.device, dtype=x.dtype)
-        cond_in = torch.zeros([batch_size * 2, cond.size(1), cond.size(2)], device=x.device, dtype=x.dtype)
+    def solve_midpoint(self, x, t_span, mu, mask, spks, cond, streaming=False, cfg_schedule=None, deep_cache_interval=1):
+        """Explicit midpoint solver, 2 estimator calls per step. Same arguments as `solve_euler`."""
+        state = self._cfg_state(x, t_span, mu, mask, spks, cond, streaming, cfg_schedule, deep_cache_interval)
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            v = self._cfg_velocity(x, t, state, streaming)
+            x = x + dt * self._cfg_velocity(x + 0.5 * dt * v, t + 0.5 * dt, state, streaming)
+        return x.float()
 
+    def solve_rk4(self, x, t_span, mu, mask, spks, cond, streaming=False, cfg_schedule=None, deep_cache_interval=1):
+        """Classic 4th order Runge-Kutta solver, 4 estimator calls per step. Same arguments as `solve_euler`."""
+        state = self._cfg_state(x, t_span, mu, mask, spks, cond, streaming, cfg_schedule, deep_cache_interval)
         for step in range(1, len(t_span)):
-            # Classifier-Free Guidance inference introduced in VoiceBox
-            # Copy conditional and unconditional input
-            x_in[:batch_size] = x
-            x_in[batch_size:] = x
-            mask_in[:batch_size] = mask
-            mask_in[batch_size:] = mask
-            mu_in[:batch_size] = mu
-            # Unconditional part remains 0
-            t_in.fill_(t)
-            spks_in[:batch_size] = spks
-            cond_in[:batch_size] = cond
-
-            dphi_dt = self.estimator(
-                x_in, mask_in,
-                mu_in, t_in,
-                spks_in,
-                cond_in,
-                streaming
-            )
-            dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [batch_size, batch_size], dim=0)
-            dphi_dt = ((1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt)
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
-
-        return sol[-1].float()
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = self._cfg_velocity(x, t, state, streaming)
+            k2 = self._cfg_velocity(x + 0.5 * dt * k1, t + 0.5 * dt, state, streaming)
+            k3 = self._cfg_velocity(x + 0.5 * dt * k2, t + 0.5 * dt, state, streaming)
+            k4 = self._cfg_velocity(x + dt * k3, t + dt, state, streaming)
+            x = x + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        return x.float()
+
+    def solve_dpm_multistep(self, x, t_span, mu, mask, spks, cond, streaming=False, cfg_schedule=None, deep_cache_interval=1):
+        """
+        Second order multistep solver in the spirit of DPM-Solver++(2M): one estimator call per step,
+        the velocity of the previous step extrapolates the current one over non-uniform steps
+        (variable step Adams-Bashforth). The first step is an Euler step. Same arguments as `solve_euler`.
+        """
+        state = self._cfg_state(x, t_span, mu, mask, spks, cond, streaming, cfg_schedule, deep_cache_interval)
+        v_prev, dt_prev = None, None
+        for step in range(1, len(t_span)):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            v = self._cfg_velocity(x, t, state, streaming)
+            if v_prev is None:
+                x = x + dt * v
+            else:
+                r = dt / dt_prev
+                x = x + dt * ((1 + 0.5 * r) * v - 0.5 * r * v_prev)
+            v_prev, dt_prev = v, dt
+        return x.float()
+
+
+# solver name -> CausalConditionalCFM method
+FLOW_SOLVERS = {
+    "euler": "solve_euler",
+    "heun": "solve_heun",
+    "midpoint": "solve_midpoint",
+    "rk4": "solve_rk4",
+    "dpm_multistep": "solve_dpm_multistep",
+}
+
+# estimator calls per ODE step of each solver
+FLOW_SOLVER_CALLS = {
+    "euler": 1,
+    "heun": 2,
+    "midpoint": 2,
+    "rk4": 4,
+    "dpm_multistep": 1,
+}
+
+
+class FlowSpeaker:
+    """
+    Flow conditioning of one speaker prompt, shared by all the turns of that speaker.
+
+    Holds the projected x-vector, the prompt speech tokens and mels aligned to each other, and once
+    the speaker is chunk streamed, the encoder state of the complete chunks of the prompt (those not
+    depending on the generated tokens through the lookahead) with their projected encoder output.
+    """
+
+    def __init__(self, embedding: torch.Tensor, prompt_token: list[int], prompt_feat: torch.Tensor):
+        self.embedding = embedding  # (1, output_size)
+        self.prompt_token = prompt_token
+        self.prompt_feat = prompt_feat  # (T_mel, output_size)
+        self.encoder_cache: EncoderChunkCache | None = None
+        self.encoder_output: torch.Tensor | None = None  # (1, T_cached, output_size)
+        self.num_encoded_tokens = 0
+
+
+class FlowStream:
+    """
+    Chunk streaming state of one turn: the encoder state and projected output of the complete encoder chunks
+    of the speaker prompt and of the tokens generated so far, and the mel frames of the turn emitted so far.
+    """
+
+    def __init__(self, speaker: FlowSpeaker):
+        self.speaker = speaker
+        self.encoder_cache = speaker.encoder_cache
+        self.encoder_output = speaker.encoder_output  # (1, 2 * num_encoded_tokens, output_size)
+        self.num_encoded_tokens = speaker.num_encoded_tokens
+        self.mel = torch.zeros(1, speaker.prompt_feat.shape[1], 0, device=speaker.embedding.device)
 
 
 class CausalMaskedDiffWithXvec(torch.nn.Module):
@@ -153,6 +343,13 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
         self.token_mel_ratio = token_mel_ratio
         self.pre_lookahead_len = pre_lookahead_len
 
+    @torch.inference_mode()
+    def prepare_speaker(self, prompt_token: list[int], prompt_feat: torch.Tensor, embedding: torch.Tensor) -> FlowSpeaker:
+        """Speaker conditioning from the aligned prompt tokens, the prompt mels (T_mel, output_size) and the x-vector (1, spk_embed_dim)."""
+        embedding = F.normalize(embedding, dim=1)
+        embedding = self.spk_embed_affine_layer(embedding)
+        return FlowSpeaker(embedding, prompt_token, prompt_feat)
+
     @torch.inference_mode()
     def forward(self,
                 token,
@@ -161,22 +358,148 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
                 prompt_feat_len,
                 embedding,
                 streaming,
-                finalize):
+                finalize,
+                generator=None,
+                noise=None,
+                n_timesteps=15,
+                solver=None,
+                cfg_schedule=None,
+                deep_cache_interval=1):
         # xvec projection
         embedding = F.normalize(embedding, dim=1)
         embedding = self.spk_embed_affine_layer(embedding)
+        return self._forward(token, token_len, prompt_feat, prompt_feat_len, embedding, streaming, finalize,
+                             generator=generator, noise=noise, n_timesteps=n_timesteps, solver=solver,
+                             cfg_schedule=cfg_schedule, deep_cache_interval=deep_cache_interval)
+
+    @torch.inference_mode()
+    def forward_speakers(self, speakers: list[FlowSpeaker], tokens: list[list[int]], streaming, finalize, **kwargs):
+        """
+        `forward` over the generated `tokens` of every row, each following the prompt of its speaker.
+
+        Chunk streaming a single row resumes the encoder from the cached complete chunks of the prompt,
+        so only the prompt tail and the generated tokens are encoded again.
+        """
+        device = speakers[0].embedding.device
+        flow_inputs = [torch.tensor(speaker.prompt_token + row) for speaker, row in zip(speakers, tokens)]
+        token_len = torch.tensor([len(x) for x in flow_inputs], device=device)
+        token = torch.nn.utils.rnn.pad_sequence(flow_inputs, batch_first=True, padding_value=0).to(device)
+        prompt_feat = torch.nn.utils.rnn.pad_sequence([speaker.prompt_feat for speaker in speakers], batch_first=True, padding_value=0)
+        prompt_feat_len = torch.tensor([speaker.prompt_feat.shape[0] for speaker in speakers], device=device)
+        embedding = torch.cat([speaker.embedding for speaker in speakers])
+        speaker = speakers[0] if streaming and len(speakers) == 1 else None
+        return self._forward(token, token_len, prompt_feat, prompt_feat_len, embedding, streaming, finalize,
+                             speaker=speaker, **kwargs)
+
+    def _speaker_encoder_cache(self, speaker: FlowSpeaker) -> FlowSpeaker:
+        """Encode the complete chunks of the prompt once, with the following prompt tokens as lookahead."""
+        if speaker.encoder_output is None:
+            chunk_size = self.encoder.static_chunk_size
+            num_tokens = max(len(speaker.prompt_token) - self.pre_lookahead_len, 0) // chunk_size * chunk_size
+            device = speaker.embedding.device
+            if num_tokens > 0:
+                token = torch.tensor([speaker.prompt_token[:num_tokens + self.pre_lookahead_len]], device=device)
+                token = self.input_embedding(token)
+                h, speaker.encoder_cache = self.encoder.forward_chunk(token[:, :num_tokens], context=token[:, num_tokens:])
+                speaker.encoder_output = self.encoder_proj(h)
+            else:
+                speaker.encoder_output = torch.zeros(1, 0, self.output_size, device=device, dtype=speaker.embedding.dtype)
+            speaker.num_encoded_tokens = num_tokens
+        return speaker
+
+    @torch.inference_mode()
+    def start_stream(self, speaker: FlowSpeaker) -> FlowStream:
+        """Chunk streaming state of a new turn of `speaker`, resuming from its cached prompt chunks."""
+        return FlowStream(self._speaker_encoder_cache(speaker))
+
+    @torch.inference_mode()
+    def forward_stream(self, stream: FlowStream, tokens: list[int], finalize: bool, noise: torch.Tensor,
+                       context_chunks: int, n_timesteps: int = 15, **kwargs) -> torch.Tensor:
+        """
+        Mel frames (1, output_size, T) of the generated `tokens` following the frames `stream` already emitted.
+
+        Without `finalize` the last `pre_lookahead_len` tokens are only the lookahead. The encoder state is
+        carried over every complete encoder chunk, so only the incomplete tail is encoded again. The
+        estimator runs over the prompt and a window of the last `context_chunks` encoder chunks of emitted
+        frames, conditioned on the prompt mel and on those frames, so the cost of a chunk does not grow
+        with the turn. `noise` is the initial noise of the prompt and of the whole turn so far, at least as
+        long as the prompt and the frames of `tokens`.
+        """
+        speaker = stream.speaker
+        device = speaker.embedding.device
+        chunk_size, ratio = self.encoder.static_chunk_size, self.token_mel_ratio
+        prompt_len = len(speaker.prompt_token)
+        prompt_frames = prompt_len * ratio
+        flow_tokens = speaker.prompt_token + tokens
+        end = len(flow_tokens) if finalize else len(flow_tokens) - self.pre_lookahead_len
+        token = self.input_embedding(torch.tensor([flow_tokens], device=device))
+
+        # text encode, the complete chunks once with their real lookahead, then the tail
+        boundary = end // chunk_size * chunk_size
+        if not finalize and boundary > stream.num_encoded_tokens:
+            h, stream.encoder_cache = self.encoder.forward_chunk(
+                token[:, stream.num_encoded_tokens:boundary],
+                context=token[:, boundary:boundary + self.pre_lookahead_len], cache=stream.encoder_cache)
+            stream.encoder_output = torch.cat([stream.encoder_output, self.encoder_proj(h)], dim=1)
+            stream.num_encoded_tokens = boundary
+        h = stream.encoder_output
+        if end > stream.num_encoded_tokens:
+            tail, _ = self.encoder.forward_chunk(token[:, stream.num_encoded_tokens:end], context=token[:, end:],
+                                                 cache=stream.encoder_cache)
+            h = torch.cat([h, self.encoder_proj(tail)], dim=1)
+
+        # the prompt and a window of emitted frames starting on a chunk boundary, which keeps the chunk masks
+        emitted = stream.mel.shape[2] // ratio
+        start = max(0, emitted // chunk_size - context_chunks) * chunk_size
+        window = (prompt_len + start) * ratio
+        h = torch.cat([h[:, :prompt_frames], h[:, window:]], dim=1)
+        noise = torch.cat([noise[:, :, :prompt_frames], noise[:, :, window:]], dim=2)
+        conds = torch.zeros_like(h)
+        conds[0, :prompt_frames] = speaker.prompt_feat[:prompt_frames]
+        context = stream.mel[0, :, start * ratio:].transpose(0, 1)
+        conds[0, prompt_frames:prompt_frames + context.shape[0]] = context
+        mask = torch.ones(1, 1, h.shape[1], device=device, dtype=h.dtype)
+        feat, _ = self.decoder(
+            mu=h.transpose(1, 2).contiguous(),
+            mask=mask,
+            spks=speaker.embedding,
+            cond=conds.transpose(1, 2),
+            n_timesteps=n_timesteps,
+            streaming=True,
+            noise=noise,
+            **kwargs,
+        )
+        mel = feat.float()[:, :, prompt_frames + (emitted - start) * ratio:]
+        stream.mel = torch.cat([stream.mel, mel], dim=2)
+        return mel
 
+    def _forward(self, token, token_len, prompt_feat, prompt_feat_len, embedding, streaming, finalize,
+                 generator=None, noise=None, n_timesteps=15, solver=None, cfg_schedule=None, deep_cache_interval=1,
+                 speaker=None):
         # concat text and prompt_text
         mask = (~make_pad_mask(token_len, max_len=token.shape[1])).unsqueeze(-1).to(embedding)
         token = self.input_embedding(torch.clamp(token, min=0)) * mask
 
         # text encode
-        if finalize is True:
-            h, h_lengths = self.encoder(token, token_len, streaming=streaming)
+        if speaker is not None:
+            # streaming a single unpadded row, resume after the cached prompt chunks
+            speaker = self._speaker_encoder_cache(speaker)
+            token = token[:, speaker.num_encoded_tokens:]
+            if finalize is True:
+                h, _ = self.encoder.forward_chunk(token, cache=speaker.encoder_cache)
+            else:
+                token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
+                h, _ = self.encoder.forward_chunk(token, context=context, cache=speaker.encoder_cache)
+            h = torch.cat([speaker.encoder_output, self.encoder_proj(h)], dim=1)
+            h_lengths = torch.tensor([h.shape[1]], device=h.device)
         else:
-            token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
-            h, h_lengths = self.encoder(token, token_len, context=context, streaming=streaming)
-        h = self.encoder_proj(h)
+            if finalize is True:
+                h, h_lengths = self.encoder(token, token_len, streaming=streaming)
+            else:
+                token, context = token[:, :-self.pre_lookahead_len], token[:, -self.pre_lookahead_len:]
+                h, h_lengths = self.encoder(token, token_len, context=context, streaming=streaming)
+            h = self.encoder_proj(h)
+            h_lengths = h_lengths.sum(dim=-1).squeeze(dim=1)
 
         # get conditions
         conds = torch.zeros_like(h, device=token.device)
@@ -184,14 +507,18 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
             conds[i, :j] = prompt_feat[i, :j]
         conds = conds.transpose(1, 2)
 
-        h_lengths = h_lengths.sum(dim=-1).squeeze(dim=1)
         mask = (~make_pad_mask(h_lengths, max_len=h.shape[1])).to(h)
         feat, _ = self.decoder(
             mu=h.transpose(1, 2).contiguous(),
             mask=mask.unsqueeze(1),
             spks=embedding,
             cond=conds,
-            n_timesteps=15,
-            streaming=streaming
+            n_timesteps=n_timesteps,
+            streaming=streaming,
+            generator=generator,
+            noise=noise,
+            solver=solver,
+            cfg_schedule=cfg_schedule,
+            deep_cache_interval=deep_cache_interval,
         )  # [B, num_mels, T]
         return feat.float(), h_lengths
@@ -26,6 +26,46 @@ def mask_to_bias(mask: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
     return mask
 
 
+class SDPAMaskAttnProcessor:
+    """
+    Self-attention through `F.scaled_dot_product_attention` with a compact mask broadcast over the heads:
+    a boolean key padding mask (batch_size, 1, time), a boolean chunk mask (batch_size, time, time), a float
+    bias of either shape, or None, which lets SDPA pick the flash kernel. The default diffusers processor
+    repeats the mask for every head first.
+    """
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, *args, **kwargs):
+        residual = hidden_states
+        batch_size = hidden_states.shape[0]
+        if encoder_hidden_states is None:
+            encoder_hidden_states = hidden_states
+        elif attn.norm_cross:
+            encoder_hidden_states = attn.norm_encoder_hidden_states(encoder_hidden_states)
+
+        query = attn.to_q(hidden_states)
+        key = attn.to_k(encoder_hidden_states)
+        value = attn.to_v(encoder_hidden_states)
+        head_dim = key.shape[-1] // attn.heads
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        if attention_mask is not None:
+            if attention_mask.dtype != torch.bool:
+                attention_mask = attention_mask.to(query.dtype)
+            attention_mask = attention_mask.unsqueeze(1)  # (batch_size, 1, query or 1, key)
+
+        hidden_states = F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask,
+                                                       dropout_p=0.0, is_causal=False, scale=attn.scale)
+        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, attn.heads * head_dim).to(query.dtype)
+
+        hidden_states = attn.to_out[0](hidden_states)
+        hidden_states = attn.to_out[1](hidden_states)
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+        return hidden_states / attn.rescale_output_factor
+
+
 class SnakeBeta(nn.Module):
     """
     A modified Snake function which uses separate parameters for the magnitude of the periodic components
@@ -213,6 +253,7 @@ class BasicTransformerBlock(nn.Module):
             bias=attention_bias,
             cross_attention_dim=cross_attention_dim if only_cross_attention else None,
             upcast_attention=upcast_attention,
+            processor=SDPAMaskAttnProcessor(),
         )
 
         # 2. Cross-Attn
@@ -233,6 +274,7 @@ class BasicTransformerBlock(nn.Module):
                 dropout=dropout,
                 bias=attention_bias,
                 upcast_attention=upcast_attention,
+                processor=SDPAMaskAttnProcessor(),
                 # scale_qk=False, # uncomment this to not to use flash attention
             )  # is self-attn if encoder_hidden_states is none
         else:
@@ -910,17 +952,38 @@ class CausalConditionalDecoder(ConditionalDecoder):
         if cond is not None:
             x = pack([x, cond], "b * t")[0]
 
+        return self._forward_layers(x, mask, t, {}, streaming)
+
+    def _attn_mask(self, attn_masks, level, x, mask, streaming):
+        """
+        Boolean attention mask of a resolution level, memoised in `attn_masks`: the (batch_size, time, time)
+        chunk mask when streaming, else a (batch_size, 1, time) key padding mask, or None without padding.
+        """
+        if level not in attn_masks:
+            if streaming is True:
+                attn_masks[level] = add_optional_chunk_mask(x, mask.bool(), False, False, 0, self.static_chunk_size, -1)
+            elif torch.compiler.is_compiling():
+                # no data dependent branch in a compiled graph, an all true mask gives the same output
+                attn_masks[level] = mask.bool()
+            else:
+                attn_masks[level] = None if bool(mask.bool().all()) else mask.bool()
+        return attn_masks[level]
+
+    def _forward_layers(self, x, mask, t, attn_masks, streaming=False, deep_cache=None):
+        """
+        U-Net over the packed input, the attention masks of each resolution level are memoised in `attn_masks`.
+
+        With a `DeepFeatureCache`, the input of the last up block is stored on full calls, and cheap calls
+        only run the first down block (for its skip connection) and the last up block on the stored feature.
+        """
+        reuse = deep_cache is not None and deep_cache.reuse(x.size(0))
         hiddens = []
         masks = [mask]
-        for resnet, transformer_blocks, downsample in self.down_blocks:
+        for level, (resnet, transformer_blocks, downsample) in enumerate(self.down_blocks):
             mask_down = masks[-1]
             x = resnet(x, mask_down, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_down.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_down.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
+            attn_mask = self._attn_mask(attn_masks, level, x, mask_down, streaming)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -929,19 +992,22 @@ class CausalConditionalDecoder(ConditionalDecoder):
                 )
             x = rearrange(x, "b t c -> b c t").contiguous()
             hiddens.append(x)  # Save hidden states for skip connections
+            if reuse:
+                break
             x = downsample(x * mask_down)
             masks.append(mask_down[:, :, ::2])
-        masks = masks[:-1]
+        if reuse:
+            x = deep_cache.feature[:x.size(0)]
+            up_blocks = self.up_blocks[-1:]
+        else:
+            masks = masks[:-1]
+            up_blocks = self.up_blocks
         mask_mid = masks[-1]
 
-        for resnet, transformer_blocks in self.mid_blocks:
+        for resnet, transformer_blocks in ([] if reuse else self.mid_blocks):
             x = resnet(x, mask_mid, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_mid.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_mid.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
+            attn_mask = self._attn_mask(attn_masks, len(masks) - 1, x, mask_mid, streaming)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -950,17 +1016,15 @@ class CausalConditionalDecoder(ConditionalDecoder):
                 )
             x = rearrange(x, "b t c -> b c t").contiguous()
 
-        for resnet, transformer_blocks, upsample in self.up_blocks:
+        for resnet, transformer_blocks, upsample in up_blocks:
+            if deep_cache is not None and not reuse and len(masks) == 1:
+                deep_cache.feature = x
             mask_up = masks.pop()
             skip = hiddens.pop()
             x = pack([x[:, :, :skip.shape[-1]], skip], "b * t")[0]
             x = resnet(x, mask_up, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            if streaming is True:
-                attn_mask = add_optional_chunk_mask(x, mask_up.bool(), False, False, 0, self.static_chunk_size, -1)
-            else:
-                attn_mask = add_optional_chunk_mask(x, mask_up.bool(), False, False, 0, 0, -1).repeat(1, x.size(1), 1)
-            attn_mask = mask_to_bias(attn_mask, x.dtype)
+            attn_mask = self._attn_mask(attn_masks, len(masks), x, mask_up, streaming)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -972,3 +1036,96 @@ class CausalConditionalDecoder(ConditionalDecoder):
         x = self.final_block(x, mask_up)
         output = self.final_proj(x * mask_up)
         return output * mask
+
+    def prepare_conditioning(self, mask, mu, spks=None, cond=None, streaming=False, x_channels=80, times=(),
+                             deep_cache_interval=1):
+        """
+        Loop-invariant part of `forward` for an ODE solve: the packed mu / spks / cond channels, and the
+        time embeddings of `times`. Attention masks and the embeddings of other times are added on first use.
+
+        Args:
+            mask (torch.Tensor): shape (batch_size, 1, time)
+            mu (torch.Tensor): shape (batch_size, mu_channels, time)
+            spks (torch.Tensor, optional): shape (batch_size, condition_channels). Defaults to None.
+            cond (torch.Tensor, optional): shape (batch_size, cond_channels, time). Defaults to None.
+            x_channels (int): channels of the x input, written by the caller into `prepared.x` before each call.
+            times (list[float]): solver times whose embeddings are computed up front.
+            deep_cache_interval (int): run the deep blocks on every n-th call only and reuse their output
+                on the others, see `DeepFeatureCache`. 1 runs the whole network on every call.
+
+        Returns:
+            PreparedConditioning
+        """
+        parts = [mu]
+        if spks is not None:
+            parts.append(spks.unsqueeze(-1).expand(-1, -1, mu.size(2)))
+        if cond is not None:
+            parts.append(cond)
+        inputs = torch.zeros([mu.size(0), x_channels + sum(part.size(1) for part in parts), mu.size(2)],
+                             device=mu.device, dtype=mu.dtype)
+        offset = x_channels
+        for part in parts:
+            inputs[:, offset:offset + part.size(1)] = part
+            offset += part.size(1)
+        deep_cache = DeepFeatureCache(deep_cache_interval) if deep_cache_interval > 1 else None
+        prepared = PreparedConditioning(inputs, mask, x_channels, streaming, deep_cache=deep_cache)
+        for t in times:
+            self._time_embedding(prepared, t)
+        return prepared
+
+    def _time_embedding(self, prepared, t: float):
+        emb = prepared.time_embeddings.get(t)
+        if emb is None:
+            t_in = torch.full([1], t, device=prepared.inputs.device, dtype=prepared.inputs.dtype)
+            emb = self.time_mlp(self.time_embeddings(t_in).to(t_in.dtype))
+            prepared.time_embeddings[t] = emb
+        return emb
+
+    def forward_prepared(self, prepared, t: float):
+        """`forward` over a `PreparedConditioning` whose `x` rows the caller has filled, at time `t`."""
+        t = self._time_embedding(prepared, t)
+        return self._forward_layers(prepared.inputs, prepared.mask, t, prepared.attn_masks, prepared.streaming,
+                                    prepared.deep_cache)
+
+
+class PreparedConditioning:
+    """
+    Estimator inputs that stay the same over the steps of an ODE solve, see
+    `CausalConditionalDecoder.prepare_conditioning`. `x` is a view on the first channels of `inputs`.
+    """
+
+    def __init__(self, inputs, mask, x_channels, streaming=False, time_embeddings=None, deep_cache=None):
+        self.inputs = inputs
+        self.x = inputs[:, :x_channels]
+        self.mask = mask
+        self.streaming = streaming
+        # time -> time_mlp output of shape (1, time_embed_dim), shared by all batch rows
+        self.time_embeddings = {} if time_embeddings is None else time_embeddings
+        # resolution level -> attention mask
+        self.attn_masks = {}
+        self.deep_cache = deep_cache
+
+    def narrow(self, batch_size):
+        """The first `batch_size` rows, sharing the buffers, the time embeddings and the deep feature cache."""
+        return PreparedConditioning(self.inputs[:batch_size], self.mask[:batch_size], self.x.size(1),
+                                    self.streaming, self.time_embeddings, self.deep_cache)
+
+
+class DeepFeatureCache:
+    """
+    DeepCache-style reuse of the deep U-Net features across the estimator calls of an ODE solve: every
+    `interval`-th call runs the whole network and stores the input of the last up block, the calls in
+    between reuse it. A call needs a stored feature with at least as many rows as its batch, the leading
+    rows being the conditional half of a CFG batch.
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.feature = None
+        self.num_calls = 0
+
+    def reuse(self, batch_size: int) -> bool:
+        reuse = (self.num_calls % self.interval != 0 and self.feature is not None
+                 and self.feature.size(0) >= batch_size)
+        self.num_calls += 1
+        return reuse
@@ -247,6 +247,24 @@ class EspnetRelPositionalEncoding(torch.nn.Module):
             ]
         return pos_emb
 
+    def forward_chunk(self, x: torch.Tensor, offset: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Add positional encoding to the frames `x` that follow `offset` cached frames.
+
+        Args:
+            x (torch.Tensor): Input tensor (batch, time, `*`).
+            offset (int): number of cached frames before `x`.
+
+        Returns:
+            torch.Tensor: Encoded tensor (batch, time, `*`).
+            torch.Tensor: Relative positions from the queries of `x` to the
+                cached and new keys (1, offset + 2 * time - 1, `*`).
+        """
+        self.extend_pe(x.new_zeros(1, offset + x.size(1)))
+        x = x * self.xscale
+        center = self.pe.size(1) // 2
+        pos_emb = self.pe[:, center - offset - x.size(1) + 1: center + x.size(1)]
+        return x, pos_emb
+
 
 class LinearNoSubsampling(torch.nn.Module):
     """Linear transform the input without subsampling
@@ -325,6 +343,16 @@ class Upsample1D(nn.Module):
         outputs = self.conv(outputs)
         return outputs, input_lengths * self.stride
 
+    def forward_chunk(self, inputs: torch.Tensor, cache: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        `forward` of the frames that follow `cache`, the last `stride` input frames (B, C, stride) of the
+        previous chunk, zeros for the first one. Returns the outputs and the cache of the next chunk.
+        """
+        inputs = torch.concat([cache, inputs], dim=2)
+        outputs = F.interpolate(inputs, scale_factor=float(self.stride), mode="nearest")
+        outputs = self.conv(outputs)
+        return outputs, inputs[:, :, -self.stride:]
+
 
 class PreLookaheadLayer(nn.Module):
     def __init__(self, channels: int, pre_lookahead_len: int = 1):
@@ -364,6 +392,22 @@ class PreLookaheadLayer(nn.Module):
         outputs = outputs + inputs
         return outputs
 
+    def forward_chunk(self, inputs: torch.Tensor, context: torch.Tensor, cache: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        `forward` of the frames that follow `cache`, the last `conv1` outputs (batch_size, channels, 2)
+        of the previous chunk, zeros for the first one. Returns the outputs and the cache of the next chunk.
+        """
+        outputs = inputs.transpose(1, 2).contiguous()
+        context = context.transpose(1, 2).contiguous()
+        if context.size(2) != 0:
+            outputs = torch.concat([outputs, context], dim=2)
+        outputs = F.pad(outputs, (0, self.pre_lookahead_len - context.size(2)), mode='constant', value=0.0)
+        outputs = torch.concat([cache, F.leaky_relu(self.conv1(outputs))], dim=2)
+        new_cache = outputs[:, :, -(self.conv2.kernel_size[0] - 1):]
+        outputs = self.conv2(outputs)
+        outputs = outputs.transpose(1, 2).contiguous()
+        return outputs + inputs, new_cache
+
 
 class MultiHeadedAttention(nn.Module):
     """Multi-Head Attention layer.
@@ -563,12 +607,14 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         torch.nn.init.xavier_uniform_(self.pos_bias_u)
         torch.nn.init.xavier_uniform_(self.pos_bias_v)
 
-    def rel_shift(self, x: torch.Tensor) -> torch.Tensor:
+    def rel_shift(self, x: torch.Tensor, time2: int = -1) -> torch.Tensor:
         """Compute relative positional encoding.
 
         Args:
-            x (torch.Tensor): Input tensor (batch, head, time1, 2*time1-1).
+            x (torch.Tensor): Input tensor (batch, head, time1, 2*time1-1),
+                or (batch, head, time1, time2+time1-1) with a key cache.
             time1 means the length of query vector.
+            time2 (int): length of key vector, -1 means time1.
 
         Returns:
             torch.Tensor: Output tensor.
@@ -583,7 +629,7 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
                                  x.size()[1],
                                  x.size(3) + 1, x.size(2))
         x = x_padded[:, :, 1:].view_as(x)[
-            :, :, :, : x.size(-1) // 2 + 1
+            :, :, :, : x.size(-1) // 2 + 1 if time2 < 0 else time2
         ]  # only keep the positions from 0 to time2
         return x
 
@@ -663,7 +709,7 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         matrix_bd = torch.matmul(q_with_bias_v, p.transpose(-2, -1))
         # NOTE(Xiang Lyu): Keep rel_shift since espnet rel_pos_emb is used
         if matrix_ac.shape != matrix_bd.shape:
-            matrix_bd = self.rel_shift(matrix_bd)
+            matrix_bd = self.rel_shift(matrix_bd, matrix_ac.size(-1))
 
         scores = (matrix_ac + matrix_bd) / math.sqrt(
             self.d_k)  # (batch, head, time1, time2)
@@ -837,6 +883,23 @@ class ConformerEncoderLayer(nn.Module):
         return x, mask, new_att_cache, new_cnn_cache
 
 
+class EncoderChunkCache:
+    """
+    Chunk streaming state of `UpsampleConformerEncoder` after its first `offset` input frames:
+    the key / value of every conformer layer and the left context of the lookahead and upsampling
+    convolutions. Only valid when those frames end on a chunk boundary and were encoded with their
+    real lookahead, since later chunks never change them then.
+    """
+
+    def __init__(self, offset: int, lookahead_cache: torch.Tensor, att_caches: list[torch.Tensor],
+                 up_cache: torch.Tensor, up_att_caches: list[torch.Tensor]):
+        self.offset = offset
+        self.lookahead_cache = lookahead_cache
+        self.att_caches = att_caches
+        self.up_cache = up_cache
+        self.up_att_caches = up_att_caches
+
+
 class UpsampleConformerEncoder(torch.nn.Module):
     """
     Args:
@@ -961,8 +1024,8 @@ class UpsampleConformerEncoder(torch.nn.Module):
             context, _, _ = self.embed(context, context_masks, offset=xs.size(1))
         mask_pad = masks  # (B, 1, T/subsample_rate)
         chunk_masks = add_optional_chunk_mask(xs, masks, False, False, 0, self.static_chunk_size if streaming is True else 0, -1)
-        # lookahead + conformer encoder
-        xs = self.pre_lookahead_layer(xs, context=context)
+        # lookahead + conformer encoder, the lookahead of a padded row sees zeros past its end as an unpadded one
+        xs = self.pre_lookahead_layer(xs * mask_pad.transpose(1, 2), context=context)
         xs = self.forward_layers(xs, chunk_masks, pos_emb, mask_pad)
 
         # upsample + conformer encoder
@@ -982,6 +1045,65 @@ class UpsampleConformerEncoder(torch.nn.Module):
         # for cross attention with decoder later
         return xs, masks
 
+    def forward_chunk(
+        self,
+        xs: torch.Tensor,
+        context: torch.Tensor = torch.zeros(0, 0, 0),
+        cache: Optional[EncoderChunkCache] = None,
+    ) -> Tuple[torch.Tensor, EncoderChunkCache]:
+        """Streaming encode of the frames that follow the ones summarised by `cache`.
+
+        Gives the output of `forward(..., streaming=True)` over the cached and
+        the new frames, restricted to the new ones, without encoding the cached
+        frames again. The batch must not be padded.
+
+        Args:
+            xs: input tensor (B, T, D) of the new frames
+            context: lookahead frames (B, pre_lookahead_len, D) after `xs`,
+                empty for the end of the sequence
+            cache: state after the previous frames, None at the start
+        Returns:
+            xs: output tensor of the new frames (B, T * stride, D)
+            cache: state after the new frames, reusable only when they end on
+                a chunk boundary and `context` holds the real lookahead
+        """
+        offset = 0 if cache is None else cache.offset
+        if cache is None:
+            cache = EncoderChunkCache(
+                0,
+                xs.new_zeros(xs.size(0), self.pre_lookahead_layer.channels, self.pre_lookahead_layer.conv2.kernel_size[0] - 1),
+                [torch.zeros((0, 0, 0, 0))] * len(self.encoders),
+                xs.new_zeros(xs.size(0), self.up_layer.channels, self.up_layer.stride),
+                [torch.zeros((0, 0, 0, 0))] * len(self.up_encoders),
+            )
+        T = xs.size(1)
+        xs, pos_emb = self.embed.pos_enc.forward_chunk(self.embed.out(xs), offset)
+        if context.size(1) != 0:
+            context_masks = torch.ones(1, 1, context.size(1), dtype=torch.bool, device=xs.device)
+            context, _, _ = self.embed(context, context_masks, offset=offset + T)
+        chunk_masks = subsequent_chunk_mask(offset + T, self.static_chunk_size, device=xs.device)[offset:].unsqueeze(0)
+        # lookahead + conformer encoder
+        xs, lookahead_cache = self.pre_lookahead_layer.forward_chunk(xs, context, cache.lookahead_cache)
+        att_caches = []
+        for layer, att_cache in zip(self.encoders, cache.att_caches):
+            xs, _, att_cache, _ = layer(xs, chunk_masks, pos_emb, att_cache=att_cache)
+            att_caches.append(att_cache)
+
+        # upsample + conformer encoder
+        xs, up_cache = self.up_layer.forward_chunk(xs.transpose(1, 2).contiguous(), cache.up_cache)
+        xs = xs.transpose(1, 2).contiguous()
+        up_offset = offset * self.up_layer.stride
+        xs, pos_emb = self.up_embed.pos_enc.forward_chunk(self.up_embed.out(xs), up_offset)
+        chunk_masks = subsequent_chunk_mask(up_offset + xs.size(1), self.static_chunk_size * self.up_layer.stride,
+                                            device=xs.device)[up_offset:].unsqueeze(0)
+        up_att_caches = []
+        for layer, att_cache in zip(self.up_encoders, cache.up_att_caches):
+            xs, _, att_cache, _ = layer(xs, chunk_masks, pos_emb, att_cache=att_cache)
+            up_att_caches.append(att_cache)
+
+        xs = self.after_norm(xs)
+        return xs, EncoderChunkCache(offset + T, lookahead_cache, att_caches, up_cache, up_att_caches)
+
     def forward_layers(self, xs: torch.Tensor, chunk_masks: torch.Tensor,
                        pos_emb: torch.Tensor,
                        mask_pad: torch.Tensor) -> torch.Tensor:
@@ -22,15 +22,14 @@ import torch.nn as nn
 import torch.nn.functional as F
 from scipy.signal import get_window
 from torch.nn import Conv1d, ConvTranspose1d
-from torch.nn.utils import remove_weight_norm
-
 try:
     from torch.nn.utils.parametrizations import weight_norm
 except ImportError:
     from torch.nn.utils import weight_norm  # noqa
 
 from soulxpodcast.models.modules.hifigan_components.layers import (
-    ResBlock, SourceModuleHnNSF, SourceModuleHnNSF2, init_weights)
+    ResBlock, SourceModuleHnNSF, SourceModuleHnNSF2, fold_weight_norm,
+    init_weights)
 
 
 class ConvRNNF0Predictor(nn.Module):
@@ -169,20 +168,23 @@ class HiFTGenerator(nn.Module):
         self.reflection_pad = nn.ReflectionPad1d((1, 0))
         self.stft_window = torch.from_numpy(get_window("hann", istft_params["n_fft"], fftbins=True).astype(np.float32))
         self.f0_predictor = ConvRNNF0Predictor() if f0_predictor is None else f0_predictor
+        # `decode_spec` replacement, e.g. an ONNX Runtime session or a compiled graph
+        self.spec_decoder = None
 
     def remove_weight_norm(self):
+        """Fold every weight norm into plain conv weights, for inference; the source module and `source_downs` have none."""
         print('Removing weight norm...')
         for up in self.ups:
-            remove_weight_norm(up)
+            fold_weight_norm(up)
         for resblock in self.resblocks:
             resblock.remove_weight_norm()
-        remove_weight_norm(self.conv_pre)
-        remove_weight_norm(self.conv_post)
-        self.m_source.remove_weight_norm()
-        for source_down in self.source_downs:
-            remove_weight_norm(source_down)
+        fold_weight_norm(self.conv_pre)
+        fold_weight_norm(self.conv_post)
         for source_resblock in self.source_resblocks:
             source_resblock.remove_weight_norm()
+        for module in self.f0_predictor.condnet:
+            if isinstance(module, nn.Conv1d):
+                fold_weight_norm(module)
 
     def _stft(self, x):
         spec = torch.stft(
@@ -204,6 +206,19 @@ class HiFTGenerator(nn.Module):
         s_stft_real, s_stft_imag = self._stft(s.squeeze(1))
         s_stft = torch.cat([s_stft_real, s_stft_imag], dim=1)
 
+        if self.spec_decoder is not None:
+            x = self.spec_decoder(x, s_stft)
+        else:
+            x = self.decode_spec(x, s_stft)
+        magnitude = torch.exp(x[:, :self.istft_params["n_fft"] // 2 + 1, :])
+        phase = torch.sin(x[:, self.istft_params["n_fft"] // 2 + 1:, :])  # actually, sin is redundancy
+
+        x = self._istft(magnitude, phase)
+        x = torch.clamp(x, -self.audio_limit, self.audio_limit)
+        return x
+
+    def decode_spec(self, x: torch.Tensor, s_stft: torch.Tensor) -> torch.Tensor:
+        """Upsampling stack of `decode`, from the mel and the source STFT to the log magnitude / phase of the iSTFT."""
         x = self.conv_pre(x)
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, self.lrelu_slope)
@@ -226,24 +241,25 @@ class HiFTGenerator(nn.Module):
             x = xs / self.num_kernels
 
         x = F.leaky_relu(x)
-        x = self.conv_post(x)
-        magnitude = torch.exp(x[:, :self.istft_params["n_fft"] // 2 + 1, :])
-        phase = torch.sin(x[:, self.istft_params["n_fft"] // 2 + 1:, :])  # actually, sin is redundancy
-
-        x = self._istft(magnitude, phase)
-        x = torch.clamp(x, -self.audio_limit, self.audio_limit)
-        return x
+        return self.conv_post(x)
 
-    @torch.inference_mode()
-    def forward(self, speech_feat: torch.Tensor, cache_source: torch.Tensor = torch.zeros(1, 1, 0)) -> torch.Tensor:
+    def source(self, speech_feat: torch.Tensor, cache_source: torch.Tensor = torch.zeros(1, 1, 0),
+               generator: torch.Generator = None) -> torch.Tensor:
+        """Harmonic source (bs, 1, t * upsample_scale) of the mel, its phase runs over the whole sequence."""
         # mel->f0
         f0 = self.f0_predictor(speech_feat)
         # f0->source
         s = self.f0_upsamp(f0[:, None]).transpose(1, 2)  # bs,n,t
-        s, _, _ = self.m_source(s)
+        s, _, _ = self.m_source(s, generator=generator)
         s = s.transpose(1, 2)
         # use cache_source to avoid glitch
         if cache_source.shape[2] != 0:
             s[:, :, :cache_source.shape[2]] = cache_source
+        return s
+
+    @torch.inference_mode()
+    def forward(self, speech_feat: torch.Tensor, cache_source: torch.Tensor = torch.zeros(1, 1, 0),
+                generator: torch.Generator = None) -> torch.Tensor:
+        s = self.source(speech_feat, cache_source=cache_source, generator=generator)
         generated_speech = self.decode(x=speech_feat, s=s)
         return generated_speech, s
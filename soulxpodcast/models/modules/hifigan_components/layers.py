@@ -5,7 +5,7 @@ import torch
 import torch.nn as nn
 from torch.distributions.uniform import Uniform
 from torch.nn import Conv1d
-from torch.nn.utils import remove_weight_norm
+from torch.nn.utils import parametrize, remove_weight_norm
 
 try:
     from torch.nn.utils.parametrizations import weight_norm
@@ -13,6 +13,14 @@ except ImportError:
     from torch.nn.utils import weight_norm  # noqa
 
 
+def fold_weight_norm(module: nn.Module):
+    """Fold the weight norm of `module` into a plain weight, for the parametrization and the legacy hook versions."""
+    if parametrize.is_parametrized(module, "weight"):
+        parametrize.remove_parametrizations(module, "weight", leave_parametrized=True)
+    else:
+        remove_weight_norm(module)
+
+
 def get_padding(kernel_size, dilation=1):
     return int((kernel_size * dilation - dilation) / 2)
 
@@ -146,8 +154,8 @@ class ResBlock(torch.nn.Module):
 
     def remove_weight_norm(self):
         for idx in range(len(self.convs1)):
-            remove_weight_norm(self.convs1[idx])
-            remove_weight_norm(self.convs2[idx])
+            fold_weight_norm(self.convs1[idx])
+            fold_weight_norm(self.convs2[idx])
 
 
 class SineGen(torch.nn.Module):
@@ -248,7 +256,7 @@ class SourceModuleHnNSF(torch.nn.Module):
         self.l_linear = torch.nn.Linear(harmonic_num + 1, 1)
         self.l_tanh = torch.nn.Tanh()
 
-    def forward(self, x):
+    def forward(self, x, generator=None):
         """
         Sine_source, noise_source = SourceModuleHnNSF(F0_sampled)
         F0_sampled (batchsize, length, 1)
@@ -263,7 +271,7 @@ class SourceModuleHnNSF(torch.nn.Module):
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
 
         # source for noise branch, in the same shape as uv
-        noise = torch.randn_like(uv) * self.sine_amp / 3
+        noise = torch.randn(uv.shape, generator=generator, device=uv.device, dtype=uv.dtype) * self.sine_amp / 3
         return sine_merge, noise, uv
 
 
@@ -302,7 +310,7 @@ class SineGen2(torch.nn.Module):
         uv = (f0 > self.voiced_threshold).type(torch.float32)
         return uv
 
-    def _f02sine(self, f0_values):
+    def _f02sine(self, f0_values, generator=None):
         """ f0_values: (batchsize, length, dim)
             where dim indicates fundamental tone and overtones
         """
@@ -311,7 +319,7 @@ class SineGen2(torch.nn.Module):
         rad_values = (f0_values / self.sampling_rate) % 1
 
         # initial phase noise (no noise for fundamental component)
-        rand_ini = torch.rand(f0_values.shape[0], f0_values.shape[2], device=f0_values.device)
+        rand_ini = torch.rand(f0_values.shape[0], f0_values.shape[2], generator=generator, device=f0_values.device)
         rand_ini[:, 0] = 0
         rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
 
@@ -355,7 +363,7 @@ class SineGen2(torch.nn.Module):
             sines = torch.cos(i_phase * 2 * np.pi)
         return sines
 
-    def forward(self, f0):
+    def forward(self, f0, generator=None):
         """ sine_tensor, uv = forward(f0)
         input F0: tensor(batchsize=1, length, dim=1)
                   f0 for unvoiced steps should be 0
@@ -366,7 +374,7 @@ class SineGen2(torch.nn.Module):
         fn = torch.multiply(f0, torch.FloatTensor([[range(1, self.harmonic_num + 2)]]).to(f0.device))
 
         # generate sine waveforms
-        sine_waves = self._f02sine(fn) * self.sine_amp
+        sine_waves = self._f02sine(fn, generator=generator) * self.sine_amp
 
         # generate uv signal
         uv = self._f02uv(f0)
@@ -375,7 +383,7 @@ class SineGen2(torch.nn.Module):
         #        std = self.sine_amp/3 -> max value ~ self.sine_amp
         # .       for voiced regions is self.noise_std
         noise_amp = uv * self.noise_std + (1 - uv) * self.sine_amp / 3
-        noise = noise_amp * torch.randn_like(sine_waves)
+        noise = noise_amp * torch.randn(sine_waves.shape, generator=generator, device=sine_waves.device, dtype=sine_waves.dtype)
 
         # first: set the unvoiced part to 0 by uv
         # then: additive noise
@@ -416,7 +424,7 @@ class SourceModuleHnNSF2(torch.nn.Module):
         self.l_linear = torch.nn.Linear(harmonic_num + 1, 1)
         self.l_tanh = torch.nn.Tanh()
 
-    def forward(self, x):
+    def forward(self, x, generator=None):
         """
         Sine_source, noise_source = SourceModuleHnNSF(F0_sampled)
         F0_sampled (batchsize, length, 1)
@@ -425,9 +433,9 @@ class SourceModuleHnNSF2(torch.nn.Module):
         """
         # source for harmonic branch
         with torch.no_grad():
-            sine_wavs, uv, _ = self.l_sin_gen(x)
+            sine_wavs, uv, _ = self.l_sin_gen(x, generator=generator)
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
 
         # source for noise branch, in the same shape as uv
-        noise = torch.randn_like(uv) * self.sine_amp / 3
+        noise = torch.randn(uv.shape, generator=generator, device=uv.device, dtype=uv.dtype) * self.sine_amp / 3
         return sine_merge, noise, uv
@@ -21,6 +21,83 @@ from transformers.generation.utils import (
 from transformers import StoppingCriteria
 
 
+class SpeechVocabHead:
+    """
+    LM head restricted to the speech tokens plus the speech eos.
+
+    Speech decoding can only emit `speech_token_offset + [0, speech_vocab_size)` or `eos_token_id`, so the
+    head weight is sliced to these rows and logits, logits processors and sampling all run over the
+    sub-vocabulary. Sub-vocabulary index `speech_vocab_size` is the eos; one extra always masked column
+    stands for every other token so that processors reading the history (repetition penalty) still work.
+
+    Args:
+        lm_head_weight: [vocab_size, hidden_size] weight of the (tied) LM head.
+    """
+
+    def __init__(self, lm_head_weight: torch.Tensor, speech_token_offset: int, speech_vocab_size: int, eos_token_id: int):
+        self.eos_index = speech_vocab_size
+        self.other_index = speech_vocab_size + 1
+        self.to_full = torch.cat([
+            torch.arange(speech_token_offset, speech_token_offset + speech_vocab_size),
+            torch.tensor([eos_token_id]),
+        ]).to(lm_head_weight.device)
+        self.weight = lm_head_weight.detach()[self.to_full].contiguous()
+        self.to_sub = torch.full((lm_head_weight.shape[0],), self.other_index, dtype=torch.long, device=lm_head_weight.device)
+        self.to_sub[self.to_full] = torch.arange(speech_vocab_size + 1, device=lm_head_weight.device)
+
+    def logits(self, hidden_states: torch.Tensor) -> torch.FloatTensor:
+        logits = nn.functional.linear(hidden_states, self.weight).float()
+        return nn.functional.pad(logits, (0, 1), value=-float("inf"))
+
+
+def _ras_next_tokens(
+    input_ids: torch.LongTensor,
+    next_token_scores: torch.FloatTensor,
+    next_token_logits: torch.FloatTensor,
+    do_sample: bool = True,
+    use_ras: bool = False,
+    win_size: int = 25,
+    tau_r: float = 0.2,
+) -> tuple[torch.LongTensor, Optional[torch.BoolTensor]]:
+    r"""
+    Select the next token of every sequence with Repetition Aware Sampling (VALL-E 2), fully on device.
+
+    Sampling uses the exponential race: argmax(scores - log(E)) with E ~ Exp(1) is distributed as
+    softmax(scores), so neither a softmax nor a multinomial is needed. With RAS a candidate is drawn
+    from the processed scores and, for the rows where it already occurs `win_size * tau_r` times in the
+    last `win_size` tokens, replaced by an independent draw from the raw logits; the other rows keep the
+    candidate itself, as in VALL-E 2.
+
+    Return:
+        `(next_tokens, fallback)`: next tokens of shape `(batch_size,)` and the `(batch_size, 1)` mask of
+        the rows that fell back to the raw logits (None without RAS).
+    """
+    if do_sample:
+        # one draw of the race for the candidate and one for the fallback; clamp so that log never sees 0
+        race = torch.empty((2 if use_ras else 1,) + next_token_scores.shape,
+                           device=next_token_scores.device, dtype=torch.float32)
+        race = race.exponential_().clamp_(min=torch.finfo(torch.float32).tiny).log_()
+        next_tokens = (next_token_scores - race[0]).argmax(dim=-1, keepdim=True)
+    else:
+        next_tokens = next_token_scores.argmax(dim=-1, keepdim=True)
+    if not use_ras:
+        return next_tokens.squeeze(1), None
+
+    if do_sample:
+        resampled_tokens = (next_token_logits - race[1]).argmax(dim=-1, keepdim=True)
+    else:
+        resampled_tokens = next_token_logits.argmax(dim=-1, keepdim=True)
+    rep_num = (input_ids[:, -win_size:] == next_tokens).sum(dim=-1, keepdim=True) + 1
+    fallback = rep_num >= win_size * tau_r
+    return torch.where(fallback, resampled_tokens, next_tokens).squeeze(1), fallback
+
+
+def _cache_row(past_key_values, row: int, copy: bool = False) -> list:
+    """Per-layer (key, value) of one batch row of a DynamicCache, copied when the cache is about to shrink."""
+    kv = [(layer.keys[row:row + 1], layer.values[row:row + 1]) for layer in past_key_values.layers]
+    return [(key.clone(), value.clone()) for key, value in kv] if copy else kv
+
+
 def _ras_sample_hf_engine(
     self,
     input_ids: torch.LongTensor,
@@ -32,6 +109,9 @@ def _ras_sample_hf_engine(
     use_ras=False,
     win_size=25,
     tau_r=0.2,
+    speech_vocab: Optional[SpeechVocabHead] = None,
+    speech_logits_processor: Optional[LogitsProcessorList] = None,
+    finished_kv: Optional[dict] = None,
     **model_kwargs,
 ) -> Union[GenerateNonBeamOutput, torch.LongTensor]:
     r"""
@@ -55,6 +135,13 @@ def _ras_sample_hf_engine(
         streamer (`BaseStreamer`, *optional*):
             Streamer object that will be used to stream the generated sequences. Generated tokens are passed
             through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
+        finished_kv (`dict`, *optional*):
+            Filled with the per-layer (key, value) of every sequence, by batch row: taken when a finished
+            sequence leaves the batch, or at the end for the others. Each covers every token of its
+            sequence but the last sampled one.
+        speech_vocab (`SpeechVocabHead`, *optional*):
+            Decode over the speech sub-vocabulary only. The base model is run without its LM head and
+            `speech_logits_processor`, built for sub-vocabulary ids, replaces `logits_processor`.
         model_kwargs:
             Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
             an encoder-decoder model the kwargs should include `encoder_outputs`.
@@ -94,6 +181,10 @@ def _ras_sample_hf_engine(
     batch_size, cur_len = input_ids.shape[:2]
     this_peer_finished = False
     unfinished_sequences = torch.ones(batch_size, dtype=torch.long, device=input_ids.device)
+    # finished rows leave the batch, remember where the remaining ones came from
+    row_ids = list(range(batch_size))
+    finished_rows = {}
+    drop_finished = batch_size > 1 and not return_dict_in_generate and not synced_gpus
     model_kwargs = self._get_initial_cache_position(cur_len, input_ids.device, model_kwargs)
 
     model_forward = self.__call__
@@ -101,6 +192,11 @@ def _ras_sample_hf_engine(
     if compile_forward:
         os.environ["TOKENIZERS_PARALLELISM"] = "0"
         model_forward = self.get_compiled_call(generation_config.compile_config)
+    if speech_vocab is not None:
+        # hidden states only, the head is applied on the sub-vocabulary below
+        model_forward = self.model.__call__
+        logits_processor = speech_logits_processor
+        sub_input_ids = speech_vocab.to_sub[input_ids]
 
     if generation_config.prefill_chunk_size is not None:
         model_kwargs = self._prefill_chunking(input_ids, generation_config, **model_kwargs)
@@ -116,7 +212,11 @@ def _ras_sample_hf_engine(
         model_inputs.update({"output_attentions": output_attentions} if output_attentions else {})
         model_inputs.update({"output_hidden_states": output_hidden_states} if output_hidden_states else {})
 
-        if is_prefill:
+        if speech_vocab is not None:
+            model_inputs.pop("logits_to_keep", None)
+            outputs = model_forward(**model_inputs)
+            is_prefill = False
+        elif is_prefill:
             outputs = self(**model_inputs, return_dict=True)
             is_prefill = False
         else:
@@ -133,23 +233,29 @@ def _ras_sample_hf_engine(
 
         # Copy is needed to avoid keeping a hanging ref to outputs.logits which may be very large for first iteration
         # (the clone itself is always small)
-        next_token_logits = outputs.logits[:, -1, :].to(copy=True, dtype=torch.float32, device=input_ids.device)
-        
-        
+        if speech_vocab is not None:
+            next_token_logits = speech_vocab.logits(outputs.last_hidden_state[:, -1, :]).to(device=input_ids.device)
+        else:
+            next_token_logits = outputs.logits[:, -1, :].to(copy=True, dtype=torch.float32, device=input_ids.device)
+        processor_input_ids = sub_input_ids if speech_vocab is not None else input_ids
+
         # pre-process distribution
-        next_token_scores = logits_processor(input_ids, next_token_logits)
+        next_token_scores = logits_processor(processor_input_ids, next_token_logits)
 
-        # Repetition Aware Sampling in VALL-E 2
-        if use_ras:
-            probs_candidate = nn.functional.softmax(next_token_scores, dim=-1)
-            next_tokens_candidate = torch.multinomial(probs_candidate, num_samples=1).squeeze(1)
-            rep_num = (input_ids[:,-win_size:] == next_tokens_candidate).sum().item() + 1
-            if rep_num >= win_size * tau_r:
-                next_token_scores = next_token_logits
+        # token selection with Repetition Aware Sampling in VALL-E 2, no host sync
+        next_tokens, ras_fallback = _ras_next_tokens(
+            processor_input_ids, next_token_scores, next_token_logits,
+            do_sample=do_sample, use_ras=use_ras, win_size=win_size, tau_r=tau_r,
+        )
+        if speech_vocab is not None:
+            sub_input_ids = torch.cat([sub_input_ids, next_tokens[:, None]], dim=-1)
+            next_tokens = speech_vocab.to_full[next_tokens]
 
         # Store scores, attentions and hidden_states when required
         if return_dict_in_generate:
             if output_scores:
+                if ras_fallback is not None:
+                    next_token_scores = torch.where(ras_fallback, next_token_logits, next_token_scores)
                 scores += (next_token_scores,)
             if output_logits:
                 raw_logits += (next_token_logits,)
@@ -167,14 +273,6 @@ def _ras_sample_hf_engine(
                     else (outputs.hidden_states,)
                 )
 
-        # token selection
-        if do_sample:
-            probs = nn.functional.softmax(next_token_scores, dim=-1)
-            # TODO (joao): this OP throws "skipping cudagraphs due to ['incompatible ops']", find solution
-            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
-        else:
-            next_tokens = torch.argmax(next_token_scores, dim=-1)
-
         # finished sentences should have their next token be a padding token
         if has_eos_stopping_criteria:
             next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
@@ -185,9 +283,28 @@ def _ras_sample_hf_engine(
             streamer.put(next_tokens.cpu())
 
         unfinished_sequences = unfinished_sequences & ~stopping_criteria(input_ids, scores)
-        this_peer_finished = unfinished_sequences.max() == 0
+        # one host sync per step for both flags
+        any_unfinished, all_unfinished = torch.stack([unfinished_sequences.max(), unfinished_sequences.min()]).tolist()
+        this_peer_finished = any_unfinished == 0
         cur_len += 1
 
+        # drop finished sequences from the batch together with their cache and attention rows
+        if drop_finished and not this_peer_finished and all_unfinished == 0:
+            keep = unfinished_sequences.nonzero().squeeze(1)
+            for row in (unfinished_sequences == 0).nonzero().squeeze(1).tolist():
+                finished_rows[row_ids[row]] = input_ids[row]
+                if finished_kv is not None:
+                    # the eos just sampled is not in the cache yet
+                    finished_kv[row_ids[row]] = _cache_row(model_kwargs["past_key_values"], row, copy=True)
+            row_ids = [row_ids[row] for row in keep.tolist()]
+            input_ids = input_ids[keep]
+            if speech_vocab is not None:
+                sub_input_ids = sub_input_ids[keep]
+            unfinished_sequences = unfinished_sequences[keep]
+            if model_kwargs.get("attention_mask") is not None:
+                model_kwargs["attention_mask"] = model_kwargs["attention_mask"][keep]
+            model_kwargs["past_key_values"].batch_select_indices(keep)
+
         # This is needed to properly delete outputs.logits which may be very large for first iteration
         # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
         del outputs
@@ -195,6 +312,19 @@ def _ras_sample_hf_engine(
     if streamer is not None:
         streamer.end()
 
+    if finished_kv is not None:
+        for row, row_id in enumerate(row_ids):
+            finished_kv[row_id] = _cache_row(model_kwargs["past_key_values"], row)
+
+    if finished_rows:
+        # put the dropped sequences back in place, right padded
+        for row, row_id in enumerate(row_ids):
+            finished_rows[row_id] = input_ids[row]
+        fill_value = pad_token_id if pad_token_id is not None else 0
+        input_ids = torch.full((batch_size, cur_len), fill_value, dtype=input_ids.dtype, device=input_ids.device)
+        for row_id, sequence in finished_rows.items():
+            input_ids[row_id, :sequence.shape[0]] = sequence
+
     if return_dict_in_generate:
         if self.config.is_encoder_decoder:
             return GenerateEncoderDecoderOutput(
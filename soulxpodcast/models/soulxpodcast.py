@@ -1,9 +1,13 @@
+import os
 import time
+import threading
 from datetime import datetime
 
 from tqdm import tqdm
 from itertools import chain
 from copy import deepcopy
+from dataclasses import replace
+from collections import deque
 
 import numpy as np
 import s3tokenizer
@@ -14,15 +18,35 @@ from soulxpodcast.config import Config, SamplingParams, AutoPretrainedConfig
 from soulxpodcast.engine.llm_engine import (
     HFLLMEngine, VLLMEngine
 )
-from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec
+from soulxpodcast.engine.acoustic_pipeline import AcousticPipeline
+from soulxpodcast.engine.compile_backend import (apply_compile_backend,
+                                                  warmup_compiled)
+from soulxpodcast.engine.dialect_cache import DialectPromptCache, dialect_prompt_key, model_fingerprint
+from soulxpodcast.engine.onnx_backend import (OrtSpeechTokenizer, apply_onnx_backend,
+                                               load_speech_tokenizer)
+from soulxpodcast.engine.speaker_cache import SpeakerFlowCache, prompt_audio_key
+from soulxpodcast.engine.streamer import SpeechTokenStreamer
+from soulxpodcast.engine.vocoder_engine import VocoderEngine
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec, CfgSchedule, FlowSpeaker
 from soulxpodcast.models.modules.hifigan import HiFTGenerator
+from soulxpodcast.utils.audio import fade_in_out
+from soulxpodcast.utils.commons import bucket_by_length
+from soulxpodcast.utils.export import ACOUSTIC_ARTIFACT, load_acoustic, load_checkpoints
 
 class SoulXPodcast(torch.nn.Module):
     def __init__(self, config: Config = None):
         super().__init__()
         self.config = Config() if config is None else config
+        self.device = torch.device(self.config.device)
+        if self.config.num_threads > 0:
+            torch.set_num_threads(self.config.num_threads)
 
-        self.audio_tokenizer = s3tokenizer.load_model("speech_tokenizer_v2_25hz").cuda().eval()
+        self.audio_tokenizer = None
+        if self.config.acoustic_backend == "onnx":
+            self.audio_tokenizer = load_speech_tokenizer(self.config.model, self.device, self.config.onnx_num_threads)
+        if self.audio_tokenizer is None:
+            self.audio_tokenizer = s3tokenizer.load_model("speech_tokenizer_v2_25hz").to(self.device).eval()
+        self._tokenize_lock = threading.Lock()
         if self.config.llm_engine == "hf":
             self.llm = HFLLMEngine(**self.config.__dict__)
         elif self.config.llm_engine == "vllm":
@@ -32,137 +56,545 @@ class SoulXPodcast(torch.nn.Module):
 
         self.use_tqdm = True
 
-        self.flow = CausalMaskedDiffWithXvec()
-        if self.config.hf_config.fp16_flow:
+        # flow + HiFT from the exported artifact (cli/export.py) when present, else from the checkpoints
+        acoustic_artifact = os.path.join(self.config.model, ACOUSTIC_ARTIFACT)
+        if os.path.exists(acoustic_artifact):
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+            tqdm.write(f"[{timestamp}] - [INFO] - Loading flow and HiFT from {acoustic_artifact}")
+            self.flow, self.hift = CausalMaskedDiffWithXvec(), HiFTGenerator()
+            load_acoustic(acoustic_artifact, self.flow, self.hift, self.device)
+        else:
+            self.flow, self.hift = load_checkpoints(self.config.model)
+
+        self.fp16_flow = self.config.hf_config.fp16_flow and self.device.type == "cuda"
+        if self.fp16_flow:
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
             tqdm.write(f"[{timestamp}] - [INFO] - Casting flow to fp16")
-            self.flow.half()
-        self.flow.load_state_dict(torch.load(f"{self.config.model}/flow.pt", map_location="cpu", weights_only=True), strict=True)
-        self.flow.cuda().eval()
+        elif self.config.hf_config.fp16_flow:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+            tqdm.write(f"[{timestamp}] - [WARNING] - fp16 flow needs cuda, running flow in {self.config.cpu_dtype} on {self.device}")
+        self.flow.to(self.device, dtype=torch.float16 if self.fp16_flow else torch.float32).eval()
+        self.speaker_cache = SpeakerFlowCache(self.config.speaker_cache_size)
+        self.dialect_cache = DialectPromptCache(self.config.dialect_cache_size, self.config.dialect_cache_dir)
+        self.model_id = model_fingerprint(self.config.model)
+
+        self.hift.to(self.device, dtype=torch.float32).eval()
+        if self.config.acoustic_backend == "onnx":
+            onnx_parts = apply_onnx_backend(self.config.model, self.flow, self.hift, self.device, self.config.onnx_num_threads)
+            if isinstance(self.audio_tokenizer, OrtSpeechTokenizer):
+                onnx_parts["speech_tokenizer"] = True
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+            tqdm.write(f"[{timestamp}] - [INFO] - ONNX Runtime backend for: {', '.join(onnx_parts) or 'nothing, no graph found'}")
+        self.vocoder = VocoderEngine(self.hift, window_frames=self.config.hift_window_frames,
+                                     overlap_frames=self.config.hift_window_overlap,
+                                     batch_size=self.config.hift_batch_size)
+        self.compile_stats = None
+        if self.config.acoustic_backend == "compile":
+            self.compile_stats = apply_compile_backend(self.flow, self.hift, tuple(self.config.compile_buckets),
+                                                       self.config.compile_backend)
+            if self.config.compile_warmup:
+                start_time = time.time()
+                warmup_compiled(self.flow, self.vocoder, tuple(self.config.compile_buckets), self._flow_autocast,
+                                **self._flow_options(None))
+                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
+                tqdm.write(f"[{timestamp}] - [INFO] - Compiled flow and HiFT for buckets {tuple(self.config.compile_buckets)} "
+                           f"in {time.time() - start_time:.1f}s")
 
-        self.hift = HiFTGenerator()
-        hift_state_dict = {k.replace('generator.', ''): v for k, v in torch.load(f"{self.config.model}/hift.pt", map_location="cpu", weights_only=True).items()}
-        self.hift.load_state_dict(hift_state_dict, strict=True)
-        self.hift.cuda().eval()
+        # HiFT caches of chunk streaming: the last mel frames are vocoded again with the next chunk,
+        #    their source is reused and their speech cross-faded to avoid glitches at chunk borders.
+        self.mel_cache_len = 8
+        self.source_cache_len = self.mel_cache_len * 480
+        self.speech_window = torch.from_numpy(np.hamming(2 * self.source_cache_len)).float()
 
-    
     @torch.inference_mode()
-    def forward_longform(
+    def tokenize_prompts(self, log_mels: list[torch.Tensor]) -> list[list[int]]:
+        """
+        Speech tokens of prompt log-mels (128, T), quantized as one padded batch. Calls are serialized, so
+        prompts can be tokenized next to a running generation (e.g. speaker registration in the API).
+        """
+        mels, mels_lens = s3tokenizer.padding(log_mels)
+        with self._tokenize_lock:
+            tokens, tokens_lens = self.audio_tokenizer.quantize(mels.to(self.device), mels_lens.to(self.device))
+        return [tokens[i, :int(tokens_lens[i])].tolist() for i in range(len(log_mels))]
+
+    def _flow_autocast(self):
+        """fp16 / fp32 autocast of the flow on cuda, optional bf16 on CPU."""
+        if self.device.type == "cuda":
+            return torch.amp.autocast("cuda", dtype=torch.float16 if self.fp16_flow else torch.float32)
+        return torch.amp.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.config.cpu_dtype == "bfloat16")
+
+    def _flow_options(self, sampling_params: SamplingParams | list[SamplingParams]) -> dict:
+        """Flow ODE solver, step count, guidance schedule and deep feature reuse of a request, the sampling params override the config."""
+        sampling_param = sampling_params[0] if isinstance(sampling_params, (list, tuple)) else sampling_params
+
+        def option(name):
+            value = getattr(sampling_param, name, None)
+            return getattr(self.config, name) if value is None else value
+
+        return {
+            'solver': option('flow_solver'),
+            'n_timesteps': option('flow_n_timesteps'),
+            'cfg_schedule': CfgSchedule(
+                interval=tuple(option('flow_cfg_interval')),
+                stride=option('flow_cfg_stride'),
+                reuse_delta=option('flow_cfg_reuse'),
+            ),
+            'deep_cache_interval': option('flow_deep_cache_interval'),
+        }
+
+    def _render_batch(self, jobs: list[tuple], flow_options: dict | None = None) -> list[torch.Tensor]:
+        """
+        Flow + HiFi-GAN for a batch of turns, the flow runs once over the padded batch.
+
+        Each job is (generated_speech_tokens, speaker, seed), `speaker` the `FlowSpeaker` of the turn;
+        the noise of a turn is drawn from its own generator, so the output does not depend on the batching.
+        `flow_options` holds the `solver`, `n_timesteps`, `cfg_schedule` and `deep_cache_interval` of the flow ODE.
+        """
+        device = self.device
+        generators = [torch.Generator(device=device).manual_seed(job[2]) for job in jobs]
+
+        # Flow generation
+        with self._flow_autocast():
+            generated_mels, generated_mels_lens = self.flow.forward_speakers(
+                [job[1] for job in jobs], [job[0] for job in jobs],
+                streaming=False, finalize=True,
+                generator=generators[0] if len(jobs) == 1 else generators,
+                **(flow_options or {}),
+            )
+
+        # HiFi-GAN generation, long turns in overlapping windows batched across the turns
+        prompt_mels_lens = [job[1].prompt_feat.shape[0] for job in jobs]
+        mels = [generated_mels[i:i+1, :, mel_start:mel_end]
+                for i, (mel_start, mel_end) in enumerate(zip(prompt_mels_lens, generated_mels_lens.tolist()))]
+        wavs, _ = self.vocoder(mels, generators)
+        return wavs
+
+    def _render_turns(self, jobs: list[tuple], flow_options: dict | None = None) -> tuple[list[torch.Tensor], float]:
+        """Render turns in order, batching the flow over buckets of similar token length."""
+        start_time = time.time()
+        wavs = [None] * len(jobs)
+        lengths = [len(job[0]) + len(job[1].prompt_token) for job in jobs]
+        for bucket in bucket_by_length(lengths, self.config.flow_batch_size, self.config.flow_bucket_ratio):
+            for index, wav in zip(bucket, self._render_batch([jobs[index] for index in bucket], flow_options)):
+                wavs[index] = wav
+        return wavs, time.time() - start_time
+
+    def _render_turn_chunks(self, speech_tokens, speaker: FlowSpeaker, seed: int, flow_options: dict | None = None):
+        """
+        Flow + HiFi-GAN over a turn whose speech tokens are still being decoded.
+
+        Every `stream_chunk_tokens` tokens (plus the flow lookahead) the flow renders the new mel frames under
+        its chunk masks (`CausalMaskedDiffWithXvec.forward_stream`): the encoder state is carried over the
+        complete chunks of the prompt and of the turn, and the estimator only sees the prompt and the last
+        `config.stream_context_chunks` chunks of emitted frames, so every chunk costs the same however long
+        the turn. The noise is fixed for the whole turn and only the new mel frames are vocoded.
+        Yields (wav_chunk, num_tokens, is_last, acoustic_time).
+        """
+        device = self.device
+        generator = torch.Generator(device=device).manual_seed(seed)
+        hop_len, lookahead_len = self.config.stream_chunk_tokens, self.flow.pre_lookahead_len
+        token_mel_ratio = self.flow.token_mel_ratio
+        stream = self.flow.start_stream(speaker)
+        noise = torch.zeros(1, self.flow.output_size, 0, device=device)
+        hift_cache = None
+        tokens, token_offset = [], 0
+
+        def render(num_tokens, finalize):
+            nonlocal noise, hift_cache
+            start_time = time.time()
+            mel_len = (len(speaker.prompt_token) + num_tokens - (0 if finalize else lookahead_len)) * token_mel_ratio
+            if noise.shape[2] < mel_len:
+                noise = torch.cat([noise, torch.randn((1, noise.shape[1], mel_len - noise.shape[2]),
+                                                      generator=generator, device=device)], dim=2)
+            with self._flow_autocast():
+                mel = self.flow.forward_stream(
+                    stream, tokens[:num_tokens], finalize, noise, self.config.stream_context_chunks,
+                    **(flow_options or {}),
+                )
+
+            if hift_cache is not None:
+                mel = torch.cat([hift_cache['mel'], mel], dim=2)
+                wav, source = self.hift(speech_feat=mel, cache_source=hift_cache['source'], generator=generator)
+                wav = fade_in_out(wav, hift_cache['speech'], self.speech_window)
+            else:
+                wav, source = self.hift(speech_feat=mel, generator=generator)
+            if not finalize:
+                hift_cache = {
+                    'mel': mel[:, :, -self.mel_cache_len:],
+                    'source': source[:, :, -self.source_cache_len:],
+                    'speech': wav[:, -self.source_cache_len:],
+                }
+                wav = wav[:, :-self.source_cache_len]
+            return wav, time.time() - start_time
+
+        for token in speech_tokens:
+            if token == self.config.hf_config.eos_token_id:
+                break
+            tokens.append(token - self.config.hf_config.speech_token_offset)
+            if len(tokens) - token_offset >= hop_len + lookahead_len:
+                wav, acoustic_time = render(token_offset + hop_len + lookahead_len, finalize=False)
+                yield wav, hop_len, False, acoustic_time
+                token_offset += hop_len
+
+        if len(tokens) > token_offset or hift_cache is not None:
+            wav, acoustic_time = render(len(tokens), finalize=True)
+        else:
+            wav, acoustic_time = torch.zeros(1, 0, device=device), 0.0
+        yield wav, len(tokens) - token_offset, True, acoustic_time
+
+    def _dialect_prompt(self, audio_key: str, prompt_input: list[int],
+                        sampling_params: SamplingParams | list[SamplingParams], seed: int) -> list[int]:
+        """
+        Speech tokens of a dialect chain-of-thought prompt, memoised in `dialect_cache`.
+
+        The generation draws from its own `seed`, under a forked torch RNG with the hf engine and through the
+        sampling params with vLLM, so a cache hit leaves the random state of the following turns exactly as
+        a miss does.
+        """
+        key = dialect_prompt_key(self.model_id, self.config.llm_engine, audio_key, prompt_input, sampling_params, seed)
+        token_ids = self.dialect_cache.get(key)
+        if token_ids is not None:
+            return list(token_ids)
+        sampling_param = sampling_params[0] if isinstance(sampling_params, (list, tuple)) else sampling_params
+        # the hf engine samples from the torch RNG, vLLM from its own generator seeded per request
+        sampling_param = replace(sampling_param, seed=seed, stop_token_ids=list(sampling_param.stop_token_ids))
+        with torch.random.fork_rng(devices=[self.device] if self.device.type == "cuda" else []):
+            torch.manual_seed(seed)
+            token_ids = self.llm.generate(prompt_input, sampling_param, past_key_values=None)['token_ids']
+        self.dialect_cache.put(key, token_ids)
+        return list(token_ids)
+
+    def _generate_to_streamer(self, outputs: dict, streamer: SpeechTokenStreamer, *args, **kwargs):
+        """LLM turn run on a background thread, the tokens reach the caller through `streamer`."""
+        try:
+            outputs.update(self.llm.generate(*args, streamer=streamer, **kwargs))
+        except BaseException as e:
+            streamer.error(e)
+
+    def forward_longform(self, **kwargs):
+        """Synthesize the whole dialogue, see `forward_longform_stream` for the arguments."""
+        generated_wavs = [record['wav'] for record in self.forward_longform_stream(**kwargs)]
+        return {'generated_wavs': generated_wavs}
+
+    def _prepare_dialogue(
         self, prompt_mels_for_llm,
         prompt_mels_lens_for_llm: torch.Tensor,
         prompt_text_tokens_for_llm: list[list[int]],
-        text_tokens_for_llm: list[list[int]],
-        prompt_mels_for_flow_ori, 
+        prompt_mels_for_flow_ori,
         spk_emb_for_flow: torch.Tensor,
         sampling_params: SamplingParams | list[SamplingParams],
-        spk_ids: list[list[int]],
+        base_seed: int,
         use_dialect_prompt: bool = False,
         dialect_prompt_text_tokens_for_llm: list[list[int]] = None,
         dialect_prefix: list[list[int]] = None,
-        **kwargs,  # for compatibility
+        prompt_speech_tokens: list[list[int] | None] | None = None,
+        **kwargs,  # the turns of the dialogue
     ):
+        """Flow speakers and LLM prompt inputs of a dialogue, returns (speakers, prompt_inputs, history_inputs)."""
+        prompt_size = len(prompt_mels_for_llm)
 
-        prompt_size, turn_size = len(prompt_mels_for_llm), len(text_tokens_for_llm)
+        # Speaker flow conditioning, cached across turns and requests by prompt audio
+        speaker_keys = [
+            prompt_audio_key(prompt_mels_for_llm[i, :, :int(prompt_mels_lens_for_llm[i])], prompt_mels_for_flow_ori[i], spk_emb_for_flow[i])
+            for i in range(prompt_size)
+        ]
+        speakers = [self.speaker_cache.get(key) for key in speaker_keys]
+        if any(speaker is None for speaker in speakers):
+            # Audio tokenization of the prompts without known speech tokens
+            prompt_speech_tokens = list(prompt_speech_tokens) if prompt_speech_tokens is not None else [None] * prompt_size
+            untokenized = [i for i in range(prompt_size) if speakers[i] is None and prompt_speech_tokens[i] is None]
+            if untokenized:
+                tokens = self.tokenize_prompts([prompt_mels_for_llm[i, :, :int(prompt_mels_lens_for_llm[i])] for i in untokenized])
+                for i, prompt_speech_token in zip(untokenized, tokens):
+                    prompt_speech_tokens[i] = prompt_speech_token
 
-        # Audio tokenization
-        prompt_speech_tokens_ori, prompt_speech_tokens_lens_ori = self.audio_tokenizer.quantize(
-            prompt_mels_for_llm.cuda(), prompt_mels_lens_for_llm.cuda()
-        )
-
-        # align speech token with speech feat as to reduce
-        #    the noise ratio during the generation process.
-        prompt_speech_tokens = []
-        prompt_mels_for_flow, prompt_mels_lens_for_flow = [], []
-
-        for prompt_index in range(prompt_size):
-            prompt_speech_token_len = prompt_speech_tokens_lens_ori[prompt_index].item()
-            prompt_speech_token = prompt_speech_tokens_ori[prompt_index, :prompt_speech_token_len]
-            prompt_mel = prompt_mels_for_flow_ori[prompt_index]
-            prompt_mel_len = prompt_mel.shape[0]
-            if prompt_speech_token_len * 2 > prompt_mel_len:
-                prompt_speech_token = prompt_speech_token[:int(prompt_mel_len/2)]
-                prompt_mel_len = torch.tensor([prompt_mel_len]).cuda()
-            else:
-                prompt_mel = prompt_mel.detach().clone()[:prompt_speech_token_len * 2].cuda()
-                prompt_mel_len = torch.tensor([prompt_speech_token_len * 2]).cuda()
-            prompt_speech_tokens.append(prompt_speech_token)
-            prompt_mels_for_flow.append(prompt_mel)
-            prompt_mels_lens_for_flow.append(prompt_mel_len)
+            # align speech token with speech feat as to reduce
+            #    the noise ratio during the generation process.
+            for prompt_index in range(prompt_size):
+                if speakers[prompt_index] is not None:
+                    continue
+                prompt_speech_token = torch.tensor(prompt_speech_tokens[prompt_index], dtype=torch.long)
+                prompt_speech_token_len = prompt_speech_token.shape[0]
+                prompt_mel = prompt_mels_for_flow_ori[prompt_index]
+                if prompt_speech_token_len * 2 > prompt_mel.shape[0]:
+                    prompt_speech_token = prompt_speech_token[:int(prompt_mel.shape[0]/2)]
+                else:
+                    prompt_mel = prompt_mel.detach().clone()[:prompt_speech_token_len * 2]
+                with self._flow_autocast():
+                    speakers[prompt_index] = self.flow.prepare_speaker(
+                        prompt_speech_token.tolist(), prompt_mel.to(self.device),
+                        spk_emb_for_flow[prompt_index:prompt_index+1].to(self.device),
+                    )
+                self.speaker_cache.put(speaker_keys[prompt_index], speakers[prompt_index])
 
         # Prepare LLM inputs
         prompt_inputs = []
         history_inputs = []
         
         for i in range(prompt_size):
-            speech_tokens_i = [token+self.config.hf_config.speech_token_offset for token in prompt_speech_tokens[i].tolist()]
+            speech_tokens_i = [token+self.config.hf_config.speech_token_offset for token in speakers[i].prompt_token]
             speech_tokens_i += [self.config.hf_config.eos_token_id]
             if use_dialect_prompt and len(dialect_prompt_text_tokens_for_llm[i])>0:
                 dialect_prompt_input = prompt_text_tokens_for_llm[i] + speech_tokens_i + dialect_prompt_text_tokens_for_llm[i]
                 if i>0:
                     dialect_prompt_input = dialect_prefix[0] + dialect_prompt_input
-                prompt_input = self.llm.generate(dialect_prompt_input, sampling_params, past_key_values=None)['token_ids']
+                prompt_input = self._dialect_prompt(speaker_keys[i], dialect_prompt_input, sampling_params, base_seed + i)
                 prompt_inputs.append(dialect_prefix[i+1]+dialect_prompt_text_tokens_for_llm[i] + prompt_input)
                 history_inputs.append(dialect_prefix[i+1]+dialect_prompt_text_tokens_for_llm[i] + prompt_input)
             else:
                 prompt_inputs.append(prompt_text_tokens_for_llm[i] + speech_tokens_i )
                 history_inputs.append(prompt_text_tokens_for_llm[i] + speech_tokens_i )
 
-        generated_wavs, results_dict = [], {}
-        
-        # LLM generation
-        inputs = list(chain.from_iterable(prompt_inputs))
-        cache_config = AutoPretrainedConfig().from_dataclass(self.llm.config.hf_config)
-        past_key_values = DynamicCache(config=cache_config)
-        valid_turn_size = prompt_size
-        for i in range(turn_size):
-
-            # # set ratio: reach the reset cache ratio;
-            if valid_turn_size > self.config.max_turn_size or len(inputs)>self.config.turn_tokens_threshold:
-                assert self.config.max_turn_size >= self.config.prompt_context + self.config.history_context, "Invalid Long history size setting, "
-                prompt_text_bound = max(self.config.prompt_context, len(history_inputs)-self.config.history_text_context-self.config.history_context)
-                inputs = list(chain.from_iterable(
-                    history_inputs[:self.config.prompt_context]+ \
-                    history_inputs[prompt_text_bound:-self.config.history_context]+ \
-                    prompt_inputs[-self.config.history_context:]
-                ))
-                valid_turn_size = self.config.prompt_context + len(history_inputs) - prompt_text_bound
-                past_key_values = DynamicCache(config=cache_config)
-            valid_turn_size += 1
-            
-            inputs.extend(text_tokens_for_llm[i])
-            start_time = time.time()
-            llm_outputs = self.llm.generate(inputs, sampling_params, past_key_values=past_key_values)
-
-            inputs.extend(llm_outputs['token_ids'])
-            prompt_inputs.append(text_tokens_for_llm[i]+llm_outputs['token_ids'])
-            history_inputs.append(text_tokens_for_llm[i][:-1]) # remove the <|audio_start|>
-            
-            # Prepare Flow inputs
-            turn_spk = spk_ids[i]
-            generated_speech_tokens = [token - self.config.hf_config.speech_token_offset for token in  llm_outputs['token_ids'][:-1]]  # ignore last eos
-            prompt_speech_token = prompt_speech_tokens[turn_spk].tolist()
-            flow_input = torch.tensor([prompt_speech_token + generated_speech_tokens])
-            flow_inputs_len = torch.tensor([len(prompt_speech_token) + len(generated_speech_tokens)])
-
-            # Flow generation and HiFi-GAN generation            
-            start_idx = spk_ids[i]
-            prompt_mels = prompt_mels_for_flow[start_idx][None]
-            prompt_mels_lens = prompt_mels_lens_for_flow[start_idx][None]
-            spk_emb = spk_emb_for_flow[start_idx:start_idx+1]
-
-            # Flow generation
-            with torch.amp.autocast("cuda", dtype=torch.float16 if self.config.hf_config.fp16_flow else torch.float32):
-                generated_mels, generated_mels_lens = self.flow(
-                    flow_input.cuda(), flow_inputs_len.cuda(),
-                    prompt_mels, prompt_mels_lens, spk_emb.cuda(),
-                    streaming=False, finalize=True
-                )
+        return speakers, prompt_inputs, history_inputs
+
+    @torch.inference_mode()
+    def forward_longform_stream(
+        self, prompt_mels_for_llm,
+        prompt_mels_lens_for_llm: torch.Tensor,
+        prompt_text_tokens_for_llm: list[list[int]],
+        text_tokens_for_llm: list[list[int]],
+        prompt_mels_for_flow_ori, 
+        spk_emb_for_flow: torch.Tensor,
+        sampling_params: SamplingParams | list[SamplingParams],
+        spk_ids: list[list[int]],
+        use_dialect_prompt: bool = False,
+        dialect_prompt_text_tokens_for_llm: list[list[int]] = None,
+        dialect_prefix: list[list[int]] = None,
+        chunk_streaming: bool = False,
+        prompt_speech_tokens: list[list[int] | None] | None = None,
+        **kwargs,  # for compatibility
+    ):
+        """
+        Synthesize the dialogue turn by turn.
+
+        Yields one record per turn, in turn order, as soon as its waveform is ready:
+            wav: [1, num_samples] waveform at 24kHz
+            spk_id: speaker index of the turn
+            turn_index: index of the turn in `text_tokens_for_llm`
+            num_tokens: number of generated speech tokens
+            timings: seconds spent in the LLM for this turn (`llm`), in the flow + HiFi-GAN call that
+                rendered it (`acoustic`, shared by the turns of a batch) and since the call started (`elapsed`)
+
+        With `chunk_streaming`, the LLM decodes on a background thread and a record is yielded every
+        `config.stream_chunk_tokens` speech tokens instead, with the extra keys `chunk_index` and
+        `is_last_chunk`; `num_tokens` counts the tokens of the chunk and `llm` is only set on the last one.
+        Acoustic pipelining and flow batching do not apply in this mode.
+
+        `prompt_speech_tokens` holds the speech tokens of the prompts already known, e.g. from the prompt
+        feature store, the others are quantized from `prompt_mels_for_llm`.
+        """
+        request_start_time = time.time()
+        prompt_size, turn_size = len(prompt_mels_for_llm), len(text_tokens_for_llm)
+
+        # seed every turn on its own so that sequential and pipelined runs render the same audio
+        base_seed = torch.initial_seed()
+        speakers, prompt_inputs, history_inputs = self._prepare_dialogue(
+            prompt_mels_for_llm, prompt_mels_lens_for_llm, prompt_text_tokens_for_llm,
+            prompt_mels_for_flow_ori, spk_emb_for_flow, sampling_params, base_seed,
+            use_dialect_prompt=use_dialect_prompt,
+            dialect_prompt_text_tokens_for_llm=dialect_prompt_text_tokens_for_llm,
+            dialect_prefix=dialect_prefix,
+            prompt_speech_tokens=prompt_speech_tokens,
+        )
+
+        flow_options = self._flow_options(sampling_params)
+        pipeline = None
+        if self.config.pipeline_acoustic:
+            pipeline = AcousticPipeline(self._render_turns, self.device,
+                                        max_pending=self.config.pipeline_queue_size)
+        # offline rendering buckets all turns at the end, the pipeline renders as soon as a batch is full
+        render_window = self.config.flow_batch_size if pipeline is not None or self.config.flow_batch_size <= 1 else turn_size
+        pending_jobs = []
+        # per-turn info of the turns waiting for their waveform, in turn order
+        pending_records = deque()
+        completed = False
+
+        def finish_turns(wavs, acoustic_time):
+            for wav in wavs:
+                record = pending_records.popleft()
+                record['wav'] = wav
+                record['timings']['acoustic'] = acoustic_time
+                record['timings']['elapsed'] = time.time() - request_start_time
+                yield record
+
+        try:
+            # LLM generation
+            inputs = list(chain.from_iterable(prompt_inputs))
+            cache_config = AutoPretrainedConfig().from_dataclass(self.llm.config.hf_config)
+            past_key_values = DynamicCache(config=cache_config)
+            # the speaker prompt block heads every fresh cache, share its KV across requests;
+            cache_prefix_len = len(inputs)
+            valid_turn_size = prompt_size
+            for i in range(turn_size):
+
+                # # set ratio: reach the reset cache ratio;
+                if valid_turn_size > self.config.max_turn_size or len(inputs)>self.config.turn_tokens_threshold:
+                    assert self.config.max_turn_size >= self.config.prompt_context + self.config.history_context, "Invalid Long history size setting, "
+                    prompt_len = sum(len(x) for x in history_inputs[:self.config.prompt_context])
+                    # the cache holds every input token but the last sampled eos;
+                    if self.config.kv_surgery and past_key_values.get_seq_length() == len(inputs) - 1:
+                        # keep the speaker prompts and the most recent turns, cut the middle turns out of the cache;
+                        recent_start = max(prompt_len, len(inputs) - sum(len(x) for x in prompt_inputs[-self.config.history_context:]))
+                        self.llm.evict_kv(past_key_values, prompt_len, recent_start)
+                        inputs = inputs[:prompt_len] + inputs[recent_start:]
+                        valid_turn_size = self.config.prompt_context + self.config.history_context
+                    else:
+                        prompt_text_bound = max(self.config.prompt_context, len(history_inputs)-self.config.history_text_context-self.config.history_context)
+                        inputs = list(chain.from_iterable(
+                            history_inputs[:self.config.prompt_context]+ \
+                            history_inputs[prompt_text_bound:-self.config.history_context]+ \
+                            prompt_inputs[-self.config.history_context:]
+                        ))
+                        valid_turn_size = self.config.prompt_context + len(history_inputs) - prompt_text_bound
+                        past_key_values = DynamicCache(config=cache_config)
+                        cache_prefix_len = prompt_len
+                valid_turn_size += 1
+
+                inputs.extend(text_tokens_for_llm[i])
+                turn_spk = spk_ids[i]
+                start_time = time.time()
+                if chunk_streaming:
+                    llm_outputs, streamer = {}, SpeechTokenStreamer()
+                    llm_thread = threading.Thread(
+                        target=self._generate_to_streamer,
+                        args=(llm_outputs, streamer, inputs, sampling_params),
+                        kwargs=dict(past_key_values=past_key_values, cache_prefix_len=cache_prefix_len),
+                        daemon=True,
+                    )
+                    llm_thread.start()
+                    chunks = self._render_turn_chunks(streamer, speakers[turn_spk], base_seed + i, flow_options)
+                    try:
+                        for chunk_index, (wav, num_tokens, is_last, acoustic_time) in enumerate(chunks):
+                            timings = {'acoustic': acoustic_time, 'elapsed': time.time() - request_start_time}
+                            if is_last:
+                                llm_thread.join()
+                                timings['llm'] = time.time() - start_time
+                            yield {
+                                'wav': wav,
+                                'spk_id': turn_spk,
+                                'turn_index': i,
+                                'chunk_index': chunk_index,
+                                'is_last_chunk': is_last,
+                                'num_tokens': num_tokens,
+                                'timings': timings,
+                            }
+                    finally:
+                        # a consumer that stops mid-turn (closed generator, error) must not leave the
+                        #    LLM thread decoding into the shared cache while the next request starts;
+                        if llm_thread.is_alive():
+                            streamer.stop()
+                            llm_thread.join()
+                else:
+                    llm_outputs = self.llm.generate(inputs, sampling_params, past_key_values=past_key_values,
+                                                    cache_prefix_len=cache_prefix_len)
+                cache_prefix_len = 0
+
+                inputs.extend(llm_outputs['token_ids'])
+                prompt_inputs.append(text_tokens_for_llm[i]+llm_outputs['token_ids'])
+                history_inputs.append(text_tokens_for_llm[i][:-1]) # remove the <|audio_start|>
+
+                if chunk_streaming:
+                    continue
+
+                # Prepare Flow inputs
+                generated_speech_tokens = [token - self.config.hf_config.speech_token_offset for token in  llm_outputs['token_ids'][:-1]]  # ignore last eos
+                pending_records.append({
+                    'spk_id': turn_spk,
+                    'turn_index': i,
+                    'num_tokens': len(generated_speech_tokens),
+                    'timings': {'llm': time.time() - start_time},
+                })
+                pending_jobs.append((generated_speech_tokens, speakers[turn_spk], base_seed + i))
+                if len(pending_jobs) < render_window and i < turn_size - 1:
+                    continue
+
+                # Flow generation and HiFi-GAN generation
+                if pipeline is not None:
+                    pipeline.submit(pending_jobs, flow_options)
+                    for wavs, acoustic_time in pipeline.poll():
+                        yield from finish_turns(wavs, acoustic_time)
+                else:
+                    yield from finish_turns(*self._render_turns(pending_jobs, flow_options))
+                pending_jobs = []
+
+            if pipeline is not None:
+                for wavs, acoustic_time in pipeline.drain():
+                    yield from finish_turns(wavs, acoustic_time)
+            completed = True
+        finally:
+            if pipeline is not None:
+                # a closed generator or a failure drops the queued turns instead of rendering them for nothing
+                pipeline.close(cancel=not completed)
+
+    @torch.inference_mode()
+    def forward_longform_batch(self, dialogues: list[dict]) -> list[dict]:
+        """
+        Synthesize several independent dialogues, decoding their turns together.
+
+        Every dialogue takes the arguments of `forward_longform_stream` but `chunk_streaming`, with the same
+        sampling params for all, since they share the LLM batches. Turn i of every dialogue that has one goes through
+        the same `generate_batch` call, each dialogue carrying its own KV cache from turn to turn; a
+        dialogue past the history limits is cut down as without KV surgery and prefilled again. The turns
+        of all dialogues are rendered together at the end.
+
+        Returns:
+            one {'generated_wavs': [...]} per dialogue, like `forward_longform`.
+        """
+        base_seed = torch.initial_seed()
+        sampling_params = dialogues[0]['sampling_params']
+        if any(dialogue['sampling_params'] != sampling_params for dialogue in dialogues[1:]):
+            raise ValueError("forward_longform_batch decodes all dialogues with the same sampling params")
+        states = []
+        for dialogue in dialogues:
+            speakers, prompt_inputs, history_inputs = self._prepare_dialogue(base_seed=base_seed, **dialogue)
+            states.append({
+                'speakers': speakers,
+                'prompt_inputs': prompt_inputs,
+                'history_inputs': history_inputs,
+                'inputs': list(chain.from_iterable(prompt_inputs)),
+                'kv': None,  # holds every input token but the last sampled eos
+                'valid_turn_size': len(prompt_inputs),
+                'jobs': [],
+            })
+
+        for i in range(max(len(dialogue['text_tokens_for_llm']) for dialogue in dialogues)):
+            active = [d for d, dialogue in enumerate(dialogues) if i < len(dialogue['text_tokens_for_llm'])]
+            for d in active:
+                state = states[d]
+                # # set ratio: reach the reset cache ratio;
+                if state['valid_turn_size'] > self.config.max_turn_size or len(state['inputs']) > self.config.turn_tokens_threshold:
+                    assert self.config.max_turn_size >= self.config.prompt_context + self.config.history_context, "Invalid Long history size setting, "
+                    history_inputs, prompt_inputs = state['history_inputs'], state['prompt_inputs']
+                    prompt_text_bound = max(self.config.prompt_context, len(history_inputs)-self.config.history_text_context-self.config.history_context)
+                    state['inputs'] = list(chain.from_iterable(
+                        history_inputs[:self.config.prompt_context]+ \
+                        history_inputs[prompt_text_bound:-self.config.history_context]+ \
+                        prompt_inputs[-self.config.history_context:]
+                    ))
+                    state['valid_turn_size'] = self.config.prompt_context + len(history_inputs) - prompt_text_bound
+                    state['kv'] = None
+                state['valid_turn_size'] += 1
+                state['inputs'].extend(dialogues[d]['text_tokens_for_llm'][i])
+
+            llm_outputs = self.llm.generate_batch(
+                [states[d]['inputs'] for d in active], sampling_params,
+                kv_caches=[states[d]['kv'] for d in active],
+            )
 
-            # HiFi-GAN generation
-            mel = generated_mels[:, :, prompt_mels_lens[0].item():generated_mels_lens[0].item()]
-            wav, _ = self.hift(speech_feat=mel)
-            generated_wavs.append(wav)
+            for d, llm_output in zip(active, llm_outputs):
+                state, text_tokens = states[d], dialogues[d]['text_tokens_for_llm'][i]
+                state['kv'] = llm_output.get('kv')
+                state['inputs'].extend(llm_output['token_ids'])
+                state['prompt_inputs'].append(text_tokens+llm_output['token_ids'])
+                state['history_inputs'].append(text_tokens[:-1]) # remove the <|audio_start|>
+                generated_speech_tokens = [token - self.config.hf_config.speech_token_offset for token in llm_output['token_ids'][:-1]]  # ignore last eos
+                turn_spk = dialogues[d]['spk_ids'][i]
+                state['jobs'].append((generated_speech_tokens, state['speakers'][turn_spk], base_seed + i))
 
-        # Save the generated wav;
-        results_dict['generated_wavs'] = generated_wavs
-        return results_dict
\ No newline at end of file
+        # Flow generation and HiFi-GAN generation, bucketed across the dialogues
+        wavs, _ = self._render_turns([job for state in states for job in state['jobs']], self._flow_options(sampling_params))
+        results, start = [], 0
+        for state in states:
+            results.append({'generated_wavs': wavs[start:start + len(state['jobs'])]})
+            start += len(state['jobs'])
+        return results
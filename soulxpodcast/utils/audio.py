@@ -42,17 +42,19 @@ hann_window = {}
 
 
 def mel_spectrogram(y, n_fft=1920, num_mels=80, sampling_rate=24000, hop_size=480,
-                    win_size=1920, fmin=0, fmax=8000, center=False):
+                    win_size=1920, fmin=0, fmax=8000, center=False, pad=True):
+    """`pad=False` takes `y` already reflect padded by (n_fft - hop_size) / 2 on both sides, e.g. the rows of a batch of different lengths."""
     global mel_basis, hann_window  # pylint: disable=global-statement
     if f"{str(fmax)}_{str(y.device)}" not in mel_basis:
         mel = librosa_mel_fn(sr=sampling_rate, n_fft=n_fft, n_mels=num_mels, fmin=fmin, fmax=fmax)
         mel_basis[str(fmax) + "_" + str(y.device)] = torch.from_numpy(mel).float().to(y.device)
         hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
 
-    y = torch.nn.functional.pad(
-        y.unsqueeze(1), (int((n_fft - hop_size) / 2), int((n_fft - hop_size) / 2)), mode="reflect"
-    )
-    y = y.squeeze(1)
+    if pad:
+        y = torch.nn.functional.pad(
+            y.unsqueeze(1), (int((n_fft - hop_size) / 2), int((n_fft - hop_size) / 2)), mode="reflect"
+        )
+        y = y.squeeze(1)
 
     spec = torch.view_as_real(
         torch.stft(
@@ -88,15 +90,15 @@ def audio_volume_normalize(audio: torch.Tensor, coeff=0.1):
     Returns:
         torch tensor: The volume-normalized audio signal.
     """
-    # Sort the absolute values of the audio signal
     device = audio.device
     audio = audio.cpu().numpy()
-    temp = np.sort(np.abs(audio))
+    temp = np.abs(audio)
 
     # If the maximum value is less than 0.1, scale the array to have a maximum of 0.1
-    if temp[-1] < 0.1:
+    peak = temp.max()
+    if peak < 0.1:
         scaling_factor = max(
-            temp[-1], 1e-3
+            peak, 1e-3
         )  # Prevent division by zero with a small constant
         audio = audio / scaling_factor * 0.1
 
@@ -106,10 +108,13 @@ def audio_volume_normalize(audio: torch.Tensor, coeff=0.1):
 
     # If there are fewer than or equal to 10 significant values, return the audio without further processing
     if L <= 10:
-        return audio
+        return torch.from_numpy(audio).to(device)
 
-    # Compute the average of the top 10% to 1% of values in temp
-    volume = np.mean(temp[int(0.9 * L) : int(0.99 * L)])
+    # Compute the average of the top 10% to 1% of values in temp, a partition around both ranks
+    # gathers the same values as a full sort in linear time
+    low, high = int(0.9 * L), int(0.99 * L)
+    temp = np.partition(temp, (low, high - 1))
+    volume = np.mean(temp[low:high])
 
     # Normalize the audio to the target coefficient level, clamping the scale factor between 0.1 and 10
     audio = audio * np.clip(coeff / volume, a_min=0.1, a_max=10)
@@ -120,4 +125,13 @@ def audio_volume_normalize(audio: torch.Tensor, coeff=0.1):
         audio = audio / max_value
 
     audio = torch.from_numpy(audio).to(device)
-    return audio
\ No newline at end of file
+    return audio
+
+def fade_in_out(fade_in_wav: torch.Tensor, fade_out_wav: torch.Tensor, window: torch.Tensor) -> torch.Tensor:
+    """Cross-fade the head of `fade_in_wav` with the tail of `fade_out_wav`, `window` spans twice the overlap."""
+    overlap_len = window.shape[0] // 2
+    window = window.to(fade_in_wav)
+    fade_in_wav = fade_in_wav.clone()
+    fade_in_wav[..., :overlap_len] = fade_in_wav[..., :overlap_len] * window[:overlap_len] + \
+        fade_out_wav[..., -overlap_len:] * window[overlap_len:]
+    return fade_in_wav
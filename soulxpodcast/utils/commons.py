@@ -7,4 +7,23 @@ def set_all_random_seed(seed):
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
\ No newline at end of file
+    torch.cuda.manual_seed_all(seed)
+
+
+def bucket_by_length(lengths: list[int], max_batch_size: int, max_ratio: float = 1.25) -> list[list[int]]:
+    """
+    Group item indices into batches of similar length to limit padding.
+
+    Items are visited from shortest to longest, a bucket is closed once it holds
+    `max_batch_size` items or the next item is longer than `max_ratio` times its
+    shortest one.
+    """
+    buckets, bucket = [], []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if bucket and (len(bucket) >= max_batch_size or lengths[index] > max_ratio * max(lengths[bucket[0]], 1)):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(index)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
@@ -3,16 +3,13 @@ import json
 from tqdm import tqdm
 from datetime import datetime
 
-import onnxruntime
 import torch
-import torchaudio
 from torch.utils.data import DataLoader, Dataset, DistributedSampler
-import torchaudio.compliance.kaldi as kaldi
-
-import s3tokenizer
 
 from soulxpodcast.utils.text import normalize_text
-from soulxpodcast.utils.audio import mel_spectrogram, audio_volume_normalize
+from soulxpodcast.utils.feature_store import PromptFeatureStore, prompt_file_key
+from soulxpodcast.utils.frontend import AudioFrontend, PromptFeatures
+from soulxpodcast.utils.speaker_embedding import SpeakerEmbedder
 from soulxpodcast.config import Config, SamplingParams
 
 
@@ -23,7 +20,7 @@ TASK_PODCAST = "<|task_podcast|>"
 
 class PodcastDataset(Dataset):
 
-    def __init__(self, text_tokenizer, data_list, model_config: Config):
+    def __init__(self, text_tokenizer, data_list, model_config: Config, speech_tokenizer=None):
         self.datas = []
         self.model_config = model_config
 
@@ -70,17 +67,61 @@ class PodcastDataset(Dataset):
 
         self.text_tokenizer = text_tokenizer
 
-        option = onnxruntime.SessionOptions()
-        option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
-        option.intra_op_num_threads = 1
-        self.spk_model = onnxruntime.InferenceSession(f"{self.model_config.model}/campplus.onnx", sess_options=option,
-                                                      providers=["CPUExecutionProvider"])
+        self.spk_model = SpeakerEmbedder(f"{self.model_config.model}/campplus.onnx",
+                                         num_sessions=self.model_config.campplus_sessions,
+                                         num_threads=self.model_config.campplus_threads)
+        self.frontend = AudioFrontend(self.spk_model)
+        # prompt features of repeated voices, and their speech tokens through `speech_tokenizer`
+        #    (list of log-mels -> list of token lists, e.g. `SoulXPodcast.tokenize_prompts`)
+        self.feature_store = PromptFeatureStore(self.model_config.feature_store_dir, self.model_config.feature_store_size)
+        self.speech_tokenizer = speech_tokenizer
 
     def __len__(self):
         return len(self.datas)
 
+    def prompt_features(self, prompt_wavs: list[str]) -> list[PromptFeatures]:
+        """
+        Features of the prompt audios. Those found in the feature store skip all audio work, the others go
+        through the frontend as one batch and, with a `speech_tokenizer`, get their speech tokens before being stored.
+        """
+        if not self.feature_store.enabled:
+            return self.frontend(prompt_wavs)
+        keys = [prompt_file_key(prompt_wav) for prompt_wav in prompt_wavs]
+        features = [self.feature_store.get(key) for key in keys]
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if missing:
+            for i, feature in zip(missing, self.frontend([prompt_wavs[i] for i in missing])):
+                features[i] = feature
+        untokenized = []
+        if self.speech_tokenizer is not None:
+            untokenized = [i for i, feature in enumerate(features) if feature.speech_tokens is None]
+            if untokenized:
+                for i, tokens in zip(untokenized, self.speech_tokenizer([features[i].log_mel for i in untokenized])):
+                    features[i].speech_tokens = tokens
+        for i in sorted(set(missing) | set(untokenized)):
+            self.feature_store.put(keys[i], features[i])
+        return features
+
+    def encode_prompt_text(self, prompt_text: str) -> list[int]:
+        """Token ids of a normalised prompt text, without the speaker and segment tokens around it."""
+        return self.text_tokenizer.encode(normalize_text(prompt_text)) # remove some space and strange character
+
+    def prompt_text_ids(self, text_ids: list[int], spk_idx: int) -> list[int]:
+        """LLM prompt of a speaker around the `encode_prompt_text` ids of its prompt text."""
+        prefix = f"{SPK_DICT[spk_idx]}{TEXT_START}"
+        if spk_idx == 0:
+            prefix = f"{TASK_PODCAST}{prefix}"
+        # special tokens are split off before the text is tokenized, the parts encode as the whole
+        return self.text_tokenizer.encode(prefix) + text_ids + self.text_tokenizer.encode(f"{TEXT_END}{AUDIO_START}")
+
     def __getitem__(self, idx):
-        data = self.datas[idx]
+        return self.build_item(self.datas[idx])
+
+    def build_item(self, data: dict):
+        """
+        Model inputs of one data item, see the data list of `__init__`. It touches no dataset state, so
+        concurrent callers (e.g. API requests) can build their items without `update_datasource`.
+        """
         try:
             prompt_text_ids_list, dialect_prompt_text_ids_list, spk_emb_list, mel_list, mel_len_list, log_mel_list = (
                 [], [], [], [], [], []
@@ -89,38 +130,20 @@ class PodcastDataset(Dataset):
             use_dialect_prompt = "dialect_prompt_text" in data
             dialect_prefix_list = []
             dialect_prefix_list.append(self.text_tokenizer.encode(f"{TASK_PODCAST}"))
-            for spk_idx, (prompt_text, prompt_wav) in enumerate(zip(data["prompt_text"], data["prompt_wav"])):
-                # 1. feature for s3tokenizer
-                audio = s3tokenizer.load_audio(prompt_wav, sr=16000)  
-                audio = audio_volume_normalize(audio)
-                # [T]
-                log_mel = s3tokenizer.log_mel_spectrogram(audio)  # [num_mels, T]
-
-                # 2. feature for speaker embedding
-                spk_feat = kaldi.fbank(audio.unsqueeze(0), num_mel_bins=80, dither=0, sample_frequency=16000)
-                spk_feat = spk_feat - spk_feat.mean(dim=0, keepdim=True)
-                spk_emb = self.spk_model.run(
-                    None, {self.spk_model.get_inputs()[0].name: spk_feat.unsqueeze(dim=0).cpu().numpy()}
-                )[0].flatten().tolist()
-
-                # 3. feature for flow
-                audio, sample_rate = torchaudio.load(prompt_wav, backend='soundfile')
-                audio = audio[0]
-                audio = audio_volume_normalize(audio).unsqueeze(0)
-                # audio = audio.mean(dim=0, keepdim=True)  # [1, T]
-                if sample_rate != 24000:
-                    audio = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=24000)(audio)
-                mel = mel_spectrogram(audio).transpose(1, 2).squeeze(0)  # [T, num_mels]
-                if mel.shape[0] %2 !=0:
-                    mel = mel[:-1]
+            # 1. - 3. features for s3tokenizer, speaker embedding and flow, every prompt decoded once or found in the store,
+            #    or precomputed by the caller (e.g. registered speakers)
+            prompt_features = data.get("prompt_features") or self.prompt_features(data["prompt_wav"])
+            # `encode_prompt_text` ids of the prompt texts already known, None for the others
+            known_text_ids = data.get("prompt_text_ids") or [None] * len(data["prompt_text"])
+            for spk_idx, (prompt_text, features) in enumerate(zip(data["prompt_text"], prompt_features)):
+                log_mel, spk_emb, mel = features.log_mel, features.spk_emb, features.mel
                 mel_len = mel.shape[0]
-                
+
                 # 4. feature for llm
-                prompt_text = normalize_text(prompt_text) # remove some space and strange character
-                prompt_text = f"{SPK_DICT[spk_idx]}{TEXT_START}{prompt_text}{TEXT_END}{AUDIO_START}"
-                if spk_idx == 0:
-                    prompt_text = f"{TASK_PODCAST}{prompt_text}"
-                prompt_text_ids = self.text_tokenizer.encode(prompt_text)
+                text_ids = known_text_ids[spk_idx]
+                if text_ids is None:
+                    text_ids = self.encode_prompt_text(prompt_text)
+                prompt_text_ids = self.prompt_text_ids(text_ids, spk_idx)
                 prompt_text_ids_list.append(prompt_text_ids)
                 if use_dialect_prompt:
                     dialect_prompt_text = normalize_text(data["dialect_prompt_text"][spk_idx])
@@ -137,6 +160,7 @@ class PodcastDataset(Dataset):
             item = {
                 "prompt_text_tokens": prompt_text_ids_list,
                 "spk_emb": spk_emb_list, "mel": mel_list, "mel_len": mel_len_list, "log_mel": log_mel_list, "info": data,
+                "prompt_speech_tokens": [features.speech_tokens for features in prompt_features],
             }
             if use_dialect_prompt:
                 item.update({
@@ -162,13 +186,13 @@ class PodcastDataset(Dataset):
             })
         except Exception as e:
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
-            tqdm.write(f"[{timestamp}] - [WARNING] - Error processing data item {data.get('key', idx)}: {e}")
+            tqdm.write(f"[{timestamp}] - [WARNING] - Error processing data item {data.get('key')}: {e}")
             return None
         return item
 
 class PodcastInferHandler(PodcastDataset):
 
-    def __init__(self, text_tokenizer, data_list, model_config: Config):
+    def __init__(self, text_tokenizer, data_list, model_config: Config, speech_tokenizer=None):
         self.datas = []
         self.model_config = model_config
 
@@ -188,11 +212,14 @@ class PodcastInferHandler(PodcastDataset):
         missing = 0
         self.text_tokenizer = text_tokenizer
 
-        option = onnxruntime.SessionOptions()
-        option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
-        option.intra_op_num_threads = 1
-        self.spk_model = onnxruntime.InferenceSession(f"{self.model_config.model}/campplus.onnx", sess_options=option,
-                                                    providers=["CPUExecutionProvider"])
+        self.spk_model = SpeakerEmbedder(f"{self.model_config.model}/campplus.onnx",
+                                         num_sessions=self.model_config.campplus_sessions,
+                                         num_threads=self.model_config.campplus_threads)
+        self.frontend = AudioFrontend(self.spk_model)
+        # prompt features of repeated voices, and their speech tokens through `speech_tokenizer`
+        #    (list of log-mels -> list of token lists, e.g. `SoulXPodcast.tokenize_prompts`)
+        self.feature_store = PromptFeatureStore(self.model_config.feature_store_dir, self.model_config.feature_store_size)
+        self.speech_tokenizer = speech_tokenizer
 
     def update_datasource(self, data_list):
         self.datas = data_list
\ No newline at end of file
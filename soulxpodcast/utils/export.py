@@ -0,0 +1,189 @@
+import os
+import shutil
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from soulxpodcast.engine.onnx_backend import (ONNX_DIR, ONNX_FILES,
+                                               create_session, run_session)
+from soulxpodcast.models.modules.flow import CausalMaskedDiffWithXvec
+from soulxpodcast.models.modules.hifigan import HiFTGenerator
+
+ACOUSTIC_ARTIFACT = "acoustic.safetensors"
+ACOUSTIC_FORMAT = "soulxpodcast-acoustic"
+ACOUSTIC_FORMAT_VERSION = "1"
+EXPORT_DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def load_checkpoints(model_path: str) -> tuple[CausalMaskedDiffWithXvec, HiFTGenerator]:
+    """Flow and HiFT from the training checkpoints `flow.pt` / `hift.pt`, weight norm folded."""
+    flow = CausalMaskedDiffWithXvec()
+    flow.load_state_dict(torch.load(f"{model_path}/flow.pt", map_location="cpu", weights_only=True), strict=True)
+    hift = HiFTGenerator()
+    hift_state_dict = {k.replace('generator.', ''): v for k, v in torch.load(f"{model_path}/hift.pt", map_location="cpu", weights_only=True).items()}
+    hift.load_state_dict(hift_state_dict, strict=True)
+    hift.remove_weight_norm()
+    return flow, hift
+
+
+def export_acoustic(model_path: str, output_path: str | None = None, dtype: str = "float32") -> str:
+    """
+    Write the inference artifact of the acoustic models: one safetensors file holding the flow
+    (`flow.` keys) and the HiFT with its weight norm folded (`hift.` keys), cast to `dtype`.
+
+    Returns:
+        path of the artifact, `<model_path>/acoustic.safetensors` by default.
+    """
+    assert dtype in EXPORT_DTYPES, f"Unsupported export dtype: {dtype}"
+    output_path = os.path.join(model_path, ACOUSTIC_ARTIFACT) if output_path is None else output_path
+    flow, hift = load_checkpoints(model_path)
+    tensors = {}
+    for prefix, module in (("flow.", flow), ("hift.", hift)):
+        for key, value in module.state_dict().items():
+            if value.is_floating_point():
+                value = value.to(EXPORT_DTYPES[dtype])
+            tensors[prefix + key] = value.contiguous()
+    save_file(tensors, output_path, metadata={
+        "format": ACOUSTIC_FORMAT, "version": ACOUSTIC_FORMAT_VERSION, "dtype": dtype,
+    })
+    return output_path
+
+
+def load_acoustic(path: str, flow: CausalMaskedDiffWithXvec, hift: HiFTGenerator, device: torch.device):
+    """
+    Load an `export_acoustic` artifact into freshly built `flow` and `hift`.
+
+    The file is memory mapped and its tensors become the module parameters (`assign=True`) instead of
+    being copied into the initial weights; the caller casts the modules to their runtime dtype.
+    """
+    flow_state_dict, hift_state_dict = {}, {}
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        metadata = f.metadata() or {}
+        assert metadata.get("format") == ACOUSTIC_FORMAT, f"{path} is not a SoulX-Podcast acoustic artifact"
+        assert metadata.get("version") == ACOUSTIC_FORMAT_VERSION, \
+            f"{path} has format version {metadata.get('version')}, expected {ACOUSTIC_FORMAT_VERSION}, export it again"
+        for key in f.keys():
+            if key.startswith("flow."):
+                flow_state_dict[key[len("flow."):]] = f.get_tensor(key)
+            elif key.startswith("hift."):
+                hift_state_dict[key[len("hift."):]] = f.get_tensor(key)
+    flow.load_state_dict(flow_state_dict, strict=True, assign=True)
+    hift.remove_weight_norm()
+    hift.load_state_dict(hift_state_dict, strict=True, assign=True)
+
+
+class _EstimatorGraph(torch.nn.Module):
+    def __init__(self, estimator: torch.nn.Module, streaming: bool):
+        super().__init__()
+        self.estimator = estimator
+        self.streaming = streaming
+
+    def forward(self, x, mask, mu, t, spks, cond):
+        return self.estimator(x, mask, mu, t, spks, cond, self.streaming)
+
+
+class _EncoderGraph(torch.nn.Module):
+    def __init__(self, encoder: torch.nn.Module):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, xs, xs_lens):
+        return self.encoder(xs, xs_lens)
+
+
+class _HiFTGraph(torch.nn.Module):
+    def __init__(self, hift: HiFTGenerator):
+        super().__init__()
+        self.hift = hift
+
+    def forward(self, x, s_stft):
+        return self.hift.decode_spec(x, s_stft)
+
+
+def _onnx_inputs(flow: CausalMaskedDiffWithXvec, hift: HiFTGenerator, num_tokens: int) -> dict:
+    """Example inputs of every graph for `num_tokens` speech tokens, the second row padded."""
+    mel_len = num_tokens * flow.token_mel_ratio
+    mask = torch.ones(2, 1, mel_len)
+    mask[1, :, mel_len * 3 // 4:] = 0
+    estimator = (torch.randn(2, flow.output_size, mel_len), mask, torch.randn(2, flow.output_size, mel_len),
+                 torch.rand(2), torch.randn(2, flow.output_size), torch.randn(2, flow.output_size, mel_len))
+    encoder = (torch.randn(2, num_tokens, flow.input_size), torch.tensor([num_tokens, num_tokens * 3 // 4]))
+    s_stft_real, s_stft_imag = hift._stft(torch.randn(1, mel_len * int(hift.f0_upsamp.scale_factor)))
+    vocoder = (torch.randn(1, flow.output_size, mel_len), torch.cat([s_stft_real, s_stft_imag], dim=1))
+    return {"estimator": estimator, "estimator_streaming": estimator, "encoder": encoder, "hift": vocoder}
+
+
+def _onnx_graphs(flow: CausalMaskedDiffWithXvec, hift: HiFTGenerator) -> dict:
+    """{part: (module, input names, output names, dynamic axes)} of the exported graphs."""
+    time_axes = {"x": {0: "batch", 2: "time"}, "mask": {0: "batch", 2: "time"}, "mu": {0: "batch", 2: "time"},
+                 "t": {0: "batch"}, "spks": {0: "batch"}, "cond": {0: "batch", 2: "time"}, "output": {0: "batch", 2: "time"}}
+    estimator_names = (["x", "mask", "mu", "t", "spks", "cond"], ["output"], time_axes)
+    return {
+        "estimator": (_EstimatorGraph(flow.decoder.estimator, False), *estimator_names),
+        "estimator_streaming": (_EstimatorGraph(flow.decoder.estimator, True), *estimator_names),
+        "encoder": (_EncoderGraph(flow.encoder), ["xs", "xs_lens"], ["h", "masks"],
+                    {"xs": {0: "batch", 1: "time"}, "xs_lens": {0: "batch"},
+                     "h": {0: "batch", 1: "mel_time"}, "masks": {0: "batch", 2: "mel_time"}}),
+        "hift": (_HiFTGraph(hift), ["mel", "s_stft"], ["spec"],
+                 {"mel": {0: "batch", 2: "time"}, "s_stft": {0: "batch", 2: "source_time"}, "spec": {0: "batch", 2: "source_time"}}),
+    }
+
+
+@torch.no_grad()
+def export_onnx(model_path: str, output_dir: str | None = None, opset: int = 17,
+                speech_tokenizer_onnx: str | None = None) -> dict:
+    """
+    Export the flow encoder (full context), the flow estimator (full context and chunk streaming masks)
+    and the HiFT upsampling stack as ONNX graphs with dynamic batch and time axes, into `<model_path>/onnx`
+    by default where `acoustic_backend="onnx"` picks them up. The speech tokenizer already comes as an
+    ONNX graph (`speech_tokenizer_v2.onnx` of CosyVoice2), `speech_tokenizer_onnx` is copied next to them.
+
+    Returns:
+        {part: path} of the written graphs.
+    """
+    output_dir = os.path.join(model_path, ONNX_DIR) if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    flow, hift = load_checkpoints(model_path)
+    flow.eval()
+    hift.eval()
+    inputs = _onnx_inputs(flow, hift, num_tokens=100)
+    paths = {}
+    for part, (module, input_names, output_names, dynamic_axes) in _onnx_graphs(flow, hift).items():
+        paths[part] = os.path.join(output_dir, ONNX_FILES[part])
+        torch.onnx.export(module, inputs[part], paths[part], input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    if speech_tokenizer_onnx is not None:
+        paths["speech_tokenizer"] = os.path.join(output_dir, ONNX_FILES["speech_tokenizer"])
+        shutil.copyfile(speech_tokenizer_onnx, paths["speech_tokenizer"])
+    return paths
+
+
+@torch.inference_mode()
+def check_onnx_parity(model_path: str, onnx_dir: str | None = None, lengths: tuple[int, ...] = (37, 250)) -> dict:
+    """
+    Max absolute difference between every exported graph run by ORT (CPU) and the eager module, on random
+    inputs of `lengths` speech tokens, which differ from the export length to exercise the dynamic axes.
+
+    Returns:
+        {part: max |diff|} over the lengths.
+    """
+    onnx_dir = os.path.join(model_path, ONNX_DIR) if onnx_dir is None else onnx_dir
+    flow, hift = load_checkpoints(model_path)
+    flow.eval()
+    hift.eval()
+    graphs = _onnx_graphs(flow, hift)
+    diffs = {}
+    for part, (module, _, _, _) in graphs.items():
+        path = os.path.join(onnx_dir, ONNX_FILES[part])
+        if not os.path.exists(path):
+            continue
+        session = create_session(path, torch.device("cpu"))
+        diffs[part] = 0.0
+        for num_tokens in lengths:
+            inputs = _onnx_inputs(flow, hift, num_tokens)[part]
+            expected = module(*inputs)
+            expected = expected if isinstance(expected, tuple) else (expected,)
+            for eager, ort in zip(expected, run_session(session, *inputs)):
+                diffs[part] = max(diffs[part], (eager.float() - torch.from_numpy(ort).float()).abs().max().item())
+    return diffs
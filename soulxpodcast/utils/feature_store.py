@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from soulxpodcast.utils.frontend import FRONTEND_VERSION, PromptFeatures
+
+# on-disk arrays of an entry, the speech tokens are optional
+FEATURE_FILES = ("log_mel", "spk_emb", "mel")
+SPEECH_TOKENS_FILE = "speech_tokens"
+
+
+def prompt_file_key(path: str) -> str:
+    """Content address of a prompt audio file: sha256 of its bytes and of the frontend version."""
+    digest = hashlib.sha256(f"frontend-{FRONTEND_VERSION}:".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PromptFeatureStore:
+    """
+    Prompt audio features (s3 log-mel, CAM++ x-vector, flow mel and the speech tokens) keyed by
+    `prompt_file_key`, so that repeated voices skip the frontend and the audio tokenizer.
+
+    Entries live in an in-process LRU of `max_entries` prompts, in front of an optional on-disk store
+    under `root`: one directory per key holding an .npy file per array, memory mapped on load. Files
+    are written through a temporary name and renamed, concurrent writers of one key agree on its content.
+
+    Args:
+        root: directory of the on-disk store, None keeps the features in memory only.
+        max_entries: prompts kept in memory, 0 disables the store.
+    """
+
+    def __init__(self, root: str | None = None, max_entries: int = 64):
+        self.root = root
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, PromptFeatures] = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _load(self, key: str) -> PromptFeatures | None:
+        if self.root is None:
+            return None
+        entry_dir = self._dir(key)
+        if not all(os.path.exists(os.path.join(entry_dir, f"{name}.npy")) for name in FEATURE_FILES):
+            return None
+        # copy-on-write maps give writable arrays without reading the files
+        arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="c") for name in FEATURE_FILES}
+        tokens_path = os.path.join(entry_dir, f"{SPEECH_TOKENS_FILE}.npy")
+        speech_tokens = np.load(tokens_path).tolist() if os.path.exists(tokens_path) else None
+        return PromptFeatures(torch.from_numpy(arrays["log_mel"]), arrays["spk_emb"].tolist(),
+                              torch.from_numpy(arrays["mel"]), speech_tokens)
+
+    def _save_array(self, entry_dir: str, name: str, array: np.ndarray):
+        path = os.path.join(entry_dir, f"{name}.npy")
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def _save(self, key: str, features: PromptFeatures):
+        entry_dir = self._dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        self._save_array(entry_dir, "log_mel", features.log_mel.float().cpu().numpy())
+        self._save_array(entry_dir, "spk_emb", np.asarray(features.spk_emb, dtype=np.float32))
+        self._save_array(entry_dir, "mel", features.mel.float().cpu().numpy())
+        if features.speech_tokens is not None:
+            self._save_array(entry_dir, SPEECH_TOKENS_FILE, np.asarray(features.speech_tokens, dtype=np.int32))
+
+    def _remember(self, key: str, features: PromptFeatures):
+        self.entries[key] = features
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> PromptFeatures | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.lookups += 1
+            features = self.entries.get(key)
+            if features is not None:
+                self.memory_hits += 1
+                self.entries.move_to_end(key)
+                return features
+        features = self._load(key)
+        if features is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, features)
+        return features
+
+    def put(self, key: str, features: PromptFeatures):
+        if not self.enabled:
+            return
+        if self.root is not None:
+            self._save(key, features)
+        with self._lock:
+            self._remember(key, features)
+
+    def clear(self):
+        """Drop the in-memory entries, the on-disk store is kept."""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": (self.memory_hits + self.disk_hits) / self.lookups if self.lookups > 0 else 0.0,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "root": self.root,
+        }
@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import torch
+import torch.nn.functional as F
+import torchaudio
+from librosa.filters import mel as librosa_mel_fn
+
+from soulxpodcast.utils.audio import audio_volume_normalize, mel_spectrogram
+from soulxpodcast.utils.speaker_embedding import SpeakerEmbedder
+
+# bump on any change of the features below, it is part of the feature store keys
+FRONTEND_VERSION = "1"
+
+S3_SAMPLE_RATE = 16000
+FLOW_SAMPLE_RATE = 24000
+# log-mel of the s3 speech tokenizer (whisper style): 400 point STFT, hop 160, 128 mels
+S3_N_FFT, S3_HOP, S3_N_MELS = 400, 160, 128
+# mel of the flow, see `mel_spectrogram`
+FLOW_N_FFT, FLOW_HOP = 1920, 480
+
+
+@dataclass
+class PromptFeatures:
+    """Features of one prompt audio."""
+    log_mel: torch.Tensor  # (128, T) s3tokenizer log-mel at 16 kHz
+    spk_emb: list[float]  # CAM++ x-vector
+    mel: torch.Tensor  # (T', 80) flow mel at 24 kHz, T' even
+    speech_tokens: list[int] | None = None  # s3 speech tokens of `log_mel`, not aligned to `mel`
+
+
+@lru_cache(maxsize=None)
+def _resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    """Resampler between two rates, its polyphase sinc kernel built once per rate pair."""
+    return torchaudio.transforms.Resample(orig_freq=orig_freq, new_freq=new_freq)
+
+
+@lru_cache(maxsize=None)
+def _s3_stft_constants() -> tuple[torch.Tensor, torch.Tensor]:
+    # the mel filters of the s3tokenizer assets are this librosa filterbank
+    filters = torch.from_numpy(librosa_mel_fn(sr=S3_SAMPLE_RATE, n_fft=S3_N_FFT, n_mels=S3_N_MELS)).float()
+    return torch.hann_window(S3_N_FFT), filters
+
+
+def _pad_batch(audios: list[torch.Tensor], reflect: int) -> torch.Tensor:
+    """Reflect pad every row by `reflect` on both sides, as a centered STFT of the row alone would, then zero pad them to one length."""
+    padded = [F.pad(audio[None, None], (reflect, reflect), mode="reflect")[0, 0] for audio in audios]
+    return torch.nn.utils.rnn.pad_sequence(padded, batch_first=True, padding_value=0.0)
+
+
+def resample(audios: list[torch.Tensor], orig_freq: int, new_freq: int) -> list[torch.Tensor]:
+    """Resample 1-D audios of one rate as a zero padded batch, the same samples as one by one."""
+    if orig_freq == new_freq:
+        return list(audios)
+    batch = torch.nn.utils.rnn.pad_sequence(audios, batch_first=True, padding_value=0.0)
+    batch = _resampler(orig_freq, new_freq)(batch)
+    return [row[:-(-audio.shape[0] * new_freq // orig_freq)] for row, audio in zip(batch, audios)]
+
+
+def s3_log_mel(audios: list[torch.Tensor]) -> list[torch.Tensor]:
+    """`s3tokenizer.log_mel_spectrogram` of 16 kHz audios, one batched STFT, the dynamic range clamped per row."""
+    window, filters = _s3_stft_constants()
+    stft = torch.stft(_pad_batch(audios, S3_N_FFT // 2), S3_N_FFT, S3_HOP, window=window, center=False, return_complex=True)
+    log_spec = torch.clamp(filters @ stft.abs() ** 2, min=1e-10).log10()
+    log_mels = []
+    for row, audio in zip(log_spec, audios):
+        row = row[:, :audio.shape[0] // S3_HOP]
+        row = torch.maximum(row, row.max() - 8.0)
+        log_mels.append((row + 4.0) / 4.0)
+    return log_mels
+
+
+def flow_mel(audios: list[torch.Tensor]) -> list[torch.Tensor]:
+    """(T, 80) `mel_spectrogram` of 24 kHz audios, one batched STFT, cut to an even number of frames."""
+    mels = mel_spectrogram(_pad_batch(audios, (FLOW_N_FFT - FLOW_HOP) // 2), pad=False)
+    outputs = []
+    for mel, audio in zip(mels, audios):
+        num_frames = audio.shape[0] // FLOW_HOP
+        outputs.append(mel[:, :num_frames - num_frames % 2].transpose(0, 1))
+    return outputs
+
+
+class AudioFrontend:
+    """
+    Prompt audio features of a request: every file is decoded and volume normalised once at its own rate,
+    then resampled to 16 kHz for the s3 log-mel and the CAM++ fbank and to 24 kHz for the flow mel, with
+    resamplers cached per rate pair. The resampling and both mel spectrograms run batched over the prompts,
+    the CAM++ x-vectors over the session pool of `spk_model`.
+
+    Args:
+        spk_model: CAM++ speaker embedder (`campplus.onnx`).
+    """
+
+    def __init__(self, spk_model: SpeakerEmbedder):
+        self.spk_model = spk_model
+
+    @staticmethod
+    def load(path: str) -> tuple[torch.Tensor, int]:
+        """First channel of the audio file, volume normalised, and its sample rate."""
+        audio, sample_rate = torchaudio.load(path, backend='soundfile')
+        return audio_volume_normalize(audio[0]), sample_rate
+
+    def speaker_embedding(self, audio: torch.Tensor) -> list[float]:
+        """CAM++ x-vector of a 16 kHz audio."""
+        return self.spk_model([audio])[0]
+
+    def _resample_all(self, audios: list[tuple[torch.Tensor, int]], new_freq: int) -> list[torch.Tensor]:
+        outputs = [None] * len(audios)
+        for rate in {rate for _, rate in audios}:
+            indices = [i for i, (_, r) in enumerate(audios) if r == rate]
+            for i, audio in zip(indices, resample([audios[i][0] for i in indices], rate, new_freq)):
+                outputs[i] = audio
+        return outputs
+
+    @torch.inference_mode()
+    def __call__(self, paths: list[str]) -> list[PromptFeatures]:
+        audios = [self.load(path) for path in paths]
+        audios_16k = self._resample_all(audios, S3_SAMPLE_RATE)
+        audios_24k = self._resample_all(audios, FLOW_SAMPLE_RATE)
+        log_mels = s3_log_mel(audios_16k)
+        mels = flow_mel(audios_24k)
+        spk_embs = self.spk_model(audios_16k)
+        return [PromptFeatures(log_mel, spk_emb, mel) for log_mel, spk_emb, mel in zip(log_mels, spk_embs, mels)]
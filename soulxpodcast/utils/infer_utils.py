@@ -13,7 +13,7 @@ from soulxpodcast.utils.commons import set_all_random_seed
 from soulxpodcast.config import Config, SoulXPodcastLLMConfig, SamplingParams
 
 
-def initiate_model(seed, model_path, llm_engine, fp16_flow):
+def initiate_model(seed, model_path, llm_engine, fp16_flow, device="auto", num_threads=0, cpu_dtype="float32"):
     set_all_random_seed(seed)
     
     hf_config = SoulXPodcastLLMConfig.from_initial_and_json(
@@ -27,10 +27,11 @@ def initiate_model(seed, model_path, llm_engine, fp16_flow):
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
             tqdm.write(f"[{timestamp}] - [WARNING]: No install VLLM, switch to hf engine.")
 
-    config = Config(model=model_path, enforce_eager=True, llm_engine=llm_engine, hf_config=hf_config)
+    config = Config(model=model_path, enforce_eager=True, llm_engine=llm_engine, hf_config=hf_config,
+                    device=device, num_threads=num_threads, cpu_dtype=cpu_dtype)
     model = SoulXPodcast(config)
 
-    dataset = PodcastInferHandler(model.llm.tokenizer, None, config)
+    dataset = PodcastInferHandler(model.llm.tokenizer, None, config, speech_tokenizer=model.tokenize_prompts)
     
     return model, dataset
 
@@ -75,6 +76,7 @@ def process_single_input(dataset, target_text_list, prompt_wav_list, prompt_text
         "prompt_mels_for_flow_ori": prompt_mels_for_flow,
         "prompt_mels_lens_for_flow": prompt_mels_lens_for_flow,
         "spk_emb_for_flow": spk_emb_for_flow,
+        "prompt_speech_tokens": data["prompt_speech_tokens"],
         "sampling_params": sampling_params,
         "spk_ids": spk_ids,
         "infos": infos,
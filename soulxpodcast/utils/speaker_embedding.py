@@ -0,0 +1,135 @@
+import queue
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import onnxruntime
+import torch
+import torchaudio.compliance.kaldi as kaldi
+
+SAMPLE_RATE = 16000
+
+
+class SpeakerEmbeddingStats:
+    """
+    Wall time of the `SpeakerEmbedder` calls, over all calls and the last `history` of them, and per
+    thread the calls not yet taken by `take_thread_calls`, so that concurrent callers see their own.
+    """
+
+    def __init__(self, history: int = 1000):
+        self.calls = 0
+        self.prompts = 0
+        self.runs = 0
+        self.total_seconds = 0.0
+        self.recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+
+    def record(self, prompts: int, runs: int, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.prompts += prompts
+            self.runs += runs
+            self.total_seconds += seconds
+            self.recent.append(seconds)
+        calls = getattr(self._thread, "calls", None)
+        if calls is None:
+            calls = self._thread.calls = []
+        calls.append({"prompts": prompts, "runs": runs, "ms": seconds * 1000})
+
+    def take_thread_calls(self) -> list[dict]:
+        """Calls made by the current thread since its last `take_thread_calls`: prompts, runs and ms of each."""
+        calls = getattr(self._thread, "calls", None) or []
+        self._thread.calls = []
+        return calls
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            last = self.recent[-1] if self.recent else 0.0
+            recent = sorted(self.recent)
+
+        def quantile(q):
+            return recent[min(len(recent) - 1, int(q * len(recent)))] * 1000 if recent else 0.0
+
+        return {
+            "calls": self.calls,
+            "prompts": self.prompts,
+            "runs": self.runs,
+            "mean_ms": self.total_seconds / self.calls * 1000 if self.calls else 0.0,
+            "p50_ms": quantile(0.5),
+            "p95_ms": quantile(0.95),
+            "max_ms": recent[-1] * 1000 if recent else 0.0,
+            "last_ms": last * 1000,
+        }
+
+
+class SpeakerEmbedder:
+    """
+    CAM++ x-vectors of 16 kHz audios over a pool of ONNX Runtime sessions.
+
+    The statistics pooling of CAM++ runs over every frame, so padded frames would move the x-vector:
+    prompts whose fbanks have the same number of frames share one batched run, the other prompts run
+    concurrently, one session each. Sessions are checked out of the pool per run, so concurrent
+    callers (e.g. API requests) share it as well.
+
+    Args:
+        model_path: path of `campplus.onnx`.
+        num_sessions: sessions of the pool, the number of runs in flight.
+        num_threads: intra-op threads of every session.
+    """
+
+    def __init__(self, model_path: str, num_sessions: int = 1, num_threads: int = 1):
+        option = onnxruntime.SessionOptions()
+        option.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        option.intra_op_num_threads = num_threads
+        self.num_sessions = max(1, num_sessions)
+        self.sessions = queue.Queue()
+        for _ in range(self.num_sessions):
+            self.sessions.put(onnxruntime.InferenceSession(model_path, sess_options=option,
+                                                           providers=["CPUExecutionProvider"]))
+        spk_input = self.sessions.queue[0].get_inputs()[0]
+        self.input_name = spk_input.name
+        # exported graphs may pin the batch to 1
+        self.batched = not isinstance(spk_input.shape[0], int) or spk_input.shape[0] != 1
+        self.executor = ThreadPoolExecutor(max_workers=self.num_sessions) if self.num_sessions > 1 else None
+        self.stats = SpeakerEmbeddingStats()
+
+    @staticmethod
+    def fbank(audio: torch.Tensor) -> torch.Tensor:
+        """(T, 80) mean normalised kaldi fbank of a 16 kHz audio."""
+        spk_feat = kaldi.fbank(audio.unsqueeze(0), num_mel_bins=80, dither=0, sample_frequency=SAMPLE_RATE)
+        return spk_feat - spk_feat.mean(dim=0, keepdim=True)
+
+    @contextmanager
+    def _session(self):
+        session = self.sessions.get()
+        try:
+            yield session
+        finally:
+            self.sessions.put(session)
+
+    def _run(self, feats: list[torch.Tensor]) -> list[list[float]]:
+        with self._session() as session:
+            outputs = session.run(None, {self.input_name: torch.stack(feats).cpu().numpy()})[0]
+        return [output.flatten().tolist() for output in outputs]
+
+    def __call__(self, audios: list[torch.Tensor]) -> list[list[float]]:
+        start_time = time.perf_counter()
+        feats = [self.fbank(audio) for audio in audios]
+        groups = {}
+        for i, feat in enumerate(feats):
+            groups.setdefault(feat.shape[0] if self.batched else i, []).append(i)
+        groups = list(groups.values())
+        batches = [[feats[i] for i in group] for group in groups]
+        if self.executor is not None and len(batches) > 1:
+            outputs = list(self.executor.map(self._run, batches))
+        else:
+            outputs = [self._run(batch) for batch in batches]
+        embeddings = [None] * len(audios)
+        for group, group_outputs in zip(groups, outputs):
+            for i, embedding in zip(group, group_outputs):
+                embeddings[i] = embedding
+        self.stats.record(len(audios), len(batches), time.perf_counter() - start_time)
+        return embeddings
@@ -110,7 +110,7 @@ def initiate_model(config: Config, enable_tn: bool=False):
 
     global dataset
     if dataset is None:
-        dataset = PodcastInferHandler(model.llm.tokenizer, None, config)
+        dataset = PodcastInferHandler(model.llm.tokenizer, None, config, speech_tokenizer=model.tokenize_prompts)
 
 _i18n_key2lang_dict = dict(
     # Speaker1 Prompt
@@ -280,6 +280,7 @@ def process_single(target_text_list, prompt_wav_list, prompt_text_list, use_dial
         "prompt_mels_for_flow_ori": prompt_mels_for_flow,
         "prompt_mels_lens_for_flow": prompt_mels_lens_for_flow,
         "spk_emb_for_flow": spk_emb_for_flow,
+        "prompt_speech_tokens": data["prompt_speech_tokens"],
         "sampling_params": sampling_params,
         "spk_ids": spk_ids,
         "infos": infos,
@@ -329,16 +330,9 @@ def dialogue_synthesis_function(
         use_dialect_prompt,
         dialect_prompt_text_list,
     )
-    results_dict = model.forward_longform(
-        **data
-    )
-    target_audio = None
-    for i in range(len(results_dict['generated_wavs'])):
-        if target_audio is None:
-            target_audio = results_dict['generated_wavs'][i]
-        else:
-            target_audio = torch.concat([target_audio, results_dict['generated_wavs'][i]], axis=1)
-    return (24000, target_audio.cpu().squeeze(0).numpy())
+    # stream every turn to the player as soon as it is rendered
+    for record in model.forward_longform_stream(**data):
+        yield (24000, record['wav'].cpu().squeeze(0).numpy())
 
 
 def update_example_choices(dialect_key: str):
@@ -444,6 +438,8 @@ def render_interface() -> gr.Blocks:
         generate_audio = gr.Audio(
             label=i18n("generated_audio_label"),
             interactive=False,
+            streaming=True,
+            autoplay=True,
         )
 
 
@@ -593,6 +589,19 @@ def get_args():
                         type=int,
                         default=1988,
                         help='random seed for generation')
+    parser.add_argument('--device',
+                        type=str,
+                        default="auto",
+                        help='device to run on: auto, cpu, cuda or cuda:N')
+    parser.add_argument('--num_threads',
+                        type=int,
+                        default=0,
+                        help='CPU intra-op threads, 0 keeps the torch default')
+    parser.add_argument('--cpu_dtype',
+                        type=str,
+                        default="float32",
+                        choices=["float32", "bfloat16"],
+                        help='compute dtype on CPU')
     parser.add_argument('--port',
                         type=int,
                         default=7860,
@@ -616,7 +625,8 @@ if __name__ == "__main__":
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S,%f')[:-3]
             tqdm.write(f"[{timestamp}] - [WARNING]: No install VLLM, switch to hf engine.")
     config = Config(model=args.model_path, enforce_eager=True, llm_engine=llm_engine,
-                    hf_config=hf_config)
+                    hf_config=hf_config, device=args.device, num_threads=args.num_threads,
+                    cpu_dtype=args.cpu_dtype)
 
     torch.manual_seed(args.seed)
     np.random.seed(args.seed)